@@ -21,6 +21,23 @@ MANAGER_USERNAME = "your_username"
 # Uses absolute path construction for stability
 DB_NAME = os.path.join(BASE_DIR, 'database', 'bot_database.db')
 
+# Local copy of the last successfully synced catalog (gzip-compressed JSON).
+# Lets the bot serve the catalog instantly after restart and during Google outages.
+CATALOG_SNAPSHOT_FILE = os.path.join(BASE_DIR, 'database', 'catalog_snapshot.json.gz')
+
+# How often (in seconds) buffered "last seen" timestamps are written to the database
+LAST_SEEN_FLUSH_INTERVAL = 5
+
+# Admin/partner roles are cached in memory and updated by the admin panel.
+# The cache is additionally reloaded from the database every ROLE_CACHE_TTL seconds (0 = never).
+ROLE_CACHE_TTL = 300
+
+# Admin statistics reports are cached for this many seconds (the report shows its age
+# and has a refresh button). Concurrent requests for the same report share one computation.
+REPORT_TTL_SUMMARY = 60          # General summary
+REPORT_TTL_TOP = 300             # Top products / top customers
+REPORT_TTL_WINDOW = 600          # 7/30/90-day reports
+
 # --- Google Sheets Settings ---
 # Name of the JSON key file (must be located in the root project folder)
 # Replace 'your-google-key.json' with your actual file name
@@ -31,6 +48,62 @@ GOOGLE_CREDENTIALS_FILE = os.path.join(BASE_DIR, 'your-google-key.json')
 SHEET_NAME_CATALOG = 'Catalog'   # Sheet with products
 SHEET_NAME_ORDERS = 'Orders'     # Sheet for new orders
 
+# 'google' - real spreadsheets; 'fake' - in-process stand-in with demo data (no network or key needed),
+# used for local testing and `python main.py --bench`. Nothing written to the fake sheets is kept.
+SHEETS_BACKEND = 'google'
+FAKE_SHEETS_LATENCY = 0.3        # Simulated latency of one request (in seconds)
+FAKE_SHEETS_ERROR_RATE = 0.0     # Share of fake requests failing with 429 (0.05 = 5%)
+
+# Google Sheets API quota shared by all sheet calls (default quota is 60 requests per minute per user).
+# Calls beyond it wait; order writes go first. 429/5xx errors are retried with exponential backoff.
+SHEETS_REQUESTS_PER_MINUTE = 60
+SHEETS_BURST = 10                # Requests allowed back-to-back before throttling starts
+SHEETS_MAX_RETRIES = 5
+SHEETS_MAX_BACKOFF = 60          # Maximum delay between retries (in seconds)
+
+# Orders are stored in the local database; the Orders sheet is a mirror updated in the background.
+# How often (in seconds) the mirror task checks for orders/statuses not yet written to the sheet.
+ORDERS_MIRROR_INTERVAL = 10
+# Order changes are queued in the database and written to the sheet in order.
+# Up to SHEETS_QUEUE_BATCH new orders go in one append_rows call; failed writes are retried
+# with exponential backoff capped at SHEETS_QUEUE_MAX_BACKOFF seconds.
+SHEETS_QUEUE_BATCH = 50
+SHEETS_QUEUE_MAX_BACKOFF = 300
+
+# --- Catalog Sync Settings ---
+# How often (in seconds) the bot checks the catalog sheet for changes.
+# The full sheet is downloaded only when Google reports a new revision.
+CATALOG_SYNC_INTERVAL = 60
+
+# --- Photo Cache Settings ---
+# Product photos are uploaded once to SYS_CHAT_ID to get a reusable file_id.
+# Telegram allows about 20 messages per minute in a group, so uploads are rate limited.
+PHOTO_UPLOADS_PER_MINUTE = 20
+PHOTO_WARM_LIMIT = 50            # Max uploads per background warm-up after a catalog sync (the rest load on first view)
+
+# --- Webhook Settings (python main.py --webhook) ---
+# Instead of long polling the bot can receive updates over HTTP. Telegram needs a public HTTPS URL,
+# usually a reverse proxy (nginx, Caddy) in front of WEBHOOK_LISTEN:WEBHOOK_PORT.
+WEBHOOK_LISTEN = '0.0.0.0'
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_URL = ''                 # Public base URL, e.g. 'https://bot.example.com' ('' = do not call setWebhook)
+WEBHOOK_SECRET = ''              # Checked against the X-Telegram-Bot-Api-Secret-Token header ('' = no check)
+WEBHOOK_WORKERS = 8              # Threads that process updates
+# Maximum number of accepted but not yet processed updates (split between workers).
+# When full, the bot answers 503 and Telegram redelivers the update later.
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_DRAIN_TIMEOUT = 30       # Seconds to finish queued updates on shutdown
+
+# --- Broadcast Settings ---
+# Telegram allows about 30 messages per second to different chats; keep some headroom.
+BROADCAST_RATE = 25              # Messages per second across all senders
+BROADCAST_WORKERS = 8            # Concurrent senders
+# Recipients are processed in batches; progress is saved after each batch,
+# so a restarted bot resumes the campaign (at most one batch may be re-sent).
+BROADCAST_BATCH = 200
+BROADCAST_MAX_RETRIES = 3        # Retries per message on 429 / network errors
+
 # --- Discount Settings ---
 DISCOUNT_QTY_THRESHOLD = 5       # Minimum quantity of liquids to trigger a discount
 DISCOUNT_PER_LIQUID = 5.0        # Discount amount per item (in currency units)
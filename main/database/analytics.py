@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+from database.database import get_db_connection
+
+# ==========================================
+#        АНАЛИТИКА ПО ЧАСАМ И ДНЯМ
+# ==========================================
+# Две таблицы-корзины с одинаковыми счетчиками:
+#   analytics_hourly (hour 'YYYY-MM-DD HH') и analytics_daily (day 'YYYY-MM-DD');
+#   orders       - оформлено заказов, amount - на какую сумму;
+#   new_users    - новых пользователей (по first_seen);
+#   active_users - уникальных пользователей за час / день (по last_seen);
+#   carts        - начатых корзин (первый товар в пустой корзине), для конверсии корзина -> заказ.
+# Счетчики растут в тех же транзакциях, что и исходные данные (insert_order, register_user,
+# save_last_seen, cart_increment), а отчет за любой период - это выборка по первичному ключу
+# в диапазоне: 90 дней = 90 строк, сколько бы истории ни накопилось.
+
+HOUR_LEN = 13   # 'YYYY-MM-DD HH'
+DAY_LEN = 10    # 'YYYY-MM-DD'
+COUNTERS = ('orders', 'amount', 'new_users', 'active_users', 'carts')
+
+def _bump(conn, table, key_column, counts):
+    """counts: {ключ корзины: {счетчик: прирост}} - один upsert на каждую корзину."""
+    for key, deltas in counts.items():
+        columns = ", ".join(deltas)
+        placeholders = ", ".join("?" * len(deltas))
+        updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in deltas)
+        conn.execute(f'''
+            INSERT INTO {table} ({key_column}, {columns}) VALUES (?, {placeholders})
+            ON CONFLICT({key_column}) DO UPDATE SET {updates}
+        ''', (key, *deltas.values()))
+
+def _inc(counts, key, counter):
+    bucket = counts.setdefault(key, {})
+    bucket[counter] = bucket.get(counter, 0) + 1
+
+def _bump_both(conn, ts, **deltas):
+    _bump(conn, 'analytics_hourly', 'hour', {ts[:HOUR_LEN]: deltas})
+    _bump(conn, 'analytics_daily', 'day', {ts[:DAY_LEN]: deltas})
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# --- Пополнение (вызывается внутри транзакций вызывающего кода) ---
+def record_order(conn, created_at, total):
+    """+1 оформленный заказ в час и день оформления."""
+    _bump_both(conn, created_at, orders=1, amount=total or 0)
+
+def record_cart_start(conn, user_id, ts=None):
+    """+1 начатая корзина, если в корзине пользователя ровно одна позиция (только что добавленная)."""
+    if conn.execute("SELECT COUNT(*) FROM cart_items WHERE user_id = ?", (user_id,)).fetchone()[0] == 1:
+        _bump_both(conn, ts or _now(), carts=1)
+
+def record_activity(conn, rows):
+    """
+    Учитывает визиты до того, как они записаны в users.
+    rows: [(user_id, username, first_seen, last_seen)].
+    Пользователь активен в часе/дне, если его сохраненный last_seen раньше начала этого часа/дня;
+    пользователя, которого еще нет в users, считаем и новым (в корзину first_seen).
+    """
+    if not rows:
+        return
+    stored = {}
+    ids = [row[0] for row in rows]
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        for r in conn.execute(f"SELECT user_id, last_seen FROM users WHERE user_id IN ({','.join('?' * len(chunk))})", chunk):
+            stored[r['user_id']] = r['last_seen'] or ''
+
+    hourly, daily = {}, {}
+    for user_id, _, first_seen, last_seen in rows:
+        if user_id not in stored:
+            _inc(hourly, (first_seen or last_seen)[:HOUR_LEN], 'new_users')
+            _inc(daily, (first_seen or last_seen)[:DAY_LEN], 'new_users')
+        previous = stored.get(user_id, '')
+        if previous[:HOUR_LEN] < last_seen[:HOUR_LEN]:
+            _inc(hourly, last_seen[:HOUR_LEN], 'active_users')
+        if previous[:DAY_LEN] < last_seen[:DAY_LEN]:
+            _inc(daily, last_seen[:DAY_LEN], 'active_users')
+    _bump(conn, 'analytics_hourly', 'hour', hourly)
+    _bump(conn, 'analytics_daily', 'day', daily)
+
+# --- Чтение ---
+def get_daily(start_day, end_day):
+    """Строки analytics_daily за [start_day, end_day] (включительно), по возрастанию дня."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT * FROM analytics_daily WHERE day >= ? AND day <= ? ORDER BY day",
+                        (start_day, end_day)).fetchall()
+    conn.close()
+    return rows
+
+def get_hourly(start_hour, end_hour):
+    """Строки analytics_hourly за [start_hour, end_hour] ('YYYY-MM-DD HH'), по возрастанию часа."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT * FROM analytics_hourly WHERE hour >= ? AND hour <= ? ORDER BY hour",
+                        (start_hour, end_hour)).fetchall()
+    conn.close()
+    return rows
+
+def get_day(day=None):
+    """Счетчики за один день (по умолчанию - сегодня)."""
+    day = day or datetime.now().strftime("%Y-%m-%d")
+    rows = get_daily(day, day)
+    return dict(rows[0]) if rows else dict.fromkeys(COUNTERS, 0)
+
+def summarize(rows, days):
+    """
+    Итоги по дневным строкам периода длиной `days` дней (дней без строк в таблице нет).
+    Активных за несколько дней складывать нельзя (один человек заходит каждый день),
+    поэтому для них - среднее и максимум в день.
+    """
+    totals = {c: sum(r[c] or 0 for r in rows) for c in COUNTERS if c != 'active_users'}
+    active = [r['active_users'] or 0 for r in rows]
+    totals['active_avg'] = sum(active) / days if days else 0
+    totals['active_max'] = max(active, default=0)
+    totals['conversion'] = totals['orders'] / totals['carts'] if totals['carts'] else None
+    return totals
+
+def get_window(days, today=None):
+    """
+    Отчет за последние `days` дней (включая сегодня) и за такой же период перед ним.
+    Возвращает (итоги, итоги прошлого периода, самый загруженный час или None, подтверждено, выручка).
+    """
+    today = today or datetime.now()
+    start = today - timedelta(days=days - 1)
+    previous_start = start - timedelta(days=days)
+    end_day, start_day = today.strftime("%Y-%m-%d"), start.strftime("%Y-%m-%d")
+
+    current = summarize(get_daily(start_day, end_day), days)
+    previous = summarize(get_daily(previous_start.strftime("%Y-%m-%d"),
+                                   (start - timedelta(days=1)).strftime("%Y-%m-%d")), days)
+
+    conn = get_db_connection()
+    peak = conn.execute('''
+        SELECT hour, orders FROM analytics_hourly WHERE hour >= ? AND hour <= ? AND orders > 0
+        ORDER BY orders DESC, hour DESC LIMIT 1
+    ''', (f"{start_day} 00", f"{end_day} 23")).fetchone()
+    confirmed, revenue = conn.execute(
+        "SELECT COALESCE(SUM(confirmed), 0), COALESCE(SUM(revenue), 0) FROM sales_daily WHERE day >= ? AND day <= ?",
+        (start_day, end_day)).fetchone()
+    conn.close()
+    return current, previous, (peak['hour'], peak['orders']) if peak else None, confirmed, revenue
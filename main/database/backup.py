@@ -0,0 +1,100 @@
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from config import DB_NAME
+
+# ==========================================
+#        БЭКАПЫ БАЗЫ ДАННЫХ
+# ==========================================
+# Копия снимается через VACUUM INTO на отдельном соединении: это согласованный снимок
+# вместе с -wal (в отличие от копирования файла), снятый в одной читающей транзакции.
+# В режиме WAL писатели при этом не блокируются, а запись в БД не перезапускает копирование
+# (как было бы у постраничного backup API). Копия сразу компактная и сжимается потоково (gzip).
+
+CHUNK_SIZE = 1024 * 1024
+
+def _snapshot(path):
+    """Снимает согласованную копию живой БД в файл path (файла еще не должно быть)."""
+    src = sqlite3.connect(DB_NAME, timeout=10)
+    try:
+        src.execute("VACUUM INTO ?", (path,))
+    finally:
+        src.close()
+
+def _compress(src_path, dst_path):
+    """Сжимает файл кусками и возвращает sha256 исходного содержимого."""
+    digest = hashlib.sha256()
+    with open(src_path, 'rb') as src, gzip.open(dst_path, 'wb', compresslevel=6) as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dst.write(chunk)
+    return digest.hexdigest()
+
+def create_backup(dest_dir=None):
+    """
+    Создает сжатую копию БД во временной (или указанной) папке.
+    Возвращает (путь к .db.gz, sha256 содержимого). Удалить файл после отправки - задача вызывающего.
+    """
+    dest_dir = dest_dir or tempfile.gettempdir()
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    name = os.path.splitext(os.path.basename(DB_NAME))[0]
+    backup_path = os.path.join(dest_dir, f"backup_{timestamp}_{name}.db.gz")
+
+    raw_path = os.path.join(tempfile.mkdtemp(dir=dest_dir), f"{name}.db")
+    try:
+        _snapshot(raw_path)
+        content_hash = _compress(raw_path, backup_path)
+    finally:
+        shutil.rmtree(os.path.dirname(raw_path), ignore_errors=True)
+    return backup_path, content_hash
+
+def verify_backup(path):
+    """
+    Проверка восстановления: распаковывает бэкап во временный файл и выполняет PRAGMA integrity_check.
+    Возвращает (ok, список сообщений integrity_check, {таблица: число строк}).
+    """
+    fd, raw_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as src, open(raw_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+        conn = sqlite3.connect(raw_path)
+        try:
+            messages = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+            ok = messages == ['ok']
+            counts = {}
+            if ok:
+                tables = [row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+                for table in tables:
+                    counts[table] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        finally:
+            conn.close()
+    except (OSError, sqlite3.DatabaseError) as e:
+        return False, [str(e)], {}
+    finally:
+        os.remove(raw_path)
+    return ok, messages, counts
+
+def print_backup_check(path):
+    """Печатает результат verify_backup (для python main.py --verify-backup <файл>)."""
+    ok, messages, counts = verify_backup(path)
+    if ok:
+        print(f"✅ {path}: integrity_check ok")
+        for table, count in counts.items():
+            print(f"    {table}: {count}")
+    else:
+        print(f"❌ {path}: бэкап поврежден")
+        for message in messages:
+            print(f"    {message}")
+    return ok
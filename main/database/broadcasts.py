@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+
+from database.database import get_db_connection, db_connection
+
+# ==========================================
+#        РАССЫЛКИ: КАМПАНИИ И ПРОГРЕСС
+# ==========================================
+# Получатели обходятся по возрастанию user_id пачками (keyset: user_id > последний обработанный),
+# после каждой пачки курсор и счетчики сохраняются одной транзакцией. После перезапуска
+# рассылка продолжается с сохраненного курсора (повторно может уйти не больше одной пачки).
+# Заблокировавшие бота помечаются users.is_blocked = 1 и пропускаются следующими рассылками;
+# пометка снимается, когда пользователь снова пишет боту (save_last_seen / register_user).
+#
+# Аудитория кампании - строка 'вид' или 'вид:параметр':
+#   all, active:<дней>, partners, buyers, non_buyers, referrals:<id партнера>.
+# Каждая аудитория - запрос по индексу, отсортированный по ключу получателя, поэтому ее можно
+# читать пачками с любого места, не загружая всех пользователей в память.
+
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_CANCELLED = 'cancelled'
+
+AUDIENCE_ALL = 'all'
+AUDIENCE_ACTIVE = 'active'
+AUDIENCE_PARTNERS = 'partners'
+AUDIENCE_BUYERS = 'buyers'
+AUDIENCE_NON_BUYERS = 'non_buyers'
+AUDIENCE_REFERRALS = 'referrals'
+
+def make_audience(kind, arg=None):
+    return kind if arg is None else f"{kind}:{arg}"
+
+def _parse_audience(audience):
+    kind, _, arg = (audience or AUDIENCE_ALL).partition(':')
+    return kind, int(arg) if arg else None
+
+def describe_audience(audience):
+    kind, arg = _parse_audience(audience)
+    return {
+        AUDIENCE_ALL: "все пользователи",
+        AUDIENCE_ACTIVE: f"активные за {arg} дн.",
+        AUDIENCE_PARTNERS: "партнеры",
+        AUDIENCE_BUYERS: "покупатели (есть заказы)",
+        AUDIENCE_NON_BUYERS: "без заказов",
+        AUDIENCE_REFERRALS: f"рефералы партнера {arg}",
+    }.get(kind, audience)
+
+def _audience_query(audience, now=None):
+    """
+    (ключ получателя, FROM ... WHERE ..., параметры, DISTINCT) для аудитории.
+    now - момент отсчета для active:<дней> (у кампании - время создания, чтобы окно не сдвигалось).
+    """
+    kind, arg = _parse_audience(audience)
+    if kind == AUDIENCE_ALL:
+        return "u.user_id", "users u WHERE u.is_blocked = 0", [], False
+    if kind == AUDIENCE_ACTIVE:
+        since = (datetime.strptime(now, "%Y-%m-%d %H:%M:%S") if now else datetime.now()) - timedelta(days=arg)
+        return "u.user_id", "users u WHERE u.is_blocked = 0 AND u.last_seen >= ?", [since.strftime("%Y-%m-%d %H:%M:%S")], False
+    if kind == AUDIENCE_PARTNERS:
+        return "u.user_id", "users u WHERE u.is_partner = 1 AND u.is_blocked = 0", [], False
+    if kind == AUDIENCE_BUYERS:
+        # Идем по индексу orders (user_id, created_at): у кого есть хоть один заказ
+        return "o.user_id", "orders o JOIN users u ON u.user_id = o.user_id WHERE u.is_blocked = 0", [], True
+    if kind == AUDIENCE_NON_BUYERS:
+        return ("u.user_id", "users u WHERE u.is_blocked = 0 AND NOT EXISTS "
+                "(SELECT 1 FROM orders o WHERE o.user_id = u.user_id)", [], False)
+    if kind == AUDIENCE_REFERRALS:
+        return ("r.referred_id", "referrals r JOIN users u ON u.user_id = r.referred_id "
+                "WHERE r.referrer_id = ? AND u.is_blocked = 0", [arg], False)
+    raise ValueError(f"Неизвестная аудитория: {audience}")
+
+def iter_audience(audience, after_user_id=0, batch=500, now=None):
+    """Получатели аудитории пачками (списками user_id) по возрастанию user_id."""
+    while True:
+        ids = next_recipients(audience, after_user_id, batch, now)
+        if not ids:
+            return
+        yield ids
+        after_user_id = ids[-1]
+
+def create_broadcast(admin_id, text, audience=AUDIENCE_ALL):
+    """Создает кампанию и возвращает ее id."""
+    with db_connection() as conn:
+        cur = conn.execute("INSERT INTO broadcasts (admin_id, text, audience, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                           (admin_id, text, audience, STATUS_RUNNING, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        return cur.lastrowid
+
+def get_broadcast(broadcast_id):
+    conn = get_db_connection()
+    row = conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+    conn.close()
+    return row
+
+def get_running_broadcasts():
+    """Незавершенные кампании (для продолжения после перезапуска)."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT * FROM broadcasts WHERE status = ? ORDER BY id", (STATUS_RUNNING,)).fetchall()
+    conn.close()
+    return rows
+
+def next_recipients(audience, after_user_id, limit, now=None):
+    """Следующая пачка получателей аудитории после after_user_id (keyset по индексу)."""
+    key, body, params, distinct = _audience_query(audience, now)
+    conn = get_db_connection()
+    rows = conn.execute(f"SELECT {'DISTINCT ' if distinct else ''}{key} FROM {body} AND {key} > ? ORDER BY {key} LIMIT ?",
+                        (*params, after_user_id, limit)).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+def count_recipients(audience, now=None):
+    """Размер аудитории (предпросмотр перед отправкой)."""
+    key, body, params, distinct = _audience_query(audience, now)
+    conn = get_db_connection()
+    count = conn.execute(f"SELECT COUNT({'DISTINCT ' if distinct else ''}{key}) FROM {body}", params).fetchone()[0]
+    conn.close()
+    return count
+
+def save_progress(broadcast_id, last_user_id, sent, failed, blocked_ids):
+    """
+    Сохраняет результат пачки: курсор, счетчики и пометки заблокировавших.
+    Возвращает текущий статус кампании (чтобы заметить отмену).
+    """
+    with db_connection() as conn:
+        conn.executemany("UPDATE users SET is_blocked = 1 WHERE user_id = ?", [(uid,) for uid in blocked_ids])
+        row = conn.execute('''
+            UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+            WHERE id = ? RETURNING status
+        ''', (last_user_id, sent, failed, len(blocked_ids), broadcast_id)).fetchone()
+    return row['status'] if row else None
+
+def finish_broadcast(broadcast_id, status=STATUS_DONE):
+    with db_connection() as conn:
+        conn.execute("UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                     (status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), broadcast_id, STATUS_RUNNING))
+
+def cancel_broadcasts():
+    """Останавливает все идущие рассылки. Возвращает их число."""
+    with db_connection() as conn:
+        cur = conn.execute("UPDATE broadcasts SET status = ?, finished_at = ? WHERE status = ?",
+                           (STATUS_CANCELLED, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), STATUS_RUNNING))
+        return cur.rowcount
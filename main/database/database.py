@@ -1,69 +1,149 @@
 import sqlite3
-from config import DB_NAME, MANAGER_ID
+import threading
+import time
+from contextlib import contextmanager
+from config import DB_NAME, MANAGER_ID, ROLE_CACHE_TTL
+from database.migrations import run_migrations
 
-def get_db_connection():
-    """Создает и настраивает соединение с базой данных для быстрой работы."""
-    conn = sqlite3.connect(DB_NAME, timeout=10, check_same_thread=False)
-    conn.execute("PRAGMA journal_mode=WAL;")
+# --- ПУЛ СОЕДИНЕНИЙ ---
+# У каждого потока одно постоянное соединение: настройки (PRAGMA) выполняются один раз,
+# а get_db_connection() на горячем пути просто возвращает готовое соединение.
+# Короткоживущие потоки (подтверждение заказа, рассылка, прогрев фото) закрывают свое соединение
+# сами (close_db_connection в finally); соединения завершившихся потоков, которые этого не сделали,
+# закрываются при открытии следующего соединения.
+_local = threading.local()
+_OWNERS = {}                # поток -> его соединение
+POOL_STATS = {'opened': 0, 'reused': 0, 'reclaimed': 0}
+_STATS_LOCK = threading.Lock()
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",    # В режиме WAL безопасно и без fsync на каждый commit
+    "PRAGMA cache_size=-16000",     # ~16 МБ кэша страниц на соединение
+    "PRAGMA mmap_size=67108864",    # 64 МБ memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Соединение из пула. close() не закрывает его, а возвращает потоку:
+    когда закрыт самый внешний "захват", незавершенная транзакция откатывается,
+    как это происходило бы при настоящем закрытии.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.depth = 0
+
+    def close(self):
+        self.depth = max(self.depth - 1, 0)
+        if self.depth == 0 and self.in_transaction:
+            self.rollback()
+
+    def close_for_real(self):
+        super().close()
+
+def _open_connection():
+    conn = sqlite3.connect(DB_NAME, timeout=10, check_same_thread=False, factory=PooledConnection)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     conn.row_factory = sqlite3.Row # Для удобного доступа к колонкам по имени
     return conn
 
+def _reclaim_dead_connections():
+    """Закрывает соединения потоков, которые завершились, не закрыв его. Вызывать под _STATS_LOCK."""
+    dead = [thread for thread in _OWNERS if not thread.is_alive()]
+    for thread in dead:
+        _OWNERS.pop(thread).close_for_real()
+    POOL_STATS['reclaimed'] += len(dead)
+
+def get_db_connection():
+    """Возвращает соединение текущего потока (создает его при первом обращении)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        with _STATS_LOCK:
+            POOL_STATS['reused'] += 1
+    else:
+        conn = _local.conn = _open_connection()
+        with _STATS_LOCK:
+            POOL_STATS['opened'] += 1
+            _reclaim_dead_connections()
+            _OWNERS[threading.current_thread()] = conn
+    conn.depth += 1
+    return conn
+
+@contextmanager
+def db_connection():
+    """
+    Контекстный менеджер над соединением потока:
+    на самом внешнем уровне фиксирует транзакцию при успехе и откатывает при ошибке.
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+        if conn.depth == 1 and conn.in_transaction:
+            conn.commit()
+    finally:
+        conn.close()
+
+def release_db_connection():
+    """
+    Сбрасывает состояние соединения потока после обработки апдейта:
+    откатывает забытую транзакцию (например, если хэндлер упал до commit/close).
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.depth = 0
+        if conn.in_transaction:
+            conn.rollback()
+
+def close_db_connection():
+    """Закрывает соединение текущего потока (в конце короткоживущих потоков и при остановке)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        with _STATS_LOCK:
+            _OWNERS.pop(threading.current_thread(), None)
+        conn.close_for_real()
+
 def init_db():
-    """Инициализация базы данных: создание таблиц и миграции."""
+    """Инициализация базы данных: применяет новые шаги миграции (см. database/migrations.py)."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY, username TEXT, first_seen TEXT, last_seen TEXT,
-            is_partner INTEGER DEFAULT 0, commission_percent REAL DEFAULT 0, balance REAL DEFAULT 0,
-            is_admin INTEGER DEFAULT 0 
-        )
-    ''')
-    
-    # Таблицы для партнерской программы
-    cursor.execute('CREATE TABLE IF NOT EXISTS referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER UNIQUE)')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS referred_orders (
-            id INTEGER PRIMARY KEY, order_id TEXT, partner_id INTEGER, buyer_id INTEGER,
-            order_amount REAL, commission_amount REAL, order_items TEXT, order_date TEXT
-        )
-    ''')
-
-    # Таблица корзины
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cart_items (
-            user_id INTEGER,
-            product_id TEXT,
-            quantity INTEGER,
-            promo_code TEXT,
-            PRIMARY KEY (user_id, product_id)
-        )
-    ''')
-
-    # Таблица промокодов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS promo_codes (
-            code TEXT PRIMARY KEY,
-            discount_percent INTEGER,
-            uses_left INTEGER
-        )
-    ''')
-
-    # Миграции (добавление новых колонок в существующие таблицы без их удаления)
     try:
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [info[1] for info in cursor.fetchall()]
-        if 'balance' not in columns: cursor.execute("ALTER TABLE users ADD COLUMN balance REAL DEFAULT 0")
-        if 'last_seen' not in columns: cursor.execute("ALTER TABLE users ADD COLUMN last_seen TEXT")
-        if 'is_admin' not in columns: cursor.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0")
-    except Exception as e:
-        print(f"Ошибка при миграции базы данных: {e}")
-        
+        run_migrations(conn)
+    finally:
+        conn.close()
+
+def get_all_user_ids():
+    """Все известные user_id (для кэша уже зарегистрированных пользователей)."""
+    conn = get_db_connection()
+    ids = [row[0] for row in conn.execute("SELECT user_id FROM users").fetchall()]
+    conn.close()
+    return ids
+
+def register_user(user_id, username, now):
+    """Добавляет нового пользователя (first_seen = now) или обновляет last_seen существующего."""
+    from database.analytics import record_activity
+    conn = get_db_connection()
+    record_activity(conn, [(user_id, username, now, now)])
+    conn.execute("INSERT OR IGNORE INTO users (user_id, username, first_seen, last_seen) VALUES (?, ?, ?, ?)",
+                 (user_id, username, now, now))
+    conn.execute("UPDATE users SET last_seen = ?, is_blocked = 0 WHERE user_id = ?", (now, user_id))
     conn.commit()
     conn.close()
 
+def save_last_seen(rows):
+    """
+    Пакетная запись времени визитов одной транзакцией.
+    rows: [(user_id, username, first_seen, last_seen)], first_seen используется только для новых строк.
+    """
+    from database.analytics import record_activity
+    with db_connection() as conn:
+        record_activity(conn, rows)
+        conn.executemany('''
+            INSERT INTO users (user_id, username, first_seen, last_seen) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET last_seen = excluded.last_seen, is_blocked = 0
+        ''', rows)
+
 def get_cart_items(user_id):
     """Получает товары в корзине пользователя из БД в формате словаря {id: qty}."""
     conn = get_db_connection()
@@ -73,25 +153,162 @@ def get_cart_items(user_id):
     conn.close()
     return {item['product_id']: item['quantity'] for item in items}
 
-def is_partner(user_id):
-    """Проверяет, является ли пользователь партнером."""
+# --- КОРЗИНА ---
+# Каждое нажатие кнопки - один атомарный оператор: проверка остатка идет внутри SQL,
+# поэтому двойное нажатие не пробьет лимит, а промокод строки не затирается.
+# Функции возвращают новое количество товара в корзине.
+
+def cart_increment(user_id, product_id, stock):
+    """+1 к товару (или добавление в корзину). Возвращает новое количество или None, если остаток исчерпан."""
+    from database.analytics import record_cart_start
+    if stock <= 0:
+        return None
+    with db_connection() as conn:
+        # Новая строка наследует промокод, уже примененный к корзине
+        row = conn.execute('''
+            INSERT INTO cart_items (user_id, product_id, quantity, promo_code)
+            VALUES (?, ?, 1, (SELECT promo_code FROM cart_items WHERE user_id = ? AND promo_code IS NOT NULL LIMIT 1))
+            ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + 1 WHERE quantity < ?
+            RETURNING quantity
+        ''', (user_id, product_id, user_id, stock)).fetchone()
+        if row and row['quantity'] == 1:
+            record_cart_start(conn, user_id)
+    return row['quantity'] if row else None
+
+def cart_decrement(user_id, product_id):
+    """-1 к товару; последняя штука удаляет строку. Возвращает новое количество (0 - товар удален)."""
+    with db_connection() as conn:
+        row = conn.execute('''
+            UPDATE cart_items SET quantity = quantity - 1
+            WHERE user_id = ? AND product_id = ? AND quantity > 1
+            RETURNING quantity
+        ''', (user_id, product_id)).fetchone()
+        if row:
+            return row['quantity']
+        conn.execute("DELETE FROM cart_items WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+    return 0
+
+def cart_remove(user_id, product_id):
+    """Удаляет товар из корзины. Возвращает 0."""
+    with db_connection() as conn:
+        conn.execute("DELETE FROM cart_items WHERE user_id = ? AND product_id = ?", (user_id, product_id))
+    return 0
+
+def cart_clear(user_id, conn=None):
+    """Очищает корзину (в транзакции вызывающего кода, если передано conn)."""
+    if conn is not None:
+        conn.execute("DELETE FROM cart_items WHERE user_id = ?", (user_id,))
+        return
+    with db_connection() as conn:
+        cart_clear(user_id, conn)
+
+# --- КЭШ РОЛЕЙ ---
+# Роли меняются только через админку, поэтому держим их в памяти:
+# is_admin / is_partner становятся проверкой по множеству, а не запросом к БД.
+# Админ-хэндлеры обновляют кэш сразу (set_partner / remove_partner / set_admin),
+# TTL - страховка на случай ручной правки базы.
+_ROLES = {'admins': frozenset(), 'partners': frozenset(), 'loaded_at': 0.0}
+_ROLES_LOCK = threading.Lock()
+
+def load_role_cache():
+    """(Пере)загружает кэш ролей из БД."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_partner FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
+    rows = conn.execute("SELECT user_id, is_admin, is_partner FROM users WHERE is_admin = 1 OR is_partner = 1").fetchall()
     conn.close()
-    return result and result['is_partner'] == 1
+    with _ROLES_LOCK:
+        _ROLES['admins'] = frozenset(r['user_id'] for r in rows if r['is_admin'] == 1)
+        _ROLES['partners'] = frozenset(r['user_id'] for r in rows if r['is_partner'] == 1)
+        _ROLES['loaded_at'] = time.time()
+
+def _roles():
+    if ROLE_CACHE_TTL and time.time() - _ROLES['loaded_at'] > ROLE_CACHE_TTL:
+        load_role_cache()
+    return _ROLES
+
+def _update_role(role, user_id, enabled):
+    with _ROLES_LOCK:
+        members = set(_ROLES[role])
+        if enabled:
+            members.add(user_id)
+        else:
+            members.discard(user_id)
+        _ROLES[role] = frozenset(members)
+
+def is_partner(user_id):
+    """Проверяет, является ли пользователь партнером."""
+    return user_id in _roles()['partners']
 
 def is_admin(user_id):
     """Проверяет, является ли пользователь администратором."""
     # Главный админ (из конфига) всегда имеет доступ
     if user_id == MANAGER_ID:
         return True
-        
+    return user_id in _roles()['admins']
+
+def set_partner(user_id, commission_percent):
+    """Делает пользователя партнером с указанным процентом."""
+    with db_connection() as conn:
+        conn.execute("UPDATE users SET is_partner = 1, commission_percent = ? WHERE user_id = ?", (commission_percent, user_id))
+    _update_role('partners', user_id, True)
+
+def remove_partner(user_id):
+    """Снимает статус партнера."""
+    with db_connection() as conn:
+        conn.execute("UPDATE users SET is_partner = 0, commission_percent = 0 WHERE user_id = ?", (user_id,))
+    _update_role('partners', user_id, False)
+
+def set_admin(user_id):
+    """Выдает права администратора. Возвращает False, если пользователя нет в БД."""
+    with db_connection() as conn:
+        updated = conn.execute("UPDATE users SET is_admin = 1 WHERE user_id = ?", (user_id,)).rowcount
+    if updated:
+        _update_role('admins', user_id, True)
+    return bool(updated)
+
+def get_cached_photo(url):
+    """Возвращает file_id фото для URL из кэша или None."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_admin FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
+    row = conn.execute("SELECT file_id FROM photo_cache WHERE url = ?", (url,)).fetchone()
+    conn.close()
+    return row['file_id'] if row else None
+
+def get_cached_photo_by_hash(content_hash):
+    """Ищет уже загруженное фото с таким же содержимым (одинаковая картинка под разными URL)."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT file_id FROM photo_cache WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone()
+    conn.close()
+    return row['file_id'] if row else None
+
+def save_cached_photo(url, content_hash, file_id):
+    conn = get_db_connection()
+    conn.execute("INSERT OR REPLACE INTO photo_cache (url, content_hash, file_id, updated_at) VALUES (?, ?, ?, datetime('now'))",
+                 (url, content_hash, file_id))
+    conn.commit()
+    conn.close()
+
+def delete_cached_photos(urls):
+    """Удаляет записи кэша фото для переданных URL."""
+    conn = get_db_connection()
+    conn.executemany("DELETE FROM photo_cache WHERE url = ?", [(u,) for u in urls])
+    conn.commit()
+    conn.close()
+
+def delete_cached_photo_content(url):
+    """
+    Удаляет запись URL и все записи с тем же содержимым (они ссылаются на тот же file_id).
+    Возвращает список удаленных URL.
+    """
+    with db_connection() as conn:
+        row = conn.execute("SELECT content_hash FROM photo_cache WHERE url = ?", (url,)).fetchone()
+        urls = [url]
+        if row and row['content_hash']:
+            urls += [r['url'] for r in conn.execute("DELETE FROM photo_cache WHERE content_hash = ? RETURNING url",
+                                                    (row['content_hash'],)).fetchall()]
+        conn.execute("DELETE FROM photo_cache WHERE url = ?", (url,))
+    return list(dict.fromkeys(urls))
+
+def get_cached_photo_urls():
+    conn = get_db_connection()
+    urls = [row['url'] for row in conn.execute("SELECT url FROM photo_cache").fetchall()]
     conn.close()
-    
-    return result and result['is_admin'] == 1
\ No newline at end of file
+    return urls
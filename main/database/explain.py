@@ -0,0 +1,164 @@
+from database.database import get_db_connection
+
+# ==========================================
+#        ДИАГНОСТИКА ПЛАНОВ ЗАПРОСОВ
+# ==========================================
+# Все SQL-запросы хэндлеров и фоновых задач. При добавлении нового запроса
+# добавьте его сюда - `python main.py --explain` покажет, не сканирует ли он таблицу целиком.
+# allow_scan=True - полный проход ожидаем (подсчет всех строк, выгрузка всего списка и т.п.).
+
+QUERIES = [
+    # Пользователи
+    ("users.get", "SELECT * FROM users WHERE user_id = ?", False),
+    ("users.balance", "SELECT balance FROM users WHERE user_id = ?", False),
+    ("users.partner_info", "SELECT commission_percent, balance, username FROM users WHERE user_id = ?", False),
+    ("users.register", "INSERT OR IGNORE INTO users (user_id, username, first_seen, last_seen) VALUES (?, ?, ?, ?)", False),
+    ("users.touch", "UPDATE users SET last_seen = ?, is_blocked = 0 WHERE user_id = ?", False),
+    ("users.last_seen_batch", "INSERT INTO users (user_id, username, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                              "ON CONFLICT(user_id) DO UPDATE SET last_seen = excluded.last_seen, is_blocked = 0", False),
+    ("users.balance_add", "UPDATE users SET balance = balance + ? WHERE user_id = ?", False),
+    ("users.set_partner", "UPDATE users SET is_partner = 1, commission_percent = ? WHERE user_id = ?", False),
+    ("users.set_admin", "UPDATE users SET is_admin = 1 WHERE user_id = ?", False),
+    ("users.last_seen_many", "SELECT user_id, last_seen FROM users WHERE user_id IN (?, ?, ?)", False),
+    ("users.partners_count", "SELECT COUNT(*) FROM users WHERE is_partner = 1", False),
+    ("users.partners_page", "SELECT user_id, username, commission_percent FROM users WHERE is_partner = 1 LIMIT ? OFFSET ?", False),
+    ("users.count", "SELECT COUNT(*) FROM users", True),
+    ("users.page", "SELECT user_id, username, is_partner FROM users LIMIT ? OFFSET ?", True),
+    ("users.all_ids", "SELECT user_id FROM users", True),
+    ("users.roles", "SELECT user_id, is_admin, is_partner FROM users WHERE is_admin = 1 OR is_partner = 1", True),
+
+    # Рефералы
+    ("referrals.add", "INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)", False),
+    ("referrals.count", "SELECT COUNT(id) FROM referrals WHERE referrer_id = ?", False),
+    ("referrals.referrer", "SELECT referrer_id FROM referrals WHERE referred_id = ?", False),
+    ("referred_orders.by_order", "SELECT partner_id, order_amount FROM referred_orders WHERE order_id = ?", False),
+    ("referred_orders.set_commission", "UPDATE referred_orders SET commission_amount = ? WHERE order_id = ?", False),
+    ("referred_orders.commission", "SELECT partner_id, commission_amount FROM referred_orders WHERE order_id = ?", False),
+    ("users.reverse_commission", "UPDATE users SET balance = balance - ? WHERE user_id = ?", False),
+    ("referred_orders.partner_stats", "SELECT COUNT(id), SUM(order_amount), SUM(commission_amount) FROM referred_orders WHERE partner_id = ?", False),
+
+    # Корзина
+    ("cart.items", "SELECT product_id, quantity FROM cart_items WHERE user_id = ?", False),
+    ("cart.promo", "SELECT DISTINCT promo_code FROM cart_items WHERE user_id = ? AND promo_code IS NOT NULL", False),
+    ("cart.set_promo", "UPDATE cart_items SET promo_code = ? WHERE user_id = ?", False),
+    ("cart.increment", "INSERT INTO cart_items (user_id, product_id, quantity, promo_code) "
+                       "VALUES (?, ?, 1, (SELECT promo_code FROM cart_items WHERE user_id = ? AND promo_code IS NOT NULL LIMIT 1)) "
+                       "ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + 1 WHERE quantity < ? "
+                       "RETURNING quantity", False),
+    ("cart.decrement", "UPDATE cart_items SET quantity = quantity - 1 WHERE user_id = ? AND product_id = ? AND quantity > 1 "
+                       "RETURNING quantity", False),
+    ("cart.remove", "DELETE FROM cart_items WHERE user_id = ? AND product_id = ?", False),
+    ("cart.clear", "DELETE FROM cart_items WHERE user_id = ?", False),
+
+    # Заказы
+    ("orders.get", "SELECT * FROM orders WHERE order_id = ?", False),
+    ("orders.items", "SELECT product_id, name, quantity FROM order_items WHERE order_id = ?", False),
+    ("orders.status", "SELECT status FROM orders WHERE order_id = ?", False),
+    ("orders.set_status", "UPDATE orders SET status = ? WHERE order_id = ? AND status = ?", False),
+    ("orders.by_user", "SELECT order_id, total, status, created_at FROM orders WHERE user_id = ? ORDER BY created_at DESC", False),
+    ("orders.mark_synced", "UPDATE orders SET sheet_synced = 1, sheet_status = ? WHERE order_id = ?", False),
+    ("orders.count", "SELECT COUNT(*) FROM orders", True),
+    ("orders.sales_source", "SELECT user_id, total, created_at FROM orders WHERE order_id = ?", False),
+
+    # Агрегаты продаж
+    ("sales.daily_placed", "INSERT INTO sales_daily (day, placed) VALUES (?, 1) ON CONFLICT(day) DO UPDATE SET placed = placed + 1", False),
+    ("sales.products_add", "INSERT INTO sales_products (product_id, name, units, revenue) "
+                           "SELECT product_id, name, ? * quantity, ? * COALESCE(price, 0) * quantity FROM order_items WHERE order_id = ? "
+                           "ON CONFLICT(product_id) DO UPDATE SET name = excluded.name, "
+                           "units = units + excluded.units, revenue = revenue + excluded.revenue", False),
+    ("sales.totals_placed", "UPDATE sales_totals SET placed = placed + 1 WHERE id = 1", False),
+    ("sales.totals", "SELECT placed, confirmed, revenue FROM sales_totals WHERE id = 1", False),
+    ("sales.top_products", "SELECT product_id, name, units FROM sales_products WHERE units > 0 ORDER BY units DESC LIMIT ?", False),
+    ("sales.top_customers", "SELECT user_id, spent FROM sales_customers WHERE orders > 0 ORDER BY spent DESC LIMIT ?", False),
+
+    # Почасовая и дневная аналитика
+    ("analytics.hourly_add", "INSERT INTO analytics_hourly (hour, orders, amount) VALUES (?, ?, ?) "
+                             "ON CONFLICT(hour) DO UPDATE SET orders = orders + excluded.orders, amount = amount + excluded.amount", False),
+    ("analytics.daily_add", "INSERT INTO analytics_daily (day, active_users) VALUES (?, ?) "
+                            "ON CONFLICT(day) DO UPDATE SET active_users = active_users + excluded.active_users", False),
+    ("analytics.cart_size", "SELECT COUNT(*) FROM cart_items WHERE user_id = ?", False),
+    ("analytics.daily_range", "SELECT * FROM analytics_daily WHERE day >= ? AND day <= ? ORDER BY day", False),
+    ("analytics.hourly_range", "SELECT * FROM analytics_hourly WHERE hour >= ? AND hour <= ? ORDER BY hour", False),
+    ("analytics.peak_hour", "SELECT hour, orders FROM analytics_hourly WHERE hour >= ? AND hour <= ? AND orders > 0 "
+                            "ORDER BY orders DESC, hour DESC LIMIT 1", False),
+    ("analytics.sales_range", "SELECT COALESCE(SUM(confirmed), 0), COALESCE(SUM(revenue), 0) FROM sales_daily WHERE day >= ? AND day <= ?", False),
+
+    # Рассылки
+    # Аудитории: пачка получателей после курсора и предпросмотр размера
+    ("audience.all", "SELECT u.user_id FROM users u WHERE u.is_blocked = 0 AND u.user_id > ? ORDER BY u.user_id LIMIT ?", False),
+    ("audience.active", "SELECT u.user_id FROM users u WHERE u.is_blocked = 0 AND u.last_seen >= ? "
+                        "AND u.user_id > ? ORDER BY u.user_id LIMIT ?", False),
+    ("audience.partners", "SELECT u.user_id FROM users u WHERE u.is_partner = 1 AND u.is_blocked = 0 "
+                          "AND u.user_id > ? ORDER BY u.user_id LIMIT ?", False),
+    ("audience.buyers", "SELECT DISTINCT o.user_id FROM orders o JOIN users u ON u.user_id = o.user_id "
+                        "WHERE u.is_blocked = 0 AND o.user_id > ? ORDER BY o.user_id LIMIT ?", False),
+    ("audience.non_buyers", "SELECT u.user_id FROM users u WHERE u.is_blocked = 0 AND NOT EXISTS "
+                            "(SELECT 1 FROM orders o WHERE o.user_id = u.user_id) AND u.user_id > ? ORDER BY u.user_id LIMIT ?", False),
+    ("audience.referrals", "SELECT r.referred_id FROM referrals r JOIN users u ON u.user_id = r.referred_id "
+                           "WHERE r.referrer_id = ? AND u.is_blocked = 0 AND r.referred_id > ? ORDER BY r.referred_id LIMIT ?", False),
+    ("audience.count_all", "SELECT COUNT(u.user_id) FROM users u WHERE u.is_blocked = 0", True),
+    ("audience.count_active", "SELECT COUNT(u.user_id) FROM users u WHERE u.is_blocked = 0 AND u.last_seen >= ?", False),
+    ("audience.count_partners", "SELECT COUNT(u.user_id) FROM users u WHERE u.is_partner = 1 AND u.is_blocked = 0", False),
+    # Покупатели и "без заказов" считаются проходом по индексу orders (user_id, ...) / по всем пользователям
+    ("audience.count_buyers", "SELECT COUNT(DISTINCT o.user_id) FROM orders o JOIN users u ON u.user_id = o.user_id "
+                              "WHERE u.is_blocked = 0", True),
+    ("audience.count_non_buyers", "SELECT COUNT(u.user_id) FROM users u WHERE u.is_blocked = 0 AND NOT EXISTS "
+                                  "(SELECT 1 FROM orders o WHERE o.user_id = u.user_id)", True),
+    ("audience.count_referrals", "SELECT COUNT(r.referred_id) FROM referrals r JOIN users u ON u.user_id = r.referred_id "
+                                 "WHERE r.referrer_id = ? AND u.is_blocked = 0", False),
+    ("broadcasts.mark_blocked", "UPDATE users SET is_blocked = 1 WHERE user_id = ?", False),
+    ("broadcasts.progress", "UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ? "
+                            "WHERE id = ? RETURNING status", False),
+    ("broadcasts.running", "SELECT * FROM broadcasts WHERE status = ? ORDER BY id", False),
+    ("broadcasts.cancel", "UPDATE broadcasts SET status = ?, finished_at = ? WHERE status = ?", False),
+
+    # Очередь записей в таблицу заказов
+    ("sheet_queue.add", "INSERT INTO sheet_queue (kind, order_id, created_at) VALUES (?, ?, ?)", False),
+    # Проход по rowid с LIMIT - читаются только первые строки
+    ("sheet_queue.head", "SELECT * FROM sheet_queue ORDER BY id LIMIT ?", True),
+    ("sheet_queue.done", "DELETE FROM sheet_queue WHERE id = ?", False),
+    ("sheet_queue.count", "SELECT COUNT(*) FROM sheet_queue", True),
+
+    # Промокоды
+    ("promo.active", "SELECT discount_percent FROM promo_codes WHERE code = ? AND uses_left > 0", False),
+    ("promo.use", "UPDATE promo_codes SET uses_left = uses_left - 1 WHERE code = ?", False),
+    ("promo.delete", "DELETE FROM promo_codes WHERE code = ?", False),
+    ("promo.list", "SELECT code, discount_percent, uses_left FROM promo_codes", True),
+
+    # Кэш фото
+    ("photo_cache.by_url", "SELECT file_id FROM photo_cache WHERE url = ?", False),
+    ("photo_cache.by_hash", "SELECT file_id FROM photo_cache WHERE content_hash = ? LIMIT 1", False),
+    ("photo_cache.hash_by_url", "SELECT content_hash FROM photo_cache WHERE url = ?", False),
+    ("photo_cache.delete_by_hash", "DELETE FROM photo_cache WHERE content_hash = ? RETURNING url", False),
+    ("photo_cache.urls", "SELECT url FROM photo_cache", True),
+]
+
+def _is_full_scan(detail):
+    # "SCAN users" - полный проход; "SCAN ... USING (COVERING) INDEX" - проход по индексу
+    return detail.startswith('SCAN') and 'USING' not in detail
+
+def explain_queries():
+    """Печатает EXPLAIN QUERY PLAN для каждого запроса. Возвращает список неожиданных полных сканов."""
+    conn = get_db_connection()
+    problems = []
+    try:
+        for name, sql, allow_scan in QUERIES:
+            params = (None,) * sql.count('?')
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            details = [row['detail'] for row in plan]
+            scans = [d for d in details if _is_full_scan(d)]
+            mark = "⚠️" if scans and not allow_scan else "✅"
+            print(f"{mark} {name}")
+            print(f"    {sql}")
+            for d in details:
+                print(f"    -> {d}")
+            if scans and not allow_scan:
+                problems.append(name)
+    finally:
+        conn.close()
+
+    if problems:
+        print(f"\n⚠️ Полный скан таблицы в {len(problems)} запросах: {', '.join(problems)}")
+    else:
+        print("\n✅ Неожиданных полных сканов нет.")
+    return problems
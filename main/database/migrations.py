@@ -0,0 +1,256 @@
+from datetime import datetime
+
+# ==========================================
+#        МИГРАЦИИ СХЕМЫ БД
+# ==========================================
+# Каждый шаг выполняется один раз, в своей транзакции, номер примененной версии
+# хранится в таблице schema_version. Новые изменения схемы - только новым шагом
+# в конце списка MIGRATIONS (уже примененные шаги не редактируем).
+
+def _base_tables(conn):
+    # Таблица пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY, username TEXT, first_seen TEXT, last_seen TEXT,
+            is_partner INTEGER DEFAULT 0, commission_percent REAL DEFAULT 0, balance REAL DEFAULT 0,
+            is_admin INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Таблицы для партнерской программы
+    conn.execute('CREATE TABLE IF NOT EXISTS referrals (id INTEGER PRIMARY KEY, referrer_id INTEGER, referred_id INTEGER UNIQUE)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS referred_orders (
+            id INTEGER PRIMARY KEY, order_id TEXT, partner_id INTEGER, buyer_id INTEGER,
+            order_amount REAL, commission_amount REAL, order_items TEXT, order_date TEXT
+        )
+    ''')
+
+    # Таблица корзины
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cart_items (
+            user_id INTEGER,
+            product_id TEXT,
+            quantity INTEGER,
+            promo_code TEXT,
+            PRIMARY KEY (user_id, product_id)
+        )
+    ''')
+
+    # Таблица промокодов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS promo_codes (
+            code TEXT PRIMARY KEY,
+            discount_percent INTEGER,
+            uses_left INTEGER
+        )
+    ''')
+
+def _legacy_user_columns(conn):
+    # Колонки, добавленные в users после первых версий бота
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if 'balance' not in columns: conn.execute("ALTER TABLE users ADD COLUMN balance REAL DEFAULT 0")
+    if 'last_seen' not in columns: conn.execute("ALTER TABLE users ADD COLUMN last_seen TEXT")
+    if 'is_admin' not in columns: conn.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0")
+
+def _photo_cache(conn):
+    # Кэш file_id фотографий товаров в Telegram (чтобы не загружать фото по URL каждый раз)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS photo_cache (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT,
+            file_id TEXT,
+            updated_at TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_photo_cache_hash ON photo_cache (content_hash)")
+
+def _lookup_indexes(conn):
+    # Индексы для запросов хэндлеров, которые раньше сканировали таблицы целиком
+    # (referrer_id, referred_id): и поиск рефералов партнера, и выборка их по порядку для рассылок
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer_referred ON referrals (referrer_id, referred_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_referred_orders_order ON referred_orders (order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_referred_orders_partner ON referred_orders (partner_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_first_seen ON users (first_seen)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_partners ON users (user_id) WHERE is_partner = 1")
+
+def _orders(conn):
+    # Заказы: SQLite - основное хранилище, Google Таблица - зеркало.
+    # sheet_synced = 1, когда строка заказа есть в таблице; sheet_status - последний записанный туда статус.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            username TEXT,
+            total REAL,
+            status TEXT,
+            delivery TEXT,
+            payment TEXT,
+            promo_code TEXT,
+            discount REAL DEFAULT 0,
+            created_at TEXT,
+            sheet_synced INTEGER DEFAULT 0,
+            sheet_status TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id TEXT,
+            product_id TEXT,
+            name TEXT,
+            price INTEGER,
+            quantity INTEGER,
+            PRIMARY KEY (order_id, product_id)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)")
+
+def _sheet_queue(conn):
+    # Очередь записей в Google Таблицу заказов: пишется в одной транзакции с заказом,
+    # фоновая задача разбирает её строго по порядку id (см. utils/orders_mirror.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sheet_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            order_id TEXT,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT,
+            payload TEXT
+        )
+    ''')
+    # Переносим то, что ещё не попало в таблицу по флагам sheet_synced / sheet_status
+    conn.execute('''
+        INSERT INTO sheet_queue (kind, order_id, created_at)
+        SELECT 'append', order_id, created_at FROM orders WHERE sheet_synced = 0 ORDER BY created_at
+    ''')
+    conn.execute('''
+        INSERT INTO sheet_queue (kind, order_id, created_at)
+        SELECT 'status', order_id, created_at FROM orders WHERE sheet_synced = 1 AND sheet_status IS NOT status
+    ''')
+
+def _sales_aggregates(conn):
+    # Готовые суммы для экранов статистики (см. database/sales.py)
+    conn.execute("CREATE TABLE IF NOT EXISTS sales_daily (day TEXT PRIMARY KEY, placed INTEGER DEFAULT 0, confirmed INTEGER DEFAULT 0, revenue REAL DEFAULT 0)")
+    conn.execute("CREATE TABLE IF NOT EXISTS sales_products (product_id TEXT PRIMARY KEY, name TEXT, units INTEGER DEFAULT 0, revenue REAL DEFAULT 0)")
+    conn.execute("CREATE TABLE IF NOT EXISTS sales_customers (user_id INTEGER PRIMARY KEY, orders INTEGER DEFAULT 0, spent REAL DEFAULT 0)")
+    conn.execute("CREATE TABLE IF NOT EXISTS sales_totals (id INTEGER PRIMARY KEY CHECK (id = 1), placed INTEGER DEFAULT 0, confirmed INTEGER DEFAULT 0, revenue REAL DEFAULT 0)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_products_units ON sales_products (units)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_customers_spent ON sales_customers (spent)")
+    # Заполняем по уже накопленной истории заказов. SQL зафиксирован здесь, а не берется
+    # из database/sales.py: миграция должна делать то же самое, как бы ни менялся код приложения
+    conn.execute('''
+        INSERT INTO sales_daily (day, placed, confirmed, revenue)
+        SELECT substr(created_at, 1, 10), COUNT(*),
+               SUM(status = 'Подтверждён'), COALESCE(SUM(CASE WHEN status = 'Подтверждён' THEN total END), 0)
+        FROM orders GROUP BY substr(created_at, 1, 10)
+    ''')
+    conn.execute('''
+        INSERT INTO sales_customers (user_id, orders, spent)
+        SELECT user_id, COUNT(*), COALESCE(SUM(total), 0) FROM orders WHERE status = 'Подтверждён' GROUP BY user_id
+    ''')
+    conn.execute('''
+        INSERT INTO sales_products (product_id, name, units, revenue)
+        SELECT oi.product_id, MAX(oi.name), SUM(oi.quantity), SUM(COALESCE(oi.price, 0) * oi.quantity)
+        FROM orders o JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.status = 'Подтверждён' GROUP BY oi.product_id
+    ''')
+    conn.execute('''
+        INSERT INTO sales_totals (id, placed, confirmed, revenue)
+        SELECT 1, COALESCE(SUM(placed), 0), COALESCE(SUM(confirmed), 0), COALESCE(SUM(revenue), 0) FROM sales_daily
+    ''')
+
+def _analytics(conn):
+    # Почасовые и дневные счетчики для отчетов за период (см. database/analytics.py)
+    for table, key_column in (('analytics_hourly', 'hour'), ('analytics_daily', 'day')):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key_column} TEXT PRIMARY KEY, orders INTEGER DEFAULT 0, amount REAL DEFAULT 0,
+                new_users INTEGER DEFAULT 0, active_users INTEGER DEFAULT 0, carts INTEGER DEFAULT 0
+            )
+        ''')
+        # Заполняем по накопленным данным (SQL зафиксирован здесь, как и в миграции 7).
+        # Заказы и новые пользователи восстанавливаются полностью; из активности известен
+        # только последний визит каждого пользователя, начатые корзины не восстанавливаются.
+        length = 13 if key_column == 'hour' else 10    # 'YYYY-MM-DD HH' / 'YYYY-MM-DD'
+        conn.execute(f'''
+            INSERT INTO {table} ({key_column}, orders, amount)
+            SELECT substr(created_at, 1, {length}), COUNT(*), COALESCE(SUM(total), 0)
+            FROM orders WHERE created_at IS NOT NULL GROUP BY 1
+        ''')
+        for column, counter in (('first_seen', 'new_users'), ('last_seen', 'active_users')):
+            conn.execute(f'''
+                INSERT INTO {table} ({key_column}, {counter})
+                SELECT substr({column}, 1, {length}), COUNT(*)
+                FROM users WHERE {column} IS NOT NULL GROUP BY 1
+                ON CONFLICT({key_column}) DO UPDATE SET {counter} = {counter} + excluded.{counter}
+            ''')
+
+def _broadcasts(conn):
+    # Рассылки с сохранением прогресса и пометка заблокировавших бота (см. database/broadcasts.py)
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if 'is_blocked' not in columns: conn.execute("ALTER TABLE users ADD COLUMN is_blocked INTEGER DEFAULT 0")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            text TEXT,
+            status TEXT,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            created_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)")
+
+def _broadcast_audiences(conn):
+    # Сегменты рассылок: аудитория кампании и индекс для выборки активных получателей
+    columns = [info[1] for info in conn.execute("PRAGMA table_info(broadcasts)").fetchall()]
+    if 'audience' not in columns: conn.execute("ALTER TABLE broadcasts ADD COLUMN audience TEXT DEFAULT 'all'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen)")
+
+# (версия, описание, функция шага)
+MIGRATIONS = [
+    (1, "Базовые таблицы", _base_tables),
+    (2, "Колонки balance / last_seen / is_admin в users", _legacy_user_columns),
+    (3, "Кэш file_id фотографий", _photo_cache),
+    (4, "Индексы для рефералов, партнерских заказов и новых пользователей", _lookup_indexes),
+    (5, "Заказы и позиции заказов", _orders),
+    (6, "Очередь записей в таблицу заказов", _sheet_queue),
+    (7, "Агрегаты продаж для статистики", _sales_aggregates),
+    (8, "Почасовая и дневная аналитика", _analytics),
+    (9, "Рассылки и пометка заблокировавших бота", _broadcasts),
+    (10, "Сегменты аудитории рассылок", _broadcast_audiences),
+]
+
+def get_schema_version(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at TEXT)")
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def run_migrations(conn):
+    """Применяет все новые шаги миграции по порядку. Возвращает список примененных версий."""
+    if conn.in_transaction:
+        conn.commit()
+    current = get_schema_version(conn)
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                         (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"❌ Ошибка миграции {version} ({description})")
+            raise
+        print(f"--- 🔧 Миграция {version}: {description} ---")
+        applied.append(version)
+    return applied
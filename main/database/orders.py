@@ -0,0 +1,167 @@
+from collections import Counter
+from datetime import datetime
+
+from database.database import get_db_connection, db_connection
+from database.sheet_queue import enqueue_sheet_job, JOB_APPEND, JOB_STATUS
+from database.sales import count_new_order, apply_order_sales
+from database.analytics import record_order
+
+# ==========================================
+#        ЗАКАЗЫ (основное хранилище)
+# ==========================================
+# Заказы пишутся в SQLite в одной транзакции с оформлением, вместе с заданием
+# в очереди sheet_queue. Google Таблица заказов - зеркало, которое догоняет фоновая задача (utils/orders_mirror.py).
+
+STATUS_NEW = 'Оформлен'
+STATUS_CONFIRMED = 'Подтверждён'
+STATUS_CANCELLED = 'Отменён'
+
+def insert_order(conn, order_id, user_id, username, items, total, delivery, payment,
+                 promo_code=None, discount=0.0, created_at=None, status=STATUS_NEW, sheet_synced=0):
+    """
+    Добавляет заказ в рамках транзакции вызывающего кода.
+    items: [(product_id, name, price, quantity)]
+    """
+    created_at = created_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute('''
+        INSERT INTO orders (order_id, user_id, username, total, status, delivery, payment,
+                            promo_code, discount, created_at, sheet_synced, sheet_status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (order_id, user_id, username, total, status, delivery, payment,
+          promo_code, discount, created_at, sheet_synced, status if sheet_synced else None))
+    conn.executemany("INSERT INTO order_items (order_id, product_id, name, price, quantity) VALUES (?, ?, ?, ?, ?)",
+                     [(order_id, pid, name, price, qty) for pid, name, price, qty in items])
+    count_new_order(conn, created_at)
+    record_order(conn, created_at, total)
+    if status == STATUS_CONFIRMED:
+        apply_order_sales(conn, order_id, 1)
+    if not sheet_synced:
+        enqueue_sheet_job(conn, JOB_APPEND, order_id)
+
+def get_order(order_id):
+    conn = get_db_connection()
+    order = conn.execute("SELECT * FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    conn.close()
+    return order
+
+def get_order_items(order_id):
+    """Позиции заказа: [(product_id, name, quantity)]."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT product_id, name, quantity FROM order_items WHERE order_id = ?", (order_id,)).fetchall()
+    conn.close()
+    return [(r['product_id'], r['name'], r['quantity']) for r in rows]
+
+def set_order_status(order_id, status, conn=None, expected=None):
+    """
+    Меняет статус заказа. Возвращает True, если статус действительно изменился.
+    expected - менять только из этого статуса (например, подтверждать только оформленный заказ).
+    """
+    if conn is not None:
+        row = conn.execute("SELECT status FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+        if not row or row['status'] == status or (expected is not None and row['status'] != expected):
+            return False
+        # Сравнение со старым статусом: параллельная смена статуса не посчитается дважды
+        if conn.execute("UPDATE orders SET status = ? WHERE order_id = ? AND status = ?",
+                        (status, order_id, row['status'])).rowcount == 0:
+            return False
+        # Агрегаты продаж меняются только при входе в статус "Подтверждён" или выходе из него
+        if status == STATUS_CONFIRMED:
+            apply_order_sales(conn, order_id, 1)
+        elif row['status'] == STATUS_CONFIRMED:
+            apply_order_sales(conn, order_id, -1)
+        enqueue_sheet_job(conn, JOB_STATUS, order_id)
+        return True
+    with db_connection() as conn:
+        return set_order_status(order_id, status, conn, expected)
+
+def cancel_order(order_id, conn=None):
+    """
+    Отменяет заказ. Если заказ был подтвержден, начисленная партнеру комиссия
+    списывается с его баланса в той же транзакции.
+    Возвращает (отменен ли, id партнера или None, списанная комиссия).
+    """
+    if conn is not None:
+        if not set_order_status(order_id, STATUS_CANCELLED, conn):
+            return False, None, 0
+        ref = conn.execute("SELECT partner_id, commission_amount FROM referred_orders WHERE order_id = ?", (order_id,)).fetchone()
+        if not ref:
+            return True, None, 0
+        commission = ref['commission_amount'] or 0
+        if commission:
+            conn.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (commission, ref['partner_id']))
+            conn.execute("UPDATE referred_orders SET commission_amount = ? WHERE order_id = ?", (0, order_id))
+        return True, ref['partner_id'], commission
+    with db_connection() as conn:
+        return cancel_order(order_id, conn)
+
+def get_user_orders(user_id):
+    """Заказы пользователя (новые сверху) вместе с позициями."""
+    conn = get_db_connection()
+    orders = conn.execute('''
+        SELECT order_id, total, status, created_at FROM orders
+        WHERE user_id = ? ORDER BY created_at DESC
+    ''', (user_id,)).fetchall()
+    items = {}
+    for row in conn.execute('''
+        SELECT oi.order_id, oi.product_id, oi.name, oi.quantity
+        FROM orders o JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.user_id = ?
+    ''', (user_id,)).fetchall():
+        items.setdefault(row['order_id'], []).append((row['product_id'], row['name'], row['quantity']))
+    conn.close()
+    return [(order, items.get(order['order_id'], [])) for order in orders]
+
+def sheet_items_str(items):
+    """Формат колонки 'Состав заказа' в таблице: id повторяется столько раз, сколько штук."""
+    return "; ".join("; ".join([pid] * qty) for pid, _, qty in items)
+
+def parse_sheet_items(items_str):
+    """Обратное преобразование колонки 'Состав заказа' в {product_id: количество}."""
+    return Counter(p.strip() for p in str(items_str).split('; ') if p.strip())
+
+# --- Зеркалирование в Google Таблицу ---
+def mark_order_synced(order_id, status, conn=None):
+    """Запоминает, что строка заказа есть в таблице и какой статус в неё записан."""
+    if conn is not None:
+        conn.execute("UPDATE orders SET sheet_synced = 1, sheet_status = ? WHERE order_id = ?", (status, order_id))
+        return
+    with db_connection() as conn:
+        mark_order_synced(order_id, status, conn)
+
+def count_orders():
+    conn = get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    conn.close()
+    return count
+
+def import_orders_from_sheet(rows, catalog):
+    """
+    Разовый перенос истории из таблицы заказов (get_all_values без заголовка) в SQLite.
+    Колонки: ID, ID пользователя, username, состав, сумма, статус, доставка, оплата, дата.
+    """
+    imported = 0
+    with db_connection() as conn:
+        for row in rows:
+            row = list(row) + [''] * (9 - len(row))
+            order_id = str(row[0]).strip()
+            if not order_id:
+                continue
+            try:
+                user_id = int(row[1])
+                total = float(str(row[4]).replace(',', '.') or 0)
+            except ValueError:
+                print(f"Пропускаю строку заказа {order_id}: некорректные данные")
+                continue
+            items = []
+            for pid, qty in parse_sheet_items(row[3]).items():
+                product = catalog.get(pid)
+                items.append((pid, product.name if product else pid, product.price if product else None, qty))
+            date = str(row[8]).strip()
+            created_at = f"{date} 00:00:00" if len(date) == 10 else (date or None)
+            exists = conn.execute("SELECT 1 FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+            if exists:
+                continue
+            insert_order(conn, order_id, user_id, row[2] or None, items, total, row[6], row[7],
+                         created_at=created_at, status=row[5] or STATUS_NEW, sheet_synced=1)
+            imported += 1
+    return imported
@@ -0,0 +1,99 @@
+from database.database import get_db_connection, db_connection
+
+# ==========================================
+#        АГРЕГАТЫ ПРОДАЖ ДЛЯ СТАТИСТИКИ
+# ==========================================
+# Экраны статистики читают готовые суммы, а не пересчитывают все заказы:
+#   sales_daily     - по дням: оформлено заказов, подтверждено, выручка подтвержденных;
+#   sales_products  - по товарам: продано штук и выручка (подтвержденные заказы);
+#   sales_customers - по покупателям: подтвержденных заказов и сумма;
+#   sales_totals    - одна строка (id = 1) с итогами за все время, чтобы не суммировать дни.
+# Суммы меняются в той же транзакции, что и заказ (insert_order / set_order_status),
+# поэтому всегда согласованы с таблицей orders. rebuild_sales() пересчитывает всё с нуля.
+
+def _day(created_at):
+    return (created_at or '')[:10]
+
+def count_new_order(conn, created_at):
+    """+1 оформленный заказ за день (в транзакции оформления)."""
+    conn.execute('''
+        INSERT INTO sales_daily (day, placed) VALUES (?, 1)
+        ON CONFLICT(day) DO UPDATE SET placed = placed + 1
+    ''', (_day(created_at),))
+    conn.execute("UPDATE sales_totals SET placed = placed + 1 WHERE id = 1")
+
+def apply_order_sales(conn, order_id, sign):
+    """Добавляет (sign=1) или вычитает (sign=-1) подтвержденный заказ из агрегатов."""
+    order = conn.execute("SELECT user_id, total, created_at FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    if not order:
+        return
+    total = order['total'] or 0
+    conn.execute('''
+        INSERT INTO sales_daily (day, confirmed, revenue) VALUES (?, ?, ?)
+        ON CONFLICT(day) DO UPDATE SET confirmed = confirmed + excluded.confirmed, revenue = revenue + excluded.revenue
+    ''', (_day(order['created_at']), sign, sign * total))
+    conn.execute("UPDATE sales_totals SET confirmed = confirmed + ?, revenue = revenue + ? WHERE id = 1", (sign, sign * total))
+    conn.execute('''
+        INSERT INTO sales_customers (user_id, orders, spent) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET orders = orders + excluded.orders, spent = spent + excluded.spent
+    ''', (order['user_id'], sign, sign * total))
+    # WHERE обязателен: без него SQLite разберет ON CONFLICT как ON от JOIN (двусмысленность upsert после SELECT)
+    conn.execute('''
+        INSERT INTO sales_products (product_id, name, units, revenue)
+        SELECT product_id, name, ? * quantity, ? * COALESCE(price, 0) * quantity FROM order_items WHERE order_id = ?
+        ON CONFLICT(product_id) DO UPDATE SET name = excluded.name,
+            units = units + excluded.units, revenue = revenue + excluded.revenue
+    ''', (sign, sign, order_id))
+
+def rebuild_sales(conn=None):
+    """Пересчитывает агрегаты по всей истории заказов (python main.py --rebuild-stats)."""
+    if conn is None:
+        with db_connection() as conn:
+            return rebuild_sales(conn)
+    from database.orders import STATUS_CONFIRMED    # orders.py импортирует этот модуль
+    conn.execute("DELETE FROM sales_daily")
+    conn.execute("DELETE FROM sales_products")
+    conn.execute("DELETE FROM sales_customers")
+    conn.execute('''
+        INSERT INTO sales_daily (day, placed, confirmed, revenue)
+        SELECT substr(created_at, 1, 10), COUNT(*),
+               SUM(status = ?), COALESCE(SUM(CASE WHEN status = ? THEN total END), 0)
+        FROM orders GROUP BY substr(created_at, 1, 10)
+    ''', (STATUS_CONFIRMED, STATUS_CONFIRMED))
+    conn.execute("INSERT OR REPLACE INTO sales_totals (id, placed, confirmed, revenue) "
+                 "SELECT 1, COALESCE(SUM(placed), 0), COALESCE(SUM(confirmed), 0), COALESCE(SUM(revenue), 0) FROM sales_daily")
+    conn.execute('''
+        INSERT INTO sales_customers (user_id, orders, spent)
+        SELECT user_id, COUNT(*), COALESCE(SUM(total), 0) FROM orders WHERE status = ? GROUP BY user_id
+    ''', (STATUS_CONFIRMED,))
+    conn.execute('''
+        INSERT INTO sales_products (product_id, name, units, revenue)
+        SELECT oi.product_id, MAX(oi.name), SUM(oi.quantity), SUM(COALESCE(oi.price, 0) * oi.quantity)
+        FROM orders o JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.status = ? GROUP BY oi.product_id
+    ''', (STATUS_CONFIRMED,))
+    return conn.execute("SELECT COUNT(*) FROM sales_daily").fetchone()[0]
+
+# --- Чтение для экранов статистики ---
+def get_order_totals():
+    """(всего заказов, подтверждено, выручка по подтвержденным)."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT placed, confirmed, revenue FROM sales_totals WHERE id = 1").fetchone()
+    conn.close()
+    return tuple(row) if row else (0, 0, 0)
+
+def get_top_products(limit=10):
+    """[(product_id, name, штук)] по подтвержденным заказам."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT product_id, name, units FROM sales_products WHERE units > 0 ORDER BY units DESC LIMIT ?",
+                        (limit,)).fetchall()
+    conn.close()
+    return [(r['product_id'], r['name'], r['units']) for r in rows]
+
+def get_top_customers(limit=10):
+    """[(user_id, сумма)] по подтвержденным заказам."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT user_id, spent FROM sales_customers WHERE orders > 0 ORDER BY spent DESC LIMIT ?",
+                        (limit,)).fetchall()
+    conn.close()
+    return [(r['user_id'], r['spent']) for r in rows]
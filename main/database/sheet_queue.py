@@ -0,0 +1,63 @@
+import time
+from datetime import datetime
+
+from config import SHEETS_QUEUE_MAX_BACKOFF
+from database.database import get_db_connection, db_connection
+
+# ==========================================
+#        ОЧЕРЕДЬ ЗАПИСЕЙ В GOOGLE ТАБЛИЦУ
+# ==========================================
+# Задание ставится в очередь в той же транзакции, что и изменение заказа,
+# поэтому ни одно изменение не теряется при падении Google или перезапуске бота.
+# Задание хранит только order_id: строка/статус берутся из заказа в момент отправки.
+# Исключение - списание остатков: его расчет сохраняется в payload перед первой записью.
+
+JOB_APPEND = 'append'   # Добавить строку заказа
+JOB_STATUS = 'status'   # Обновить статус в существующей строке
+JOB_STOCK = 'stock'     # Списать остатки подтвержденного заказа в таблице каталога
+
+def enqueue_sheet_job(conn, kind, order_id):
+    """Ставит задание в очередь в рамках транзакции вызывающего кода. Возвращает id задания."""
+    cur = conn.execute("INSERT INTO sheet_queue (kind, order_id, created_at) VALUES (?, ?, ?)",
+                       (kind, order_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return cur.lastrowid
+
+def save_job_payload(job_id, payload):
+    """Сохраняет рассчитанные данные задания (JSON), чтобы повтор записал то же самое."""
+    with db_connection() as conn:
+        conn.execute("UPDATE sheet_queue SET payload = ? WHERE id = ?", (payload, job_id))
+
+def get_queue_head(limit):
+    """Первые задания очереди (по порядку постановки)."""
+    conn = get_db_connection()
+    rows = conn.execute("SELECT * FROM sheet_queue ORDER BY id LIMIT ?", (limit,)).fetchall()
+    conn.close()
+    return rows
+
+def complete_jobs(job_ids, conn=None):
+    """Удаляет выполненные задания (в транзакции вызывающего кода, если передано conn)."""
+    if conn is not None:
+        conn.executemany("DELETE FROM sheet_queue WHERE id = ?", [(job_id,) for job_id in job_ids])
+        return
+    with db_connection() as conn:
+        complete_jobs(job_ids, conn)
+
+def fail_jobs(job_ids, error):
+    """Откладывает задания с экспоненциальной задержкой (2, 4, 8 ... до SHEETS_QUEUE_MAX_BACKOFF сек.)."""
+    with db_connection() as conn:
+        for job_id in job_ids:
+            conn.execute('''
+                UPDATE sheet_queue SET attempts = attempts + 1, last_error = ?,
+                       next_attempt_at = ? + MIN(?, 1 << MIN(attempts + 1, 20))
+                WHERE id = ?
+            ''', (str(error)[:500], time.time(), SHEETS_QUEUE_MAX_BACKOFF, job_id))
+
+def get_queue_stats():
+    """(заданий в очереди, время постановки самого старого, попыток у первого, последняя ошибка первого)."""
+    conn = get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM sheet_queue").fetchone()[0]
+    head = conn.execute("SELECT created_at, attempts, last_error FROM sheet_queue ORDER BY id LIMIT 1").fetchone()
+    conn.close()
+    if not head:
+        return count, None, 0, None
+    return count, head['created_at'], head['attempts'], head['last_error']
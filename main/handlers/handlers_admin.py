@@ -1,25 +1,34 @@
 import telebot
-import threading
-import time
-from datetime import datetime, timedelta
-from collections import Counter
-
-from loader import bot, orders_sheet
-from config import MANAGER_ID
-from database.database import get_db_connection, is_admin
-import utils.utils
-from utils.utils import admin_required, update_catalog_cache, CACHE_LOCK, escape_markdown
+from telebot.apihelper import ApiTelegramException
+
+from loader import bot, router
+from config import MANAGER_ID, REPORT_TTL_SUMMARY, REPORT_TTL_TOP, REPORT_TTL_WINDOW
+from database.database import get_db_connection, is_admin, set_partner, remove_partner, set_admin, POOL_STATS
+from database.sheet_queue import get_queue_stats
+from database.orders import get_order, cancel_order
+from database.sales import get_order_totals, get_top_products, get_top_customers
+from database.analytics import get_day, get_window
+from database.broadcasts import (
+    cancel_broadcasts, count_recipients, describe_audience, make_audience,
+    AUDIENCE_ALL, AUDIENCE_ACTIVE, AUDIENCE_PARTNERS, AUDIENCE_BUYERS, AUDIENCE_NON_BUYERS, AUDIENCE_REFERRALS
+)
+from utils.utils import admin_required, update_catalog_cache, get_catalog, escape_markdown, format_sync_stats
+from utils.orders_mirror import notify_orders_mirror
+from utils.sheets_client import format_sheets_stats
+from utils.broadcast import start_broadcast
+from utils.webhook import format_webhook_stats
+from utils.report_cache import get_report, format_age, REPORT_STATS
 
 # ==========================================
 #        ГЛАВНОЕ МЕНЮ АДМИНА
 # ==========================================
 
-@bot.message_handler(regexp='^👑 Админ-панель$')
+@router.message('👑 Админ-панель')
 @admin_required
 def handle_admin_panel_button(message):
     show_admin_panel(message)
 
-@bot.message_handler(commands=['admin'])
+@router.command('admin')
 @admin_required
 def show_admin_panel(message):
     keyboard = telebot.types.InlineKeyboardMarkup()
@@ -35,50 +44,74 @@ def show_admin_panel(message):
     else:
         bot.send_message(message.chat.id, "👑 Админ-панель", reply_markup=keyboard)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_panel_main')
+@router.callback('admin_panel_main')
 def back_to_admin_panel(call):
     bot.answer_callback_query(call.id)
     show_admin_panel(call)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_check_status')
+@router.callback('admin_check_status')
 def handle_check_status(call):
     # Проверка прав внутри декоратора может не сработать на callback, проверяем явно или доверяем логике меню
     bot.answer_callback_query(call.id)
-    bot.send_message(call.message.chat.id, "✅ Бот онлайн и работает стабильно!")
+    queued, oldest, attempts, last_error = get_queue_stats()
+    queue_text = f"Очередь в таблицу заказов: {queued}"
+    if queued:
+        queue_text += f" (старейшее с {oldest}, попыток {attempts})"
+        if last_error:
+            queue_text += f"\nПоследняя ошибка: {last_error}"
+    bot.send_message(call.message.chat.id, "✅ Бот онлайн и работает стабильно!\n\n"
+                     f"БД: открыто соединений {POOL_STATS['opened']}, переиспользований {POOL_STATS['reused']}, "
+                     f"закрыто брошенных {POOL_STATS['reclaimed']}\n"
+                     f"{queue_text}\n"
+                     f"Отчеты: из кэша {REPORT_STATS['hits']}, пересчитано {REPORT_STATS['builds']}, ждали расчета {REPORT_STATS['waits']}\n\n"
+                     f"{format_webhook_stats()}\n\n{format_sheets_stats()}")
 
 # ==========================================
 #        УПРАВЛЕНИЕ МАГАЗИНОМ
 # ==========================================
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_shop_menu')
+@router.callback('admin_shop_menu')
 def handle_shop_menu(call):
     bot.answer_callback_query(call.id)
     keyboard = telebot.types.InlineKeyboardMarkup()
     keyboard.add(telebot.types.InlineKeyboardButton(text="🔄 Синхронизировать каталог", callback_data="admin_sync"))
+    keyboard.add(telebot.types.InlineKeyboardButton(text="📈 Статус синхронизации", callback_data="admin_sync_stats"))
     keyboard.add(telebot.types.InlineKeyboardButton(text="🏷️ Управление промокодами", callback_data="admin_promo_menu"))
     keyboard.add(telebot.types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_panel_main"))
     bot.edit_message_text("🏪 Управление Магазином", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=keyboard)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_sync')
+@router.callback('admin_sync')
 def handle_sync_callback(call):
     bot.answer_callback_query(call.id, "Запускаю синхронизацию...")
     bot.send_message(call.from_user.id, "⏳ Начинаю обновление кэша...")
-    if update_catalog_cache():
+    if update_catalog_cache(force=True):
         bot.send_message(call.from_user.id, "✅ Кэш успешно обновлен.")
     else:
         bot.send_message(call.from_user.id, "❌ Ошибка при обновлении кэша.")
 
-@bot.message_handler(commands=['sync'])
+@router.command('sync')
 @admin_required
 def sync_command_handler(message):
     bot.send_message(message.from_user.id, "Запускаю принудительное обновление кэша...")
-    if update_catalog_cache():
+    if update_catalog_cache(force=True):
         bot.send_message(message.from_user.id, "✅ Кэш успешно обновлен.")
     else:
         bot.send_message(message.from_user.id, "❌ Произошла ошибка.")
 
+@router.callback('admin_sync_stats')
+def handle_sync_stats(call):
+    bot.answer_callback_query(call.id)
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    keyboard.add(telebot.types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_shop_menu"))
+    bot.edit_message_text(format_sync_stats(), chat_id=call.message.chat.id, message_id=call.message.message_id, parse_mode="Markdown", reply_markup=keyboard)
+
+@router.command('syncstats')
+@admin_required
+def sync_stats_command_handler(message):
+    bot.send_message(message.chat.id, format_sync_stats(), parse_mode="Markdown")
+
 # --- ПРОМОКОДЫ ---
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_promo_menu')
+@router.callback('admin_promo_menu')
 def handle_promo_menu(call):
     bot.answer_callback_query(call.id)
     keyboard = telebot.types.InlineKeyboardMarkup()
@@ -88,7 +121,7 @@ def handle_promo_menu(call):
     keyboard.add(telebot.types.InlineKeyboardButton(text="⬅️ Назад в меню магазина", callback_data="admin_shop_menu"))
     bot.edit_message_text("🏷️ Управление промокодами", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=keyboard)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'promo_create')
+@router.callback('promo_create')
 def handle_promo_create(call):
     bot.answer_callback_query(call.id)
     msg = bot.send_message(call.from_user.id, "Введите данные: `КОД %СКИДКИ КОЛ-ВО`\nПример: `SALE20 20 50`", parse_mode="Markdown")
@@ -107,7 +140,7 @@ def process_promo_creation(message):
     except Exception as e:
         bot.reply_to(message, f"❌ Ошибка формата: {e}")
 
-@bot.callback_query_handler(func=lambda call: call.data == 'promo_list')
+@router.callback('promo_list')
 def handle_promo_list(call):
     bot.answer_callback_query(call.id)
     conn = get_db_connection()
@@ -122,7 +155,7 @@ def handle_promo_list(call):
     keyboard.add(telebot.types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_promo_menu"))
     bot.edit_message_text(response, chat_id=call.message.chat.id, message_id=call.message.message_id, parse_mode="Markdown", reply_markup=keyboard)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'promo_delete')
+@router.callback('promo_delete')
 def handle_promo_delete_prompt(call):
     bot.answer_callback_query(call.id)
     msg = bot.send_message(call.from_user.id, "Введите код промокода для удаления:")
@@ -145,7 +178,7 @@ def process_promo_deletion(message):
 
 USERS_PER_PAGE = 8
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_users_menu')
+@router.callback('admin_users_menu')
 def handle_user_management_menu(call):
     bot.answer_callback_query(call.id)
     keyboard = telebot.types.InlineKeyboardMarkup()
@@ -197,7 +230,7 @@ def generate_paginated_list(page=0, list_type='all'):
     keyboard.add(telebot.types.InlineKeyboardButton("⬅️ Назад в меню", callback_data="admin_users_menu"))
     return header + f"\nСтраница {page + 1} из {total_pages}", keyboard
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith(('list_users_page_', 'list_partners_page_')))
+@router.callback(prefix=('list_users_page_', 'list_partners_page_'))
 def handle_list_pagination(call):
     page = int(call.data.split('_')[-1])
     l_type = 'partners' if 'partners' in call.data else 'all'
@@ -205,7 +238,7 @@ def handle_list_pagination(call):
     bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=kb)
 
 # --- ПРОСМОТР ПРОФИЛЯ ---
-@bot.callback_query_handler(func=lambda call: call.data.startswith('view_user_'))
+@router.callback(prefix='view_user_')
 def handle_view_user(call):
     _, _, user_id, page, list_type = call.data.split('_')
     user_id = int(user_id)
@@ -241,7 +274,7 @@ def handle_view_user(call):
 # --- ДЕЙСТВИЯ С ПОЛЬЗОВАТЕЛЯМИ ---
 
 # 1. Изменение баланса
-@bot.callback_query_handler(func=lambda call: call.data.startswith('edit_balance_profile_'))
+@router.callback(prefix='edit_balance_profile_')
 def prompt_edit_balance_profile(call):
     uid = int(call.data.split('_')[-1])
     msg = bot.send_message(call.from_user.id, f"Введите сумму (+ или -) для ID {uid}:")
@@ -263,7 +296,7 @@ def process_edit_balance_input_id_known(message, user_id):
         bot.reply_to(message, "❌ Введите число.")
 
 # 2. Сделать партнером
-@bot.callback_query_handler(func=lambda call: call.data.startswith('make_partner_'))
+@router.callback(prefix='make_partner_')
 def prompt_make_partner(call):
     uid = int(call.data.split('_')[-1])
     msg = bot.send_message(call.from_user.id, f"Введите % комиссии для ID {uid}:")
@@ -272,29 +305,23 @@ def prompt_make_partner(call):
 def process_make_partner(message, user_id):
     try:
         pct = float(message.text)
-        conn = get_db_connection()
-        conn.execute("UPDATE users SET is_partner = 1, commission_percent = ? WHERE user_id = ?", (pct, user_id))
-        conn.commit()
-        conn.close()
+        set_partner(user_id, pct)
         bot.reply_to(message, f"✅ Партнер создан ({pct}%).")
         try: bot.send_message(user_id, "🎉 Вы стали партнером!")
         except: pass
     except: bot.reply_to(message, "❌ Ошибка.")
 
 # 3. Удалить партнера
-@bot.callback_query_handler(func=lambda call: call.data.startswith('remove_partner_'))
+@router.callback(prefix='remove_partner_')
 def handle_remove_partner(call):
     uid = int(call.data.split('_')[-1])
-    conn = get_db_connection()
-    conn.execute("UPDATE users SET is_partner = 0, commission_percent = 0 WHERE user_id = ?", (uid,))
-    conn.commit()
-    conn.close()
+    remove_partner(uid)
     bot.answer_callback_query(call.id, "Партнер удален.", show_alert=True)
     # Возвращаем в меню
     handle_user_management_menu(call)
 
 # 4. Изменить %
-@bot.callback_query_handler(func=lambda call: call.data.startswith('change_commission_'))
+@router.callback(prefix='change_commission_')
 def prompt_change_com(call):
     uid = int(call.data.split('_')[-1])
     msg = bot.send_message(call.from_user.id, "Введите НОВЫЙ %:")
@@ -311,7 +338,7 @@ def process_change_com(message, user_id):
     except: bot.reply_to(message, "❌ Ошибка.")
 
 # 5. Статистика партнера
-@bot.callback_query_handler(func=lambda call: call.data.startswith('partner_stats_'))
+@router.callback(prefix='partner_stats_')
 def handle_partner_stats(call):
     uid = int(call.data.split('_')[-1])
     conn = get_db_connection()
@@ -332,12 +359,12 @@ def handle_partner_stats(call):
     bot.send_message(call.from_user.id, text, parse_mode="Markdown")
 
 # 6. Команды ввода ID (для кнопок "по ID")
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_partner_stats_prompt')
+@router.callback('admin_partner_stats_prompt')
 def prompt_stats_id(call):
     bot.send_message(call.from_user.id, "Введите ID партнера:")
     bot.register_next_step_handler(call.message, lambda m: handle_partner_stats(type('obj', (object,), {'data': f'partner_stats_{m.text}', 'message': m, 'from_user': m.from_user})))
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_add_admin_prompt')
+@router.callback('admin_add_admin_prompt')
 def prompt_add_admin(call):
     msg = bot.send_message(call.from_user.id, "Введите ID нового админа:")
     bot.register_next_step_handler(msg, process_add_admin)
@@ -345,19 +372,15 @@ def prompt_add_admin(call):
 def process_add_admin(message):
     try:
         uid = int(message.text)
-        conn = get_db_connection()
-        if not conn.execute("SELECT 1 FROM users WHERE user_id=?", (uid,)).fetchone():
+        if not set_admin(uid):
             bot.reply_to(message, "❌ Юзер не найден в БД.")
             return
-        conn.execute("UPDATE users SET is_admin = 1 WHERE user_id = ?", (uid,))
-        conn.commit()
-        conn.close()
         bot.reply_to(message, "✅ Админ добавлен.")
         try: bot.send_message(uid, "👑 Вам выданы права администратора.")
         except: pass
     except: bot.reply_to(message, "❌ Ошибка.")
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_edit_balance_prompt')
+@router.callback('admin_edit_balance_prompt')
 def prompt_edit_bal_manual(call):
     msg = bot.send_message(call.from_user.id, "Введите `ID СУММА` (напр. `12345 50`):", parse_mode="Markdown")
     bot.register_next_step_handler(msg, process_edit_bal_manual)
@@ -372,53 +395,144 @@ def process_edit_bal_manual(message):
 #        РАССЫЛКА И СТАТИСТИКА
 # ==========================================
 
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_broadcast')
+# Аудитории в меню рассылки: (текст кнопки, аудитория); рефералы партнера - по отдельному запросу ID
+BROADCAST_AUDIENCES = [
+    ("👥 Все", make_audience(AUDIENCE_ALL)),
+    ("🟢 Активные за 7 дн.", make_audience(AUDIENCE_ACTIVE, 7)),
+    ("🟡 Активные за 30 дн.", make_audience(AUDIENCE_ACTIVE, 30)),
+    ("🤝 Партнеры", make_audience(AUDIENCE_PARTNERS)),
+    ("🛍 Покупатели", make_audience(AUDIENCE_BUYERS)),
+    ("🆕 Без заказов", make_audience(AUDIENCE_NON_BUYERS)),
+]
+
+@router.callback('admin_broadcast')
 def handle_broadcast_callback(call):
-    msg = bot.send_message(call.from_user.id, "Введите текст рассылки (/cancel_broadcast для отмены):")
-    bot.register_next_step_handler(msg, process_broadcast_text)
+    bot.answer_callback_query(call.id)
+    kb = telebot.types.InlineKeyboardMarkup()
+    for title, audience in BROADCAST_AUDIENCES:
+        kb.add(telebot.types.InlineKeyboardButton(title, callback_data=f"broadcast_to_{audience}"))
+    kb.add(telebot.types.InlineKeyboardButton("🔗 Рефералы партнера", callback_data="broadcast_referrals"))
+    kb.add(telebot.types.InlineKeyboardButton("⬅️ Назад", callback_data="admin_panel_main"))
+    bot.edit_message_text("📢 Кому отправить рассылку?", call.message.chat.id, call.message.message_id, reply_markup=kb)
 
-def process_broadcast_text(message):
+@router.callback(prefix='broadcast_to_')
+def handle_broadcast_audience(call):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, "Нет прав")
+        return
+    bot.answer_callback_query(call.id)
+    prompt_broadcast_text(call.from_user.id, call.data[len('broadcast_to_'):])
+
+@router.callback('broadcast_referrals')
+def handle_broadcast_referrals(call):
+    bot.answer_callback_query(call.id)
+    msg = bot.send_message(call.from_user.id, "Введите ID партнера:")
+    bot.register_next_step_handler(msg, process_broadcast_partner_id)
+
+def process_broadcast_partner_id(message):
+    if not message.text or not message.text.strip().isdigit():
+        bot.send_message(message.chat.id, "❌ Нужен числовой ID.")
+        return
+    prompt_broadcast_text(message.chat.id, make_audience(AUDIENCE_REFERRALS, int(message.text.strip())))
+
+def prompt_broadcast_text(chat_id, audience):
+    """Показывает размер аудитории и ждет текст рассылки."""
+    try:
+        count = count_recipients(audience)
+    except ValueError:
+        bot.send_message(chat_id, "❌ Неизвестная аудитория.")
+        return
+    if not count:
+        bot.send_message(chat_id, f"Аудитория «{describe_audience(audience)}» пуста, рассылка не нужна.")
+        return
+    msg = bot.send_message(chat_id, f"📢 Аудитория: {describe_audience(audience)}\nПолучателей: {count}\n\n"
+                                    "Введите текст рассылки (/cancel_broadcast для отмены):")
+    bot.register_next_step_handler(msg, process_broadcast_text, audience)
+
+def process_broadcast_text(message, audience):
     if message.text == '/cancel_broadcast':
         bot.send_message(message.chat.id, "Отмена.")
         return
-    bot.send_message(message.chat.id, "⏳ Рассылка запущена...")
-    threading.Thread(target=broadcast_message, args=(message.from_user.id, message.text)).start()
+    broadcast_id = start_broadcast(message.from_user.id, message.text, audience)
+    bot.send_message(message.chat.id, f"⏳ Рассылка #{broadcast_id} запущена. Остановить: /stop_broadcast")
 
-def broadcast_message(admin_id, text):
-    conn = get_db_connection()
-    users = conn.execute("SELECT user_id FROM users").fetchall()
-    conn.close()
-    ok, fail = 0, 0
-    for u in users:
-        try:
-            bot.send_message(u['user_id'], text, parse_mode="Markdown")
-            ok += 1
-        except: fail += 1
-        time.sleep(0.05)
-    bot.send_message(admin_id, f"✅ Рассылка завершена!\nУспешно: {ok}\nОшибок: {fail}")
+@router.command('stop_broadcast')
+@admin_required
+def stop_broadcast_handler(message):
+    stopped = cancel_broadcasts()
+    bot.send_message(message.chat.id, f"🛑 Остановлено рассылок: {stopped}" if stopped else "Активных рассылок нет.")
 
 def get_general_stats_text():
     """Считает статистику и возвращает текст. Не требует прав админа для вызова (права проверяются выше)."""
-    try:
-        all_orders = orders_sheet.get_all_records()
-        confirmed = [o for o in all_orders if o.get('Статус') == 'Подтверждён']
-        total_rev = sum(float(str(o.get('Сумма', 0)).replace(',', '.')) for o in confirmed)
-        
-        conn = get_db_connection()
-        total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-        today = datetime.now().strftime("%Y-%m-%d") + "%"
-        new_today = conn.execute("SELECT COUNT(*) FROM users WHERE first_seen LIKE ?", (today,)).fetchone()[0]
-        conn.close()
-        
-        return (f"📊 *Сводка*\n\n"
-                f"Заказов всего: {len(all_orders)}\nПодтверждено: {len(confirmed)}\n"
-                f"Выручка: {total_rev:.2f} zl.\n\n"
-                f"Пользователей: {total_users}\nНовых сегодня: {new_today}")
-    except Exception as e:
-        return f"Ошибка при расчете статистики: {e}"
+    total_orders, confirmed, total_rev = get_order_totals()
+    
+    conn = get_db_connection()
+    total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn.close()
+    today = get_day()
+    
+    return (f"📊 *Сводка*\n\n"
+            f"Заказов всего: {total_orders}\nПодтверждено: {confirmed}\n"
+            f"Выручка: {total_rev:.2f} zl.\n\n"
+            f"Пользователей: {total_users}\nНовых сегодня: {today['new_users']}\n"
+            f"Активных сегодня: {today['active_users']}\nЗаказов сегодня: {today['orders']}")
+
+def _change(current, previous):
+    """Изменение к прошлому периоду: ' (+12%)'; пусто, если сравнивать не с чем."""
+    if not previous:
+        return ""
+    return f" ({(current - previous) / previous:+.0%})"
+
+def get_window_stats_text(days):
+    """Отчет за последние `days` дней по почасовым/дневным счетчикам (database/analytics.py)."""
+    cur, prev, peak, confirmed, revenue = get_window(days)
+    conversion = f"{cur['conversion']:.0%}" if cur['conversion'] is not None else "—"
+    text = (f"📅 *Статистика за {days} дн.*\n"
+            f"_(в скобках - изменение к предыдущим {days} дн.)_\n\n"
+            f"Заказов: {cur['orders']}{_change(cur['orders'], prev['orders'])}\n"
+            f"На сумму: {cur['amount']:.2f} zl.{_change(cur['amount'], prev['amount'])}\n"
+            f"Подтверждено: {confirmed}, выручка {revenue:.2f} zl.\n\n"
+            f"Новых пользователей: {cur['new_users']}{_change(cur['new_users'], prev['new_users'])}\n"
+            f"Активных в день: в среднем {cur['active_avg']:.1f}, максимум {cur['active_max']}\n"
+            f"Начато корзин: {cur['carts']}, конверсия в заказ: {conversion}")
+    if peak:
+        text += f"\nСамый загруженный час: {peak[0]}:00 ({peak[1]} зак.)"
+    return text
+
+def get_top_products_text():
+    all_items = get_catalog().by_id
+    text = "🔥 *Топ товаров:*\n\n"
+    for i, (pid, name, count) in enumerate(get_top_products(10), 1):
+        item = all_items.get(pid)
+        name = item.name if item else (name or f"ID {pid}")
+        text += f"{i}. {escape_markdown(name)} - {count} шт.\n"
+    return text
+
+def get_top_users_text():
+    text = "🏆 *Топ клиентов:*\n\n"
+    for i, (uid, amt) in enumerate(get_top_customers(10), 1):
+        text += f"{i}. ID `{uid}` — {amt:.2f} zl.\n"
+    return text
 
 # --- СТАТИСТИКА ---
-@bot.callback_query_handler(func=lambda call: call.data == 'admin_stats')
+# Отчеты кэшируются (utils/report_cache.py): ключ отчета -> (функция расчета, TTL в секундах).
+# Ключ совпадает с callback кнопки без префикса 'stats_'; кнопка "Обновить" - 'stats_refresh_<ключ>'.
+STATS_WINDOWS = (7, 30, 90)
+STATS_REPORTS = {
+    'general': (get_general_stats_text, REPORT_TTL_SUMMARY),
+    'top_products': (get_top_products_text, REPORT_TTL_TOP),
+    'top_users': (get_top_users_text, REPORT_TTL_TOP),
+}
+for _days in STATS_WINDOWS:
+    STATS_REPORTS[f'window_{_days}'] = (lambda days=_days: get_window_stats_text(days), REPORT_TTL_WINDOW)
+
+def get_stats_report(key, refresh=False):
+    """Текст отчета из кэша с пометкой о его возрасте."""
+    build, ttl = STATS_REPORTS[key]
+    text, age = get_report(key, build, ttl, refresh)
+    return f"{text}\n\n_Обновлено {format_age(age)}_"
+
+@router.callback('admin_stats')
 def admin_stats_menu(call):
     if not is_admin(call.from_user.id):
         bot.answer_callback_query(call.id, "Нет прав")
@@ -429,102 +543,73 @@ def admin_stats_menu(call):
     kb.add(telebot.types.InlineKeyboardButton("📊 Общая сводка", callback_data="stats_general"))
     kb.add(telebot.types.InlineKeyboardButton("🔥 Топ товаров", callback_data="stats_top_products"))
     kb.add(telebot.types.InlineKeyboardButton("🏆 Топ клиентов", callback_data="stats_top_users"))
+    kb.row(*[telebot.types.InlineKeyboardButton(f"📅 {days} дн.", callback_data=f"stats_window_{days}") for days in STATS_WINDOWS])
     kb.add(telebot.types.InlineKeyboardButton("⬅️ Назад", callback_data="admin_panel_main"))
     bot.edit_message_text("📊 Выберите тип статистики:", call.message.chat.id, call.message.message_id, reply_markup=kb)
 
-@bot.callback_query_handler(func=lambda call: call.data == 'stats_general')
-def handle_stats_general(call):
-    text = get_general_stats_text()
-    
+@router.callback(*[f"stats_{key}" for key in STATS_REPORTS], prefix='stats_refresh_')
+def handle_stats_report(call):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, "Нет прав")
+        return
+    refresh = call.data.startswith('stats_refresh_')
+    key = call.data[len('stats_refresh_' if refresh else 'stats_'):]
+    if key not in STATS_REPORTS:
+        bot.answer_callback_query(call.id, "Неизвестный отчет")
+        return
+    bot.answer_callback_query(call.id, "Считаю...")
+
     kb = telebot.types.InlineKeyboardMarkup()
+    kb.add(telebot.types.InlineKeyboardButton("🔄 Обновить", callback_data=f"stats_refresh_{key}"))
     kb.add(telebot.types.InlineKeyboardButton("⬅️ Назад", callback_data="admin_stats"))
-    
-    bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=kb)
-
-@bot.message_handler(commands=['stats'])
-@admin_required
-def stats_handler(message):
     try:
-        all_orders = orders_sheet.get_all_records()
-        confirmed = [o for o in all_orders if o.get('Статус') == 'Подтверждён']
-        total_rev = sum(float(str(o.get('Сумма', 0)).replace(',','.')) for o in confirmed)
-        
-        conn = get_db_connection()
-        total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-        today = datetime.now().strftime("%Y-%m-%d") + "%"
-        new_today = conn.execute("SELECT COUNT(*) FROM users WHERE first_seen LIKE ?", (today,)).fetchone()[0]
-        conn.close()
-        
-        text = (f"📊 *Сводка*\n\n"
-                f"Заказов всего: {len(all_orders)}\nПодтверждено: {len(confirmed)}\n"
-                f"Выручка: {total_rev:.2f} zl.\n\n"
-                f"Пользователей: {total_users}\nНовых сегодня: {new_today}")
-        bot.send_message(message.chat.id, text, parse_mode="Markdown")
+        text = get_stats_report(key, refresh)
     except Exception as e:
-        bot.send_message(message.chat.id, f"Ошибка: {e}")
-
-@bot.callback_query_handler(func=lambda call: call.data == 'stats_top_products')
-def handle_stats_top_products(call):
-    bot.answer_callback_query(call.id, "Считаю...")
+        bot.send_message(call.message.chat.id, f"Ошибка при расчете статистики: {e}")
+        return
     try:
-        orders = [o for o in orders_sheet.get_all_records() if o.get('Статус') == 'Подтверждён']
-        cnt = Counter()
-        for o in orders:
-            cnt.update(str(o.get('Состав заказа', '')).split('; '))
-        
-        # Используем кэш из модуля utils
-        with CACHE_LOCK:
-             all_items = {str(i['id']).strip(): i for i in utils.CATALOG_CACHE}
-
-        text = "🔥 *Топ товаров:*\n\n"
-        for i, (pid, count) in enumerate(cnt.most_common(10), 1):
-            name = all_items.get(pid.strip(), {}).get('Название', f"ID {pid}")
-            text += f"{i}. {escape_markdown(name)} - {count} шт.\n"
-            
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=telebot.types.InlineKeyboardMarkup().add(telebot.types.InlineKeyboardButton("⬅️ Назад", callback_data="admin_stats")))
-    except Exception as e:
-        bot.send_message(call.message.chat.id, f"Ошибка: {e}")
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=kb)
+    except ApiTelegramException as e:
+        # Повторное нажатие "Обновить" без изменений в отчете
+        if 'message is not modified' not in str(e):
+            raise
 
-@bot.callback_query_handler(func=lambda call: call.data == 'stats_top_users')
-def handle_stats_top_users(call):
-    bot.answer_callback_query(call.id, "Считаю...")
+@router.command('stats')
+@admin_required
+def stats_handler(message):
     try:
-        orders = [o for o in orders_sheet.get_all_records() if o.get('Статус') == 'Подтверждён']
-        user_spend = {}
-        for o in orders:
-            uid = str(o.get('ID Пользователя'))
-            amt = float(str(o.get('Сумма', 0)).replace(',','.'))
-            if uid not in user_spend: user_spend[uid] = 0
-            user_spend[uid] += amt
-            
-        sorted_users = sorted(user_spend.items(), key=lambda x: x[1], reverse=True)[:10]
-        text = "🏆 *Топ клиентов:*\n\n"
-        for i, (uid, amt) in enumerate(sorted_users, 1):
-            text += f"{i}. ID `{uid}` — {amt:.2f} zl.\n"
-            
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=telebot.types.InlineKeyboardMarkup().add(telebot.types.InlineKeyboardButton("⬅️ Назад", callback_data="admin_stats")))
+        bot.send_message(message.chat.id, get_stats_report('general'), parse_mode="Markdown")
     except Exception as e:
-        bot.send_message(call.message.chat.id, f"Ошибка: {e}")
+        bot.send_message(message.chat.id, f"Ошибка при расчете статистики: {e}")
 
 # ==========================================
 #        ПРОЧИЕ КОМАНДЫ (/cancel и др)
 # ==========================================
 
-@bot.message_handler(commands=['cancel'])
+@router.command('cancel')
 @admin_required
 def cancel_order_command(message):
     try:
         oid = message.text.split()[1]
-        cell = orders_sheet.find(oid)
-        if cell:
-            orders_sheet.update_cell(cell.row, 6, "Отменён")
-            bot.reply_to(message, f"✅ Заказ `{oid}` отменен.", parse_mode="Markdown")
-        else:
+        order = get_order(oid)
+        if not order:
             bot.reply_to(message, "❌ Не найден.")
-    except:
+            return
+        cancelled, partner_id, commission = cancel_order(oid)
+        if not cancelled:
+            bot.reply_to(message, f"Заказ `{oid}` уже в статусе «{order['status']}».", parse_mode="Markdown")
+            return
+        notify_orders_mirror()
+        text = f"✅ Заказ `{oid}` отменен."
+        if commission:
+            text += f"\nКомиссия партнера {partner_id} ({commission:.2f} zl) списана с баланса."
+        bot.reply_to(message, text, parse_mode="Markdown")
+    except IndexError:
         bot.reply_to(message, "Формат: `/cancel ID`", parse_mode="Markdown")
+    except Exception as e:
+        bot.reply_to(message, f"Ошибка: {e}")
 
-@bot.message_handler(commands=['addpartner'])
+@router.command('addpartner')
 @admin_required
 def add_partner_cmd(message):
     try:
@@ -532,7 +617,7 @@ def add_partner_cmd(message):
         process_make_partner(type('obj', (object,), {'text': pct, 'chat': message.chat, 'reply_to': bot.reply_to}), int(uid))
     except: bot.reply_to(message, "Формат: `/addpartner ID %`")
 
-@bot.message_handler(commands=['removepartner'])
+@router.command('removepartner')
 @admin_required
 def remove_partner_cmd(message):
     try:
@@ -540,7 +625,7 @@ def remove_partner_cmd(message):
         bot.reply_to(message, "Партнер удален.")
     except: bot.reply_to(message, "Формат: `/removepartner ID`")
 
-@bot.message_handler(commands=['editbalance'])
+@router.command('editbalance')
 @admin_required
 def edit_balance_cmd(message):
     process_edit_bal_manual(message)
\ No newline at end of file
@@ -5,14 +5,23 @@ from datetime import datetime
 from collections import Counter
 
 # Импорты из наших модулей
-from loader import bot, sheet, orders_sheet, user_order_data
+from loader import bot, router, user_order_data
 from config import MANAGER_ID, MANAGER_USERNAME
-from database.database import get_db_connection, get_cart_items, is_partner
-import utils.utils
+from database.database import (
+    get_db_connection, db_connection, close_db_connection, get_cart_items, is_partner, is_admin,
+    cart_increment, cart_decrement, cart_remove, cart_clear
+)
+from database.orders import (
+    insert_order, get_order, set_order_status, cancel_order, get_user_orders,
+    STATUS_NEW, STATUS_CONFIRMED
+)
+from database.sheet_queue import enqueue_sheet_job, JOB_STOCK
 from utils.utils import (
     update_last_seen, update_cart_message, escape_markdown, 
-    calculate_volume_discount, CACHE_LOCK
+    calculate_volume_discount, get_catalog, cached_markup
 )
+from utils.photos import send_product_photo
+from utils.orders_mirror import notify_orders_mirror
 
 # ==========================================
 #        ГЛАВНОЕ МЕНЮ И START
@@ -25,11 +34,11 @@ def get_main_keyboard(user_id):
     if is_partner(user_id):
         keyboard.add("Партнерская программа 📈")
  
-    if utils.is_admin(user_id): 
+    if is_admin(user_id): 
         keyboard.add("👑 Админ-панель")
     return keyboard
 
-@bot.message_handler(commands=['start'])
+@router.command('start')
 @update_last_seen
 def send_welcome(message):
     user_id = message.from_user.id
@@ -43,8 +52,8 @@ def send_welcome(message):
             conn = get_db_connection()
             try:
                 # Пытаемся записать реферала (UNIQUE игнорирует дубли)
-                conn.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)", (int(referrer_id), user_id))
-                if conn.total_changes > 0: # Если запись произошла
+                cur = conn.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)", (int(referrer_id), user_id))
+                if cur.rowcount > 0: # Если запись произошла
                     conn.commit()
                     try:
                         u_info = f"@{username}" if username else f"ID: {user_id}"
@@ -57,7 +66,7 @@ def send_welcome(message):
 
     bot.send_message(message.chat.id, "Здравствуйте! Воспользуйтесь меню для навигации.", reply_markup=get_main_keyboard(user_id))
 
-@bot.message_handler(regexp='^Главное меню$')
+@router.message('Главное меню')
 @update_last_seen
 def back_to_main_menu(message):
     bot.send_message(message.chat.id, "Вы вернулись в главное меню.", reply_markup=get_main_keyboard(message.from_user.id))
@@ -66,61 +75,70 @@ def back_to_main_menu(message):
 #        НАВИГАЦИЯ ПО КАТАЛОГУ
 # ==========================================
 
-@bot.message_handler(regexp='^Каталог$')
+# --- Клавиатуры навигации (строятся один раз на версию каталога, см. cached_markup) ---
+def build_categories_keyboard(catalog):
+    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for category in catalog.categories():
+        keyboard.add(category)
+    keyboard.add("Главное меню")
+    return keyboard
+
+def build_manufacturers_keyboard(catalog, category):
+    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for manufacturer in catalog.manufacturers(category):
+        keyboard.add(f"Производитель: {manufacturer} ({category})")
+    keyboard.add("Назад", "Корзина", "Главное меню")
+    return keyboard
+
+def build_flavor_lines_keyboard(catalog, category, manufacturer):
+    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for line in catalog.flavor_lines(category, manufacturer):
+        keyboard.add(f"{manufacturer} - {line} ({category})")
+    keyboard.add("Назад", "Корзина", "Главное меню")
+    return keyboard
+
+def build_products_keyboard(catalog, category, manufacturer, flavor_line):
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=2)
+    for p in catalog.products(category, manufacturer, flavor_line):
+        keyboard.add(telebot.types.InlineKeyboardButton(text=p.description, callback_data=f"add_to_cart_{p.id}"))
+    keyboard.add(telebot.types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"back_to_manufacturers_{category}"))
+    return keyboard
+
+@router.message('Каталог')
 @update_last_seen
 def show_categories(message):
-    with CACHE_LOCK:
-        data = utils.CATALOG_CACHE
-    
-    # Фильтруем категории, где есть товары > 0
-    categories = sorted(list(set(
-        item['Категория'] for item in data 
-        if item.get('Категория') and int(item.get('Количество', 0)) > 0
-    )))
+    # Категории, где есть товары > 0, посчитаны заранее при обновлении кэша
+    categories = get_catalog().categories()
     
     if not categories:
         bot.send_message(message.chat.id, "Каталог пуст.")
         return
 
-    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    for category in categories:
-        keyboard.add(category)
-    keyboard.add("Главное меню")
-    
+    keyboard = cached_markup(('categories',), build_categories_keyboard)
     bot.send_message(message.chat.id, "Выберите категорию:", reply_markup=keyboard)
 
-@bot.message_handler(regexp='^Назад$')
+@router.message('Назад')
 @update_last_seen
 def back_handler(message):
     # Универсальная кнопка назад возвращает в категории
     show_categories(message)
 
 # Обработчик Категорий (показывает Производителей)
-@bot.message_handler(func=lambda message: message.text in {item.get('Категория') for item in utils.CATALOG_CACHE})
+@router.message(lookup=lambda text: get_catalog().is_category(text))
 @update_last_seen
 def show_manufacturers(message):
     category = message.text
-    with CACHE_LOCK:
-        data = utils.CATALOG_CACHE
-        
-    manufacturers = sorted(list(set(
-        item['Производитель'] for item in data 
-        if item.get('Категория') == category and int(item.get('Количество', 0)) > 0
-    )))
+    manufacturers = get_catalog().manufacturers(category)
     
     if not manufacturers:
         bot.send_message(message.chat.id, "Нет товаров.")
         return
         
-    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    for manufacturer in manufacturers:
-        keyboard.add(f"Производитель: {manufacturer} ({category})")
-    keyboard.add("Назад", "Корзина", "Главное меню")
-    
+    keyboard = cached_markup(('manufacturers', category), lambda catalog: build_manufacturers_keyboard(catalog, category))
     bot.send_message(message.chat.id, f"Категория '{category}':", reply_markup=keyboard)
 
 # Обработчик Производителей (показывает Линейки)
-@bot.message_handler(regexp='^Производитель: ')
+@router.message(prefix='Производитель: ')
 @update_last_seen
 def show_flavor_lines(message):
     try:
@@ -129,13 +147,10 @@ def show_flavor_lines(message):
         manufacturer = parts[0]
         category = parts[1][:-1]
         
-        with CACHE_LOCK:
-            data = utils.CATALOG_CACHE
-            
-        flavor_lines = sorted(list(set(
-            item['Линейка'] for item in data 
-            if item['Производитель'] == manufacturer and item['Категория'] == category
-        )))
+        flavor_lines = get_catalog().flavor_lines(category, manufacturer)
+        if not flavor_lines:
+            bot.send_message(message.chat.id, "Товары закончились.")
+            return
         
         # Если линейка всего одна - сразу показываем товары (оптимизация кликов)
         if len(flavor_lines) == 1:
@@ -145,31 +160,35 @@ def show_flavor_lines(message):
             show_products_by_flavor_line(message)
             return
 
-        keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-        for line in flavor_lines:
-            keyboard.add(f"{manufacturer} - {line} ({category})")
-        keyboard.add("Назад", "Корзина", "Главное меню")
-        
+        keyboard = cached_markup(('flavor_lines', category, manufacturer),
+                                 lambda catalog: build_flavor_lines_keyboard(catalog, category, manufacturer))
         bot.send_message(message.chat.id, f"Линейки {manufacturer}:", reply_markup=keyboard)
     except Exception as e:
         print(f"Ошибка навигации: {e}")
 
+def parse_flavor_line_label(text):
+    """Разбирает кнопку "Производитель - Линейка (Категория)". Возвращает (категория, производитель, линейка) или None."""
+    if ' - ' not in text or text.startswith('Производитель: ') or not text.endswith(')'):
+        return None
+    manufacturer, rest = text.split(' - ', 1) # rest = "Линейка (Категория)"
+    if ' (' not in rest:
+        return None
+    flavor_line, category = rest.split(' (', 1)
+    return category[:-1], manufacturer, flavor_line
+
+def is_flavor_line_label(text):
+    parsed = parse_flavor_line_label(text)
+    return parsed is not None and get_catalog().has_flavor_line(*parsed)
+
 # Обработчик Линеек (показывает Товары)
 # Ловит строки вида "Производитель - Линейка (Категория)"
-@bot.message_handler(func=lambda message: ' - ' in message.text and not message.text.startswith('Производитель: '))
+@router.message(lookup=is_flavor_line_label)
 @update_last_seen
 def show_products_by_flavor_line(message):
     try:
-        parts = message.text.split(' - ')
-        manufacturer = parts[0]
-        rest = parts[1] # "Линейка (Категория)"
-        flavor_line = rest.split(' (')[0]
-        category = rest.split(' (')[1][:-1]
+        category, manufacturer, flavor_line = parse_flavor_line_label(message.text)
 
-        with CACHE_LOCK:
-            data = utils.CATALOG_CACHE
-            
-        products = [item for item in data if item['Производитель'] == manufacturer and item['Линейка'] == flavor_line and item['Категория'] == category and int(item.get('Количество', 0)) > 0]
+        products = get_catalog().products(category, manufacturer, flavor_line)
         
         if not products:
             bot.send_message(message.chat.id, "Товары закончились.")
@@ -177,19 +196,16 @@ def show_products_by_flavor_line(message):
 
         # Показываем первый товар как "витрину" с фото
         first_item = products[0]
-        info_text = f"**{escape_markdown(first_item['Название'])}**\n" \
-                    f"Цена: {first_item['Цена']} zl."
+        info_text = f"**{escape_markdown(first_item.name)}**\n" \
+                    f"Цена: {first_item.price} zl."
         
         # Кнопки для ВСЕХ товаров этой линейки (вкусов)
-        keyboard = telebot.types.InlineKeyboardMarkup(row_width=2)
-        for p in products:
-            keyboard.add(telebot.types.InlineKeyboardButton(text=p['Описание'], callback_data=f"add_to_cart_{p['id']}"))
+        keyboard = cached_markup(('products', category, manufacturer, flavor_line),
+                                 lambda catalog: build_products_keyboard(catalog, category, manufacturer, flavor_line))
         
-        keyboard.add(telebot.types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"back_to_manufacturers_{category}"))
-        
-        if first_item['URL_фото']:
+        if first_item.photo_url:
             try:
-                bot.send_photo(message.chat.id, first_item['URL_фото'], caption=info_text, parse_mode="Markdown", reply_markup=keyboard)
+                send_product_photo(message.chat.id, first_item.photo_url, caption=info_text, parse_mode="Markdown", reply_markup=keyboard)
             except:
                 bot.send_message(message.chat.id, info_text, parse_mode="Markdown", reply_markup=keyboard)
         else:
@@ -198,7 +214,7 @@ def show_products_by_flavor_line(message):
     except Exception as e:
         print(f"Ошибка отображения товаров: {e}")
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('back_to_manufacturers_'))
+@router.callback(prefix='back_to_manufacturers_')
 def back_to_manufacturers_callback(call):
     bot.answer_callback_query(call.id)
     cat = call.data.replace('back_to_manufacturers_', '')
@@ -214,84 +230,58 @@ def back_to_manufacturers_callback(call):
 #        КОРЗИНА
 # ==========================================
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('add_to_cart_'))
+@router.callback(prefix='add_to_cart_')
 @update_last_seen
 def add_to_cart_handler(call):
     product_id = call.data.replace('add_to_cart_', '')
     user_id = call.from_user.id
     
-    with CACHE_LOCK:
-        all_items = {str(item['id']).strip(): item for item in utils.CATALOG_CACHE}
-    
-    item = all_items.get(product_id)
-    if item and int(item['Количество']) > 0:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Проверяем текущее кол-во в корзине
-        cur.execute("SELECT quantity FROM cart_items WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-        res = cur.fetchone()
-        current_qty = res['quantity'] if res else 0
-        
-        if current_qty < int(item['Количество']):
-            cur.execute("INSERT OR REPLACE INTO cart_items (user_id, product_id, quantity) VALUES (?, ?, ?)", 
-                        (user_id, product_id, current_qty + 1))
-            conn.commit()
+    item = get_catalog().get(product_id)
+    if item and item.stock > 0:
+        if cart_increment(user_id, product_id, item.stock) is not None:
             bot.answer_callback_query(call.id, "✅ Добавлено!")
         else:
             bot.answer_callback_query(call.id, "❌ Больше нет в наличии.")
-        conn.close()
     else:
         bot.answer_callback_query(call.id, "❌ Товар закончился.")
 
-@bot.message_handler(regexp='^Корзина$')
+@router.message('Корзина')
 @update_last_seen
 def show_cart(message):
     update_cart_message(message.from_user.id, message.chat.id, message.message_id)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('change_qty_') or call.data in ['clear_cart', 'ignore'])
+@router.callback('clear_cart', 'ignore', prefix='change_qty_')
 def modify_cart(call):
     if call.data == 'ignore': 
         bot.answer_callback_query(call.id)
         return
 
     user_id = call.from_user.id
-    conn = get_db_connection()
     
     if call.data == 'clear_cart':
-        conn.execute("DELETE FROM cart_items WHERE user_id = ?", (user_id,))
+        cart_clear(user_id)
         bot.answer_callback_query(call.id, "Корзина очищена.")
         bot.delete_message(call.message.chat.id, call.message.message_id)
         bot.send_message(user_id, "Ваша корзина пуста.")
-    else:
-        action, item_id = call.data.replace('change_qty_', '').split('_', 1)
-        
-        if action == 'increase':
-            with CACHE_LOCK:
-                item = next((i for i in utils.CATALOG_CACHE if str(i['id']) == item_id), None)
+        return
+
+    action, item_id = call.data.replace('change_qty_', '').split('_', 1)
+    
+    if action == 'increase':
+        item = get_catalog().get(item_id)
+        if not item or cart_increment(user_id, item_id, item.stock) is None:
+            bot.answer_callback_query(call.id, "Максимум доступно.")
             
-            cur_qty = conn.execute("SELECT quantity FROM cart_items WHERE user_id=? AND product_id=?", (user_id, item_id)).fetchone()
-            if item and cur_qty and cur_qty['quantity'] < int(item['Количество']):
-                conn.execute("UPDATE cart_items SET quantity = quantity + 1 WHERE user_id=? AND product_id=?", (user_id, item_id))
-            else:
-                bot.answer_callback_query(call.id, "Максимум доступно.")
-                
-        elif action == 'decrease':
-            cur_qty = conn.execute("SELECT quantity FROM cart_items WHERE user_id=? AND product_id=?", (user_id, item_id)).fetchone()
-            if cur_qty and cur_qty['quantity'] > 1:
-                conn.execute("UPDATE cart_items SET quantity = quantity - 1 WHERE user_id=? AND product_id=?", (user_id, item_id))
-            else:
-                conn.execute("DELETE FROM cart_items WHERE user_id=? AND product_id=?", (user_id, item_id))
-                
-        elif action == 'remove':
-            conn.execute("DELETE FROM cart_items WHERE user_id=? AND product_id=?", (user_id, item_id))
+    elif action == 'decrease':
+        cart_decrement(user_id, item_id)
+            
+    elif action == 'remove':
+        cart_remove(user_id, item_id)
             
-    conn.commit()
-    conn.close()
     update_cart_message(user_id, call.message.chat.id, call.message.message_id)
 
 # Промокоды
-@bot.callback_query_handler(func=lambda call: call.data == 'apply_promo')
+@router.callback('apply_promo')
 def promo_prompt(call):
     bot.answer_callback_query(call.id)
     msg = bot.send_message(call.from_user.id, "Введите промокод:")
@@ -314,7 +304,7 @@ def process_promo(message, chat_id, message_id):
 #        ОФОРМЛЕНИЕ ЗАКАЗА
 # ==========================================
 
-@bot.callback_query_handler(func=lambda call: call.data == 'checkout')
+@router.callback('checkout')
 @update_last_seen
 def checkout_handler(call):
     uid = call.from_user.id
@@ -331,7 +321,7 @@ def checkout_handler(call):
     bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, 
                           text="Выберите способ доставки:", reply_markup=kb)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('delivery_'))
+@router.callback(prefix='delivery_')
 def delivery_handler(call):
     uid = call.from_user.id
     method = call.data.replace('delivery_', '')
@@ -348,7 +338,7 @@ def delivery_handler(call):
     bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, 
                           text=f"Доставка: **{method}**.\nВыберите оплату:", parse_mode="Markdown", reply_markup=kb)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('payment_'))
+@router.callback(prefix='payment_')
 def payment_handler(call):
     uid = call.from_user.id
     pay_method = call.data.replace('payment_', '')
@@ -362,8 +352,7 @@ def payment_handler(call):
     if not cart: return
 
     # Подготовка данных заказа
-    with CACHE_LOCK:
-        all_items = {str(item['id']).strip(): item for item in utils.CATALOG_CACHE}
+    all_items = get_catalog().by_id
 
     subtotal = 0
     items_list_ids = []
@@ -371,69 +360,73 @@ def payment_handler(call):
 
     for pid, qty in cart.items():
         if pid in all_items:
-            subtotal += int(all_items[pid]['Цена']) * qty
+            subtotal += all_items[pid].price * qty
             items_list_ids.extend([pid] * qty)
             items_msg_list[pid] += qty
             
-    # --- ИТОГОВЫЙ РАСЧЕТ СКИДОК ---
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT promo_code FROM cart_items WHERE user_id = ? LIMIT 1", (uid,))
-    res = cursor.fetchone()
-    promo_code = res['promo_code'] if res else None
-    
-    final_price = float(subtotal)
-    discount_val = 0.0
-    
-    # 1. Промокод
-    if promo_code:
-        cursor.execute("SELECT discount_percent FROM promo_codes WHERE code = ? AND uses_left > 0", (promo_code,))
-        disc = cursor.fetchone()
-        if disc:
-            pct = disc['discount_percent']
-            discount_val = final_price * (pct / 100)
-            final_price -= discount_val
-            cursor.execute("UPDATE promo_codes SET uses_left = uses_left - 1 WHERE code = ?", (promo_code,))
-            conn.commit()
-
-    # 2. Объем
-    vol_disc, _ = calculate_volume_discount(cart, all_items)
-    final_price -= vol_disc
-    if final_price < 0: final_price = 0
-    
-    shipping = 16 if del_method == 'inpost' else 0
-    total_with_ship = final_price + shipping
-    
-    # Сохранение
     order_id = str(uuid.uuid4().hex[:6])
     date_str = datetime.now().strftime("%Y-%m-%d")
-    items_str = "; ".join(items_list_ids)
-    
-    orders_sheet.append_row([order_id, uid, call.from_user.username, items_str, total_with_ship, 'Оформлен', del_method, pay_method, date_str])
-    
-    # --- ПАРТНЕРСКИЕ НАЧИСЛЕНИЯ (ЗАПИСЬ) ---
-    cursor.execute("SELECT referrer_id FROM referrals WHERE referred_id = ?", (uid,))
-    ref = cursor.fetchone()
-    if ref:
-        partner_id = ref[0]
-        if is_partner(partner_id):
-            item_names = "; ".join([all_items.get(pid, {}).get('Название', pid) for pid in items_list_ids])
+    partner_id = None
+
+    # Всё оформление - одна транзакция: промокод, заказ, партнерская запись и очистка корзины
+    # либо применяются вместе, либо не применяются вовсе. В Google Таблицу заказ попадет в фоне.
+    with db_connection() as conn:
+        cursor = conn.cursor()
+
+        # --- ИТОГОВЫЙ РАСЧЕТ СКИДОК ---
+        cursor.execute("SELECT promo_code FROM cart_items WHERE user_id = ? AND promo_code IS NOT NULL LIMIT 1", (uid,))
+        res = cursor.fetchone()
+        promo_code = res['promo_code'] if res else None
+
+        final_price = float(subtotal)
+        discount_val = 0.0
+
+        # 1. Промокод
+        if promo_code:
+            cursor.execute("SELECT discount_percent FROM promo_codes WHERE code = ? AND uses_left > 0", (promo_code,))
+            disc = cursor.fetchone()
+            if disc:
+                pct = disc['discount_percent']
+                discount_val = final_price * (pct / 100)
+                final_price -= discount_val
+                cursor.execute("UPDATE promo_codes SET uses_left = uses_left - 1 WHERE code = ?", (promo_code,))
+
+        # 2. Объем
+        vol_disc, _ = calculate_volume_discount(cart, all_items)
+        final_price -= vol_disc
+        if final_price < 0: final_price = 0
+
+        shipping = 16 if del_method == 'inpost' else 0
+        total_with_ship = final_price + shipping
+
+        # Сохранение
+        order_items = [(pid, all_items[pid].name, all_items[pid].price, qty) for pid, qty in items_msg_list.items()]
+        insert_order(conn, order_id, uid, call.from_user.username, order_items, total_with_ship, del_method, pay_method,
+                     promo_code=promo_code, discount=discount_val + vol_disc)
+
+        # --- ПАРТНЕРСКИЕ НАЧИСЛЕНИЯ (ЗАПИСЬ) ---
+        cursor.execute("SELECT referrer_id FROM referrals WHERE referred_id = ?", (uid,))
+        ref = cursor.fetchone()
+        if ref and is_partner(ref[0]):
+            partner_id = ref[0]
+            item_names = "; ".join([all_items[pid].name if pid in all_items else pid for pid in items_list_ids])
             cursor.execute("INSERT INTO referred_orders (order_id, partner_id, buyer_id, order_amount, commission_amount, order_items, order_date) VALUES (?, ?, ?, ?, 0, ?, ?)", 
                            (order_id, partner_id, uid, total_with_ship, item_names, date_str))
-            conn.commit()
-            try:
-                bot.send_message(partner_id, f"🔔 Новый заказ от реферала!\nСумма: {total_with_ship:.2f} zl\n(Комиссия после подтверждения)")
-            except: pass
-            
-    conn.execute("DELETE FROM cart_items WHERE user_id = ?", (uid,))
-    conn.commit()
-    conn.close()
+
+        cart_clear(uid, conn)
+
+    notify_orders_mirror()
+
+    if partner_id:
+        try:
+            bot.send_message(partner_id, f"🔔 Новый заказ от реферала!\nСумма: {total_with_ship:.2f} zl\n(Комиссия после подтверждения)")
+        except: pass
 
     # Уведомление Менеджера
     msg_man = (f"🆕 **ЗАКАЗ** `{order_id}`\nUser: @{escape_markdown(call.from_user.username)} (ID:{uid})\n"
                f"Доставка: {del_method}\nОплата: {pay_method}\n\nСостав:\n")
     for pid, c in items_msg_list.items():
-        name = all_items.get(pid, {}).get('Название', pid)
+        name = all_items[pid].name if pid in all_items else pid
         msg_man += f"• {name} x{c}\n"
     msg_man += f"\nИтого: **{total_with_ship:.2f}** zl."
     
@@ -455,7 +448,7 @@ def payment_handler(call):
 #        ПОДТВЕРЖДЕНИЕ ЗАКАЗА (Менеджером)
 # ==========================================
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_'))
+@router.callback(prefix='confirm_')
 def confirm_order_handler(call):
     # Эта функция работает от лица менеджера, но находится здесь для целостности процесса покупки
     if call.from_user.id != MANAGER_ID: return
@@ -466,60 +459,61 @@ def confirm_order_handler(call):
     
     def process_background():
         try:
-            cell = orders_sheet.find(order_id)
-            if not cell: raise ValueError("Не найден")
-            
-            # Списание остатков
-            row_vals = orders_sheet.row_values(cell.row)
-            if row_vals[5] == "Подтверждён": return
-            
-            items = str(row_vals[3]).split('; ')
-            cnt = Counter(items)
-            for pid, count in cnt.items():
-                p_cell = sheet.find(pid)
-                if p_cell:
-                    curr = int(sheet.cell(p_cell.row, 5).value or 0)
-                    sheet.update_cell(p_cell.row, 5, curr - count)
-            
-            orders_sheet.update_cell(cell.row, 6, "Подтверждён")
-            
-            # Начисление комиссии партнеру
-            conn = get_db_connection()
-            ref_ord = conn.execute("SELECT partner_id, order_amount FROM referred_orders WHERE order_id=?", (order_id,)).fetchone()
-            if ref_ord:
-                pid, amt = ref_ord['partner_id'], ref_ord['order_amount']
-                pct = conn.execute("SELECT commission_percent FROM users WHERE user_id=?", (pid,)).fetchone()['commission_percent']
-                comm = amt * (pct / 100)
-                conn.execute("UPDATE users SET balance = balance + ? WHERE user_id=?", (comm, pid))
-                conn.execute("UPDATE referred_orders SET commission_amount=? WHERE order_id=?", (comm, order_id))
-                conn.commit()
+            # Сначала статус: подтвердить можно только оформленный заказ, поэтому повторное нажатие,
+            # повтор callback или уже отмененный заказ не спишут остатки еще раз.
+            # Списание ставится в очередь той же транзакцией и выполняется фоновой задачей зеркала:
+            # остатки пишет один поток, а повтор после ошибки Google не спишет заказ дважды.
+            comm = None
+            with db_connection() as conn:
+                if not set_order_status(order_id, STATUS_CONFIRMED, conn, expected=STATUS_NEW):
+                    order = get_order(order_id)
+                    status = order['status'] if order else "не найден"
+                    bot.edit_message_text(call.message.text.replace("⏳ Списываю товары...", "") +
+                                          f"\n\n⚠️ Заказ уже обработан (статус: {status}), остатки не списаны повторно.",
+                                          call.message.chat.id, call.message.message_id)
+                    return
+                enqueue_sheet_job(conn, JOB_STOCK, order_id)
+                ref_ord = conn.execute("SELECT partner_id, order_amount FROM referred_orders WHERE order_id=?", (order_id,)).fetchone()
+                if ref_ord:
+                    pid, amt = ref_ord['partner_id'], ref_ord['order_amount']
+                    pct = conn.execute("SELECT commission_percent FROM users WHERE user_id=?", (pid,)).fetchone()['commission_percent']
+                    comm = amt * (pct / 100)
+                    conn.execute("UPDATE users SET balance = balance + ? WHERE user_id=?", (comm, pid))
+                    conn.execute("UPDATE referred_orders SET commission_amount=? WHERE order_id=?", (comm, order_id))
+            notify_orders_mirror()
+
+            if comm is not None:
                 try: bot.send_message(pid, f"💰 Начислено: {comm:.2f} zl за заказ {order_id}")
                 except: pass
-            conn.close()
             
-            bot.edit_message_text(call.message.text.replace("⏳ Списываю товары...", "") + "\n\n✅ ЗАКАЗ ПОДТВЕРЖДЁН", call.message.chat.id, call.message.message_id)
+            result = "\n\n✅ ЗАКАЗ ПОДТВЕРЖДЁН\n⏳ Остатки списываются в фоне (о несписанных товарах придет сообщение)."
+            bot.edit_message_text(call.message.text.replace("⏳ Списываю товары...", "") + result, call.message.chat.id, call.message.message_id)
         except Exception as e:
             bot.send_message(call.message.chat.id, f"Ошибка: {e}")
+        finally:
+            close_db_connection()   # Поток одноразовый - соединение ему больше не нужно
 
     threading.Thread(target=process_background).start()
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('cancel_'))
+@router.callback(prefix='cancel_')
 def cancel_order_handler(call):
     if call.from_user.id != MANAGER_ID: return
     oid = call.data.replace('cancel_', '')
     try:
-        cell = orders_sheet.find(oid)
-        if cell: 
-            orders_sheet.update_cell(cell.row, 6, "Отменён")
-            bot.edit_message_text(call.message.text + "\n\n❌ ОТМЕНЁН", call.message.chat.id, call.message.message_id)
-            
-            # Уведомление партнера об отмене
-            conn = get_db_connection()
-            ref = conn.execute("SELECT partner_id FROM referred_orders WHERE order_id=?", (oid,)).fetchone()
-            if ref:
-                try: bot.send_message(ref[0], f"❌ Заказ {oid} отменен. Комиссии не будет.")
-                except: pass
-            conn.close()
+        cancelled, partner_id, commission = cancel_order(oid)
+        if not cancelled:
+            order = get_order(oid)
+            bot.answer_callback_query(call.id, f"Заказ уже {order['status']}" if order else "Заказ не найден")
+            return
+        notify_orders_mirror()
+        bot.edit_message_text(call.message.text + "\n\n❌ ОТМЕНЁН", call.message.chat.id, call.message.message_id)
+
+        # Уведомление партнера об отмене
+        if partner_id:
+            text = (f"❌ Заказ {oid} отменен. Начисленная комиссия {commission:.2f} zl списана с баланса." if commission
+                    else f"❌ Заказ {oid} отменен. Комиссии не будет.")
+            try: bot.send_message(partner_id, text)
+            except: pass
     except Exception as e:
         bot.send_message(call.message.chat.id, f"Ошибка: {e}")
 
@@ -527,26 +521,24 @@ def cancel_order_handler(call):
 #        ЛИЧНЫЙ КАБИНЕТ
 # ==========================================
 
-@bot.message_handler(regexp='^Мои заказы 📋$')
+@router.message('Мои заказы 📋')
 @update_last_seen
 def my_orders(message):
     uid = message.from_user.id
     try:
-        orders = [o for o in orders_sheet.get_all_records() if str(o.get('ID Пользователя')) == str(uid)]
+        orders = get_user_orders(uid)
         if not orders:
             bot.send_message(uid, "История пуста.")
             return
             
         text = "📋 *Ваши заказы:*\n\n"
-        with CACHE_LOCK: all_items = {str(i['id']).strip(): i for i in utils.CATALOG_CACHE}
+        all_items = get_catalog().by_id
         
-        for o in orders:
-            text += f"🆔 `{o['ID Заказа']}` | {o['Дата']} | {o['Сумма']} zl | {o['Статус']}\n"
-            items = str(o['Состав заказа']).split('; ')
-            cnt = Counter(items)
-            for pid, c in cnt.items():
-                name = all_items.get(pid.strip(), {}).get('Название', pid)
-                text += f" • {name} x{c}\n"
+        for o, items in orders:
+            text += f"🆔 `{o['order_id']}` | {(o['created_at'] or '')[:10]} | {o['total']:g} zl | {o['status']}\n"
+            for pid, name, c in items:
+                item = all_items.get(pid)
+                text += f" • {item.name if item else name} x{c}\n"
             text += "\n"
         
         for chunk in telebot.util.smart_split(text, 3000):
@@ -554,7 +546,7 @@ def my_orders(message):
     except Exception as e:
         bot.send_message(uid, f"Ошибка: {e}")
 
-@bot.message_handler(regexp='^Партнерская программа 📈$')
+@router.message('Партнерская программа 📈')
 @update_last_seen
 def partner_program(message):
     uid = message.from_user.id
@@ -575,7 +567,7 @@ def partner_program(message):
     kb.add(telebot.types.InlineKeyboardButton("Вывести средства 💸", callback_data="request_withdrawal"))
     bot.send_message(uid, text, parse_mode="Markdown", reply_markup=kb)
 
-@bot.callback_query_handler(func=lambda c: c.data == 'request_withdrawal')
+@router.callback('request_withdrawal')
 def withdrawal_handler(call):
     msg = bot.send_message(call.from_user.id, "Введите: `СУММА РЕКВИЗИТЫ`", parse_mode="Markdown")
     bot.register_next_step_handler(msg, process_withdrawal)
@@ -598,7 +590,7 @@ def process_withdrawal(message):
     except:
         bot.reply_to(message, "Ошибка формата.")
 
-@bot.message_handler(func=lambda m: True)
+@router.fallback
 @update_last_seen
 def unknown(message):
     # Ловит всё, что не подошло под фильтры
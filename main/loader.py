@@ -1,24 +1,48 @@
 import telebot
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from config import API_TOKEN, GOOGLE_CREDENTIALS_FILE, SHEET_NAME_CATALOG, SHEET_NAME_ORDERS
+from utils.router import Router
+from utils.sheets_client import SheetsClient
+from database.database import release_db_connection
+from config import (
+    API_TOKEN, GOOGLE_CREDENTIALS_FILE, SHEET_NAME_CATALOG, SHEET_NAME_ORDERS,
+    SHEETS_BACKEND, FAKE_SHEETS_LATENCY, FAKE_SHEETS_ERROR_RATE
+)
 
 # 1. Инициализация бота
 bot = telebot.TeleBot(API_TOKEN)
 
+# Единый маршрутизатор: хэндлеры регистрируются через @router.*, telebot видит только два обработчика
+router = Router()
+router.install(bot)
+# После каждого апдейта возвращаем соединение с БД в чистое состояние
+router.teardown(release_db_connection)
+
 # 2. Подключение к Google Таблицам
 scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
 
-try:
+def _open_google_sheets():
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     # Авторизация
     creds = ServiceAccountCredentials.from_json_keyfile_name(GOOGLE_CREDENTIALS_FILE, scope)
     client = gspread.authorize(creds)
     
     # Открываем листы таблиц (названия берутся из config.py)
-    sheet = client.open(SHEET_NAME_CATALOG).sheet1
-    orders_sheet = client.open(SHEET_NAME_ORDERS).sheet1
-    
-    print("✅ Успешное подключение к Google Таблицам")
+    return client.open(SHEET_NAME_CATALOG).sheet1, client.open(SHEET_NAME_ORDERS).sheet1
+
+try:
+    if SHEETS_BACKEND == 'fake':
+        # Локальная замена без сети и ключа (для тестов и замеров), см. utils/fake_sheets.py
+        from utils.fake_sheets import open_fake_sheets
+        catalog_ws, orders_ws = open_fake_sheets(FAKE_SHEETS_LATENCY, FAKE_SHEETS_ERROR_RATE)
+        print("⚠️ Используются локальные тестовые таблицы (SHEETS_BACKEND = 'fake')")
+    else:
+        catalog_ws, orders_ws = _open_google_sheets()
+        print("✅ Успешное подключение к Google Таблицам")
+
+    # Листы оборачиваются в SheetsClient: общая квота, повторы при 429, счетчики (utils/sheets_client.py)
+    sheet = SheetsClient(catalog_ws, 'catalog')
+    orders_sheet = SheetsClient(orders_ws, 'orders')
     
 except Exception as e:
     print(f"❌ КРИТИЧЕСКАЯ ОШИБКА подключения к Google Таблицам: {e}")
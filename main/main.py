@@ -1,10 +1,22 @@
+import signal
+import sys
 import threading
 import time
 
 # Импорты настроек и утилит
 from loader import bot
-from database.database import init_db
-from utils.utils import periodic_cache_update, periodic_backup_task, update_catalog_cache
+from database.database import init_db, load_role_cache
+from database.explain import explain_queries
+from database.backup import print_backup_check
+from database.sales import rebuild_sales
+from utils.utils import (
+    periodic_cache_update, periodic_backup_task, update_catalog_cache, load_catalog_snapshot,
+    load_known_users, periodic_last_seen_flush, flush_last_seen, get_catalog
+)
+from utils.orders_mirror import periodic_orders_mirror, import_orders_history, rebuild_order_rows
+from utils.bench import run_benchmarks
+from utils.broadcast import resume_broadcasts
+from utils.webhook import start_webhook, stop_webhook
 
 # ВАЖНО: Импортируем хэндлеры, чтобы декораторы сработали и зарегистрировали команды
 # (Если эти строки удалить, бот не будет реагировать на сообщения)
@@ -12,28 +24,69 @@ import handlers.handlers_admin
 import handlers.handlers_user
 
 if __name__ == "__main__":
+    # Диагностика: python main.py --explain - планы всех SQL-запросов хэндлеров
+    if '--explain' in sys.argv:
+        init_db()
+        sys.exit(1 if explain_queries() else 0)
+
+    # Пересчет агрегатов статистики по всей истории заказов: python main.py --rebuild-stats
+    if '--rebuild-stats' in sys.argv:
+        init_db()
+        print(f"✅ Агрегаты продаж пересчитаны ({rebuild_sales()} дней с заказами).")
+        sys.exit(0)
+
+    # Замеры с локальными таблицами и временной БД: python main.py --bench (нужен SHEETS_BACKEND = 'fake')
+    if '--bench' in sys.argv:
+        sys.exit(0 if run_benchmarks() else 1)
+
+    # Проверка восстановления: python main.py --verify-backup <файл.db.gz>
+    if '--verify-backup' in sys.argv:
+        paths = sys.argv[sys.argv.index('--verify-backup') + 1:]
+        if not paths:
+            print("Укажите файл бэкапа: python main.py --verify-backup backup.db.gz")
+            sys.exit(2)
+        sys.exit(0 if all([print_backup_check(p) for p in paths]) else 1)
+
     print("--- 🚀 Запуск системы бота ---")
 
     # 1. Инициализация и миграция Базы Данных
     try:
         init_db()
+        load_role_cache()
+        load_known_users()
         print("--- ✅ База данных проверена и готова ---")
     except Exception as e:
         print(f"--- ❌ Ошибка инициализации БД: {e}")
         exit(1)
 
     # 2. Первичное наполнение кэша
-    # (Делаем это до запуска бота, чтобы пользователи не ждали загрузки)
-    print("--- ⏳ Загружаю каталог из Google Таблиц... ---")
-    if update_catalog_cache():
-        print("--- ✅ Кэш каталога успешно загружен ---")
+    # Если есть локальный снимок - стартуем с него сразу, свежие данные подтянет фоновый поток.
+    # Иначе загружаем каталог до запуска бота, чтобы пользователи не ждали загрузки.
+    if load_catalog_snapshot():
+        print("--- ✅ Каталог загружен из локального снимка, обновление из Google пойдет в фоне ---")
     else:
-        print("--- ⚠️ ВНИМАНИЕ: Не удалось загрузить кэш. Проверьте соединение с Google. ---")
+        print("--- ⏳ Загружаю каталог из Google Таблиц... ---")
+        if update_catalog_cache():
+            print("--- ✅ Кэш каталога успешно загружен ---")
+        else:
+            print("--- ⚠️ ВНИМАНИЕ: Не удалось загрузить кэш. Проверьте соединение с Google. ---")
+
+    # Первый запуск с локальной таблицей заказов: переносим историю из Google Таблицы
+    try:
+        import_orders_history(get_catalog())
+    except Exception as e:
+        print(f"--- ⚠️ Не удалось импортировать историю заказов: {e}")
+
+    # Индекс "заказ -> строка таблицы" для обновления статусов без поиска по всей таблице
+    try:
+        print(f"--- ✅ Индекс строк таблицы заказов: {rebuild_order_rows()} заказов ---")
+    except Exception as e:
+        print(f"--- ⚠️ Индекс строк таблицы заказов будет построен позже: {e}")
 
     # 3. Запуск фоновых задач (Threads)
     # daemon=True означает, что потоки закроются сами, когда мы остановим основной скрипт
     
-    # Поток обновления кэша (раз в 10 мин)
+    # Поток обновления кэша (проверка таблицы раз в CATALOG_SYNC_INTERVAL сек.)
     cache_thread = threading.Thread(target=periodic_cache_update, daemon=True)
     cache_thread.start()
     
@@ -41,7 +94,37 @@ if __name__ == "__main__":
     backup_thread = threading.Thread(target=periodic_backup_task, daemon=True)
     backup_thread.start()
     
-    print("--- ✅ Фоновые службы (кэш, бэкапы) запущены ---")
+    # Поток пакетной записи времени визитов пользователей
+    last_seen_thread = threading.Thread(target=periodic_last_seen_flush, daemon=True)
+    last_seen_thread.start()
+    
+    # Поток зеркалирования заказов в Google Таблицу
+    orders_mirror_thread = threading.Thread(target=periodic_orders_mirror, daemon=True)
+    orders_mirror_thread.start()
+    
+    print("--- ✅ Фоновые службы (кэш, бэкапы, визиты, заказы) запущены ---")
+
+    # Рассылки, прерванные прошлой остановкой бота, продолжаются с сохраненного места
+    resumed = resume_broadcasts()
+    if resumed:
+        print(f"--- 📣 Продолжаю незавершенные рассылки: {resumed} ---")
+
+    # 4a. Прием обновлений через webhook: python main.py --webhook
+    if '--webhook' in sys.argv:
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+        try:
+            start_webhook()
+            print("--- 🤖 Бот запущен в режиме webhook! Нажмите Ctrl+C для остановки. ---")
+            while not stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print("\n--- 🛑 Бот остановлен пользователем ---")
+        finally:
+            # Дорабатываем принятые обновления и не теряем визиты из буфера
+            stop_webhook()
+            flush_last_seen()
+        sys.exit(0)
 
     # 4. Запуск бесконечного цикла прослушивания сообщений
     print("--- 🤖 Бот запущен и ожидает сообщений! Нажмите Ctrl+C для остановки. ---")
@@ -52,4 +135,7 @@ if __name__ == "__main__":
         print(f"❌ Критическая ошибка в работе бота: {e}")
         time.sleep(5)
     except KeyboardInterrupt:
-        print("\n--- 🛑 Бот остановлен пользователем ---")
\ No newline at end of file
+        print("\n--- 🛑 Бот остановлен пользователем ---")
+    finally:
+        # Не теряем визиты, накопленные в буфере
+        flush_last_seen()
\ No newline at end of file
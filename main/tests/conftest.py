@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота импортируются от папки main (как при запуске python main.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+# Ни Telegram, ни Google в тестах не нужны: токен только проходит проверку формата в telebot,
+# листы - локальные (utils/fake_sheets.py)
+config.API_TOKEN = '123456:TEST'
+config.SHEETS_BACKEND = 'fake'
+config.FAKE_SHEETS_LATENCY = 0.0
+config.FAKE_SHEETS_ERROR_RATE = 0.0
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Чистая БД во временной папке со всеми миграциями."""
+    import database.database as database
+    database.close_db_connection()
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / 'test.db'))
+    database.init_db()
+    yield database
+    database.close_db_connection()
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+from database.broadcasts import (
+    make_audience, iter_audience, count_recipients, AUDIENCE_ALL, AUDIENCE_ACTIVE, AUDIENCE_PARTNERS,
+    AUDIENCE_BUYERS, AUDIENCE_NON_BUYERS, AUDIENCE_REFERRALS
+)
+from database.database import db_connection
+
+NOW = datetime(2026, 5, 1, 12, 0, 0)
+
+
+def _ts(days_ago):
+    return (NOW - timedelta(days=days_ago)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _setup():
+    """Пользователи 1..30: партнеры - кратные 10, заблокированный - 15, заказы у кратных 3."""
+    with db_connection() as conn:
+        conn.executemany("INSERT INTO users (user_id, username, last_seen, is_partner, is_blocked) VALUES (?, ?, ?, ?, ?)",
+                         [(i, f"user{i}", _ts(i), int(i % 10 == 0), int(i == 15)) for i in range(1, 31)])
+        conn.executemany("INSERT INTO orders (order_id, user_id, total, status, created_at) VALUES (?, ?, 100, 'Новый', ?)",
+                         [(f"o{i}-{n}", i, _ts(n)) for i in range(3, 31, 3) for n in range(2)])
+        conn.executemany("INSERT INTO referrals (referrer_id, referred_id) VALUES (?, ?)",
+                         [(10, i) for i in (11, 12, 15, 17)] + [(20, 21)])
+
+
+def _all(audience, batch=4):
+    now = NOW.strftime("%Y-%m-%d %H:%M:%S")
+    batches = list(iter_audience(audience, 0, batch, now))
+    assert all(len(b) <= batch for b in batches)
+    recipients = [uid for b in batches for uid in b]
+    assert recipients == sorted(set(recipients))
+    assert count_recipients(audience, now) == len(recipients)
+    return recipients
+
+
+def test_audiences_skip_blocked_users(db):
+    _setup()
+    everyone = [i for i in range(1, 31) if i != 15]
+    assert _all(AUDIENCE_ALL) == everyone
+    assert _all(make_audience(AUDIENCE_ACTIVE, 7)) == list(range(1, 8))
+    assert _all(AUDIENCE_PARTNERS) == [10, 20, 30]
+    assert _all(AUDIENCE_BUYERS) == [i for i in everyone if i % 3 == 0]
+    assert _all(AUDIENCE_NON_BUYERS) == [i for i in everyone if i % 3]
+    assert _all(make_audience(AUDIENCE_REFERRALS, 10)) == [11, 12, 17]
+
+
+def test_iteration_resumes_after_cursor(db):
+    _setup()
+    now = NOW.strftime("%Y-%m-%d %H:%M:%S")
+    batches = list(iter_audience(AUDIENCE_BUYERS, 12, 2, now))
+    assert batches == [[18, 21], [24, 27], [30]]
+
+
+def test_blocked_user_drops_out_mid_broadcast(db):
+    _setup()
+    now = NOW.strftime("%Y-%m-%d %H:%M:%S")
+    batches = iter_audience(AUDIENCE_ALL, 0, 5, now)
+    assert next(batches) == [1, 2, 3, 4, 5]
+    with db_connection() as conn:
+        conn.execute("UPDATE users SET is_blocked = 1 WHERE user_id = 6")
+    assert next(batches) == [7, 8, 9, 10, 11]
@@ -0,0 +1,54 @@
+import gzip
+import threading
+
+import database.backup as backup
+from database.database import db_connection, close_db_connection
+
+
+def _fill_users(count):
+    with db_connection() as conn:
+        conn.executemany("INSERT INTO users (user_id, username) VALUES (?, ?)", [(i, f"user{i}") for i in range(1, count + 1)])
+
+
+def test_backup_restores_with_same_rows(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'DB_NAME', db.DB_NAME)
+    _fill_users(500)
+    path, content_hash = backup.create_backup(str(tmp_path))
+    assert path.endswith('.db.gz') and len(content_hash) == 64
+    ok, messages, counts = backup.verify_backup(path)
+    assert ok and messages == ['ok']
+    assert counts['users'] == 500 and 'schema_version' in counts
+
+
+def test_backup_is_consistent_while_writers_run(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'DB_NAME', db.DB_NAME)
+    _fill_users(2000)
+    stop, writes = threading.Event(), []
+
+    def writer():
+        try:
+            while not stop.is_set():
+                with db_connection() as conn:
+                    conn.execute("UPDATE users SET last_seen = datetime('now') WHERE user_id = ?", (len(writes) % 2000 + 1,))
+                writes.append(1)
+        finally:
+            close_db_connection()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        path, _ = backup.create_backup(str(tmp_path))
+    finally:
+        stop.set()
+        thread.join()
+    assert writes                           # Писатель не блокировался на время копирования
+    ok, _, counts = backup.verify_backup(path)
+    assert ok and counts['users'] == 2000
+
+
+def test_verify_reports_damaged_backup(tmp_path):
+    path = tmp_path / 'broken.db.gz'
+    with gzip.open(path, 'wb') as f:
+        f.write(b'SQLite format 3\x00' + b'\x00' * 100)
+    ok, messages, counts = backup.verify_backup(str(path))
+    assert not ok and messages and counts == {}
@@ -0,0 +1,114 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telebot')
+
+from telebot.apihelper import ApiTelegramException
+
+import utils.broadcast as broadcast
+from database.broadcasts import (
+    create_broadcast, get_broadcast, STATUS_DONE, STATUS_CANCELLED, cancel_broadcasts
+)
+from database.database import db_connection
+from utils.sheets_client import TokenBucket
+
+ADMIN_ID = 1
+
+
+def _error(code, retry_after=None):
+    result_json = {'ok': False, 'error_code': code, 'description': 'test'}
+    if retry_after is not None:
+        result_json['parameters'] = {'retry_after': retry_after}
+    return ApiTelegramException('sendMessage', None, result_json)
+
+
+class FakeBot:
+    """Запоминает отправленные сообщения; failures[user_id] - список ошибок для первых попыток."""
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self.lock:
+            errors = self.failures.get(chat_id)
+            if errors:
+                raise errors.pop(0)
+            self.sent.append(chat_id)
+        return SimpleNamespace(message_id=len(self.sent))
+
+    def edit_message_text(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def fake_bot(db, monkeypatch):
+    monkeypatch.setattr(broadcast, 'BUCKET', TokenBucket(1000, 1000))
+    monkeypatch.setattr(broadcast, 'BROADCAST_BATCH', 10)
+    monkeypatch.setattr(broadcast, '_pause_until', 0.0)
+    bot = FakeBot()
+    monkeypatch.setattr(broadcast, 'bot', bot)
+    return bot
+
+
+def _fill_users(count):
+    with db_connection() as conn:
+        conn.executemany("INSERT INTO users (user_id, username) VALUES (?, ?)",
+                         [(i, f"user{i}") for i in range(2, count + 2)])
+
+
+def test_send_one_waits_on_flood_control_and_retries(fake_bot):
+    fake_bot.failures[5] = [_error(429, retry_after=0)]
+    assert broadcast.send_one(5, "hi") == 'sent'
+    assert fake_bot.sent == [5]
+
+
+def test_send_one_reports_blocked_and_failed(fake_bot):
+    fake_bot.failures[5] = [_error(403)]
+    fake_bot.failures[6] = [_error(400)]
+    assert broadcast.send_one(5, "hi") == 'blocked'
+    assert broadcast.send_one(6, "hi") == 'failed'
+
+
+def test_run_broadcast_counts_results_and_marks_blocked(fake_bot):
+    _fill_users(25)
+    fake_bot.failures[7] = [_error(403)]
+    fake_bot.failures[8] = [_error(400)]
+    broadcast_id = create_broadcast(ADMIN_ID, "hi")
+    broadcast.run_broadcast(broadcast_id)
+
+    campaign = get_broadcast(broadcast_id)
+    assert campaign['status'] == STATUS_DONE
+    assert (campaign['sent'], campaign['blocked'], campaign['failed']) == (23, 1, 1)
+    with db_connection() as conn:
+        assert conn.execute("SELECT user_id FROM users WHERE is_blocked = 1").fetchall()[0][0] == 7
+
+
+def test_run_broadcast_resumes_from_saved_cursor(fake_bot):
+    _fill_users(25)
+    broadcast_id = create_broadcast(ADMIN_ID, "hi")
+    with db_connection() as conn:
+        conn.execute("UPDATE broadcasts SET last_user_id = 11, sent = 10 WHERE id = ?", (broadcast_id,))
+    broadcast.run_broadcast(broadcast_id)
+
+    recipients = [uid for uid in fake_bot.sent if uid != ADMIN_ID]
+    assert recipients == list(range(12, 27))
+    assert get_broadcast(broadcast_id)['sent'] == 25
+
+
+def test_cancelled_broadcast_stops_after_current_batch(fake_bot, monkeypatch):
+    _fill_users(40)
+    broadcast_id = create_broadcast(ADMIN_ID, "hi")
+    save_progress = broadcast.save_progress
+
+    def cancel_after_first_batch(*args):
+        cancel_broadcasts()
+        return save_progress(*args)
+
+    monkeypatch.setattr(broadcast, 'save_progress', cancel_after_first_batch)
+    broadcast.run_broadcast(broadcast_id)
+    assert len([uid for uid in fake_bot.sent if uid != ADMIN_ID]) == 10
+    assert get_broadcast(broadcast_id)['status'] == STATUS_CANCELLED
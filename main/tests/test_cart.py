@@ -0,0 +1,57 @@
+import threading
+
+from database.database import (
+    db_connection, close_db_connection, cart_increment, cart_decrement, cart_remove, get_cart_items
+)
+
+
+def test_increment_stops_at_stock(db):
+    assert [cart_increment(1, 'p1', 3) for _ in range(4)] == [1, 2, 3, None]
+    assert get_cart_items(1) == {'p1': 3}
+    assert cart_increment(1, 'p2', 0) is None
+    # Остаток уменьшился ниже количества в корзине - добавить нельзя, но и уменьшать молча не нужно
+    assert cart_increment(1, 'p1', 2) is None
+    assert get_cart_items(1) == {'p1': 3}
+
+
+def test_decrement_to_zero_removes_row(db):
+    cart_increment(1, 'p1', 5)
+    cart_increment(1, 'p1', 5)
+    assert cart_decrement(1, 'p1') == 1
+    assert cart_decrement(1, 'p1') == 0
+    assert get_cart_items(1) == {}
+    assert cart_decrement(1, 'p1') == 0        # Повторное нажатие на пустой позиции
+    cart_increment(1, 'p2', 5)
+    assert cart_remove(1, 'p2') == 0 and get_cart_items(1) == {}
+
+
+def test_new_row_inherits_applied_promo_code(db):
+    cart_increment(1, 'p1', 5)
+    with db_connection() as conn:
+        conn.execute("UPDATE cart_items SET promo_code = 'SALE' WHERE user_id = 1")
+    cart_increment(1, 'p2', 5)
+    with db_connection() as conn:
+        codes = {r['product_id']: r['promo_code'] for r in conn.execute("SELECT * FROM cart_items WHERE user_id = 1")}
+    assert codes == {'p1': 'SALE', 'p2': 'SALE'}
+
+
+def test_concurrent_increments_never_exceed_stock(db):
+    stock, results = 5, []
+    start = threading.Barrier(8)
+
+    def tap():
+        try:
+            start.wait()
+            for _ in range(10):
+                results.append(cart_increment(1, 'p1', stock))
+        finally:
+            close_db_connection()
+
+    threads = [threading.Thread(target=tap) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(r for r in results if r is not None) == [1, 2, 3, 4, 5]
+    assert results.count(None) == 80 - stock
+    assert get_cart_items(1) == {'p1': stock}
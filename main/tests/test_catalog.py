@@ -0,0 +1,76 @@
+import pytest
+
+from utils.catalog import Catalog, Product, diff_catalog, parse_rows, _parse_int
+from utils.fake_sheets import FakeWorksheet, CATALOG_HEADER
+
+
+def _records(rows):
+    return FakeWorksheet('Catalog', [CATALOG_HEADER] + rows).get_all_records()
+
+
+def _row(pid, name='Товар', stock=5, price=25, category='Жидкости'):
+    return [pid, name, '', category, stock, 'Бренд', 'Линейка', price, '']
+
+
+def test_parse_int_accepts_sheet_formats():
+    assert _parse_int('1 200', 'Цена') == 1200
+    assert _parse_int('35,0', 'Цена') == 35
+    assert _parse_int(7, 'Цена') == 7
+    assert _parse_int('', 'Количество', default=0) == 0
+    for bad in ('', 'abc', '12.5', True):
+        with pytest.raises(ValueError):
+            _parse_int(bad, 'Цена')
+
+
+def test_parse_rows_reports_bad_rows_with_sheet_row_numbers():
+    products, errors = parse_rows(_records([
+        _row('p1', price='1 200'),
+        _row('', name='Без id'),
+        _row('p2', price='abc'),
+        _row('p1', name='Повтор'),
+        _row('p3', stock=''),
+        _row('p4', price='12.5'),
+    ]))
+    assert [p.id for p in products] == ['p1', 'p3']
+    assert products[0].price == 1200 and products[0].row == 2
+    assert products[1].stock == 0
+    assert [row for row, _ in errors] == [3, 4, 5, 7]
+
+
+def test_product_round_trips_through_snapshot_tuple():
+    product, = parse_rows(_records([_row('p1', name=' Манго ', stock='12')]))[0]
+    assert product.name == 'Манго' and product.stock == 12 and isinstance(product.price, int)
+    copy = Product.from_tuple(product.to_tuple())
+    assert copy.same_data(product) and copy.row == product.row
+    with pytest.raises(AttributeError):
+        product.extra = 1       # __slots__: у товара нет __dict__
+
+
+def test_diff_catalog_classifies_changes_and_reuses_unchanged():
+    old_products, _ = parse_rows(_records([_row('p1'), _row('p2'), _row('p3'), _row('p4'), _row('p5')]))
+    catalog = Catalog(old_products, version=1)
+
+    new_products, _ = parse_rows(_records([
+        _row('p1'),                 # без изменений
+        _row('p2', price=30),
+        _row('p3', stock=0),
+        _row('p6'),                 # новый, p4 удален
+        _row('p5', name='Новое'),   # переименован и сдвинулся на строку выше
+    ]))
+    diff = diff_catalog(catalog, new_products)
+
+    assert diff.added == ['p6']
+    assert diff.removed == ['p4']
+    assert diff.price_changed == ['p2']
+    assert diff.stock_changed == ['p3']
+    assert diff.changed == ['p5']
+    assert diff.items[0] is catalog.get('p1')
+    assert [p.id for p in diff.items] == ['p1', 'p2', 'p3', 'p6', 'p5']
+
+
+def test_diff_catalog_detects_moved_rows():
+    catalog = Catalog(parse_rows(_records([_row('p1'), _row('p2')]))[0])
+    diff = diff_catalog(catalog, parse_rows(_records([_row('p2'), _row('p1')]))[0])
+    assert sorted(diff.moved) == ['p1', 'p2']
+    assert not diff.is_empty()
+    assert diff_catalog(catalog, catalog.items).is_empty()
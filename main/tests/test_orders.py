@@ -0,0 +1,67 @@
+from database.database import db_connection
+from database.orders import (
+    insert_order, set_order_status, cancel_order, get_order, STATUS_NEW, STATUS_CONFIRMED, STATUS_CANCELLED
+)
+from database.sheet_queue import get_queue_head, JOB_APPEND, JOB_STATUS
+
+
+def _place(order_id, partner_id=None):
+    with db_connection() as conn:
+        insert_order(conn, order_id, 100, 'user', [('p1', 'Товар', 50, 2)], 100, 'pickup', 'cash')
+        if partner_id:
+            conn.execute("INSERT OR IGNORE INTO users (user_id, username, balance, commission_percent, is_partner) "
+                         "VALUES (?, 'partner', 0, 10, 1)", (partner_id,))
+            conn.execute("INSERT INTO referred_orders (order_id, partner_id, buyer_id, order_amount, commission_amount) "
+                         "VALUES (?, ?, 100, 100, 0)", (order_id, partner_id))
+
+
+def _credit_commission(order_id, partner_id, amount):
+    """Как confirm_order_handler: подтверждение и комиссия одной транзакцией."""
+    with db_connection() as conn:
+        set_order_status(order_id, STATUS_CONFIRMED, conn)
+        conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, partner_id))
+        conn.execute("UPDATE referred_orders SET commission_amount = ? WHERE order_id = ?", (amount, order_id))
+
+
+def _balance(partner_id):
+    with db_connection() as conn:
+        return conn.execute("SELECT balance FROM users WHERE user_id = ?", (partner_id,)).fetchone()[0]
+
+
+def test_order_changes_are_queued_for_the_sheet(db):
+    _place('o1')
+    assert set_order_status('o1', STATUS_CONFIRMED)
+    assert [(job['kind'], job['order_id']) for job in get_queue_head(10)] == [(JOB_APPEND, 'o1'), (JOB_STATUS, 'o1')]
+
+
+def test_confirm_only_from_new_status(db):
+    """Повторное нажатие «Подтвердить» или подтверждение отмененного заказа ничего не меняет."""
+    _place('o1')
+    _place('o2')
+    assert set_order_status('o1', STATUS_CONFIRMED, expected=STATUS_NEW)
+    assert not set_order_status('o1', STATUS_CONFIRMED, expected=STATUS_NEW)
+    cancel_order('o2')
+    assert not set_order_status('o2', STATUS_CONFIRMED, expected=STATUS_NEW)
+    assert get_order('o2')['status'] == STATUS_CANCELLED
+
+
+def test_cancel_confirmed_order_reverses_commission(db):
+    _place('o1', partner_id=7)
+    _place('o2', partner_id=7)
+    _credit_commission('o1', 7, 10)
+    _credit_commission('o2', 7, 10)
+
+    assert cancel_order('o1') == (True, 7, 10)
+    assert _balance(7) == 10
+    assert cancel_order('o1') == (False, None, 0)      # Повторная отмена ничего не списывает
+    assert _balance(7) == 10
+    with db_connection() as conn:
+        assert conn.execute("SELECT commission_amount FROM referred_orders WHERE order_id = 'o1'").fetchone()[0] == 0
+    assert get_order('o1')['status'] == STATUS_CANCELLED
+
+
+def test_cancel_new_order_has_no_commission(db):
+    _place('o1', partner_id=7)
+    assert cancel_order('o1') == (True, 7, 0)
+    assert _balance(7) == 0
+    assert cancel_order('missing') == (False, None, 0)
@@ -0,0 +1,144 @@
+import pytest
+
+import utils.orders_mirror as mirror
+import utils.sheets_client as sheets_client
+import utils.stock as stock
+from database.database import db_connection
+from database.orders import insert_order, set_order_status, get_order, STATUS_CANCELLED, STATUS_CONFIRMED, STATUS_NEW, STATUS_NEW
+from database.sheet_queue import enqueue_sheet_job, get_queue_head, JOB_STOCK
+from utils.fake_sheets import FakeWorksheet, ORDERS_HEADER, CATALOG_HEADER
+from utils.sheets_client import SheetsClient, TokenBucket
+
+
+@pytest.fixture
+def orders_ws(db, monkeypatch):
+    """Пустой лист заказов без задержек квоты и пауз между повторами."""
+    worksheet = FakeWorksheet('Orders', [ORDERS_HEADER])
+    monkeypatch.setattr(sheets_client, 'BUCKET', TokenBucket(1000, 1000))
+    monkeypatch.setattr(sheets_client, 'backoff_delay', lambda attempt: 0)
+    monkeypatch.setattr(mirror, 'orders_sheet', SheetsClient(worksheet, 'test_orders'))
+    monkeypatch.setattr(mirror, 'ORDER_ROWS', {})
+    monkeypatch.setattr(mirror, '_rows_loaded', False)
+    return worksheet
+
+
+def _place(*order_ids):
+    with db_connection() as conn:
+        for order_id in order_ids:
+            insert_order(conn, order_id, 5, 'user', [('p1', 'Товар', 10, 1)], 10, 'pickup', 'cash')
+
+
+def _ids(worksheet):
+    return [row[0] for row in worksheet.get_all_values()[1:]]
+
+
+def test_consecutive_jobs_are_batched(orders_ws):
+    _place('o1', 'o2', 'o3')
+    set_order_status('o2', STATUS_CANCELLED)
+    assert mirror.sync_orders_to_sheet() == (3, 1)
+    assert orders_ws.calls['append_rows'] == 1 and orders_ws.calls['batch_update'] == 1
+    assert _ids(orders_ws) == ['o1', 'o2', 'o3']
+    assert orders_ws.get_all_values()[2][5] == STATUS_CANCELLED
+    assert get_queue_head(10) == [] and get_order('o2')['sheet_status'] == STATUS_CANCELLED
+
+
+def test_failed_job_blocks_the_queue_in_order(orders_ws):
+    _place('o1')
+    orders_ws.error_rate = 1.0
+    assert mirror.sync_orders_to_sheet() == (0, 0)
+    orders_ws.error_rate = 0.0
+    _place('o2')
+    assert mirror.sync_orders_to_sheet() == (0, 0)    # Первое задание ждет повтора, порядок не нарушается
+    head = get_queue_head(10)
+    assert [job['order_id'] for job in head] == ['o1', 'o2'] and head[0]['attempts'] == 1
+
+    with db_connection() as conn:
+        conn.execute("UPDATE sheet_queue SET next_attempt_at = 0")
+    assert mirror.sync_orders_to_sheet() == (2, 0)
+    assert _ids(orders_ws) == ['o1', 'o2']
+
+
+def test_retried_append_does_not_duplicate_rows(orders_ws):
+    """append_rows записал строки, но вызов упал (таймаут после записи) - повтор их не дублирует."""
+    append_rows = orders_ws.append_rows
+
+    def append_then_fail(rows, *args, **kwargs):
+        append_rows(rows, *args, **kwargs)
+        orders_ws.append_rows = append_rows
+        raise TimeoutError("ответ не дошел")
+
+    orders_ws.append_rows = append_then_fail
+    _place('o1', 'o2')
+    assert mirror.sync_orders_to_sheet() == (0, 0)
+    with db_connection() as conn:
+        conn.execute("UPDATE sheet_queue SET next_attempt_at = 0")
+    _place('o3')
+    assert mirror.sync_orders_to_sheet() == (1, 0)
+    assert _ids(orders_ws) == ['o1', 'o2', 'o3']
+    assert get_queue_head(10) == []
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.messages.append((chat_id, text))
+
+
+@pytest.fixture
+def catalog_ws(orders_ws, monkeypatch):
+    """Лист каталога: p1 (остаток 10), p2 (в ячейке не число); строки ищутся через find."""
+    worksheet = FakeWorksheet('Catalog', [CATALOG_HEADER,
+                                          ['p1', 'Товар', '', 'Жидкости', 10, 'Бренд', 'Линейка', 25, ''],
+                                          ['p2', 'Товар 2', '', 'Жидкости', 'много', 'Бренд', 'Линейка', 25, '']])
+    monkeypatch.setattr(stock, 'sheet', SheetsClient(worksheet, 'test_catalog'))
+    monkeypatch.setattr(mirror, 'get_catalog', lambda: {})
+    monkeypatch.setattr(mirror, 'bot', FakeBot())
+    return worksheet
+
+
+def _confirm(order_id, items):
+    """Как confirm_order_handler: статус и задание на списание одной транзакцией."""
+    with db_connection() as conn:
+        insert_order(conn, order_id, 5, 'user', items, 10, 'pickup', 'cash')
+        assert set_order_status(order_id, STATUS_CONFIRMED, conn, expected=STATUS_NEW)
+        enqueue_sheet_job(conn, JOB_STOCK, order_id)
+
+
+def test_stock_jobs_of_concurrent_confirms_are_applied_in_turn(catalog_ws):
+    _confirm('o1', [('p1', 'Товар', 10, 2)])
+    _confirm('o2', [('p1', 'Товар', 10, 3)])
+    mirror.sync_orders_to_sheet()
+    assert catalog_ws.cell(2, 5).value == '5'
+    assert get_queue_head(10) == []
+
+
+def test_retried_stock_write_does_not_decrement_twice(catalog_ws):
+    """batch_update записал остатки, но ответ не дошел - повтор пишет те же значения."""
+    batch_update = catalog_ws.batch_update
+
+    def update_then_fail(data):
+        batch_update(data)
+        catalog_ws.batch_update = batch_update
+        raise TimeoutError("ответ не дошел")
+
+    catalog_ws.batch_update = update_then_fail
+    _confirm('o1', [('p1', 'Товар', 10, 2)])
+    mirror.sync_orders_to_sheet()
+    assert catalog_ws.cell(2, 5).value == '8'
+    assert [job['kind'] for job in get_queue_head(10)] == [JOB_STOCK]
+
+    with db_connection() as conn:
+        conn.execute("UPDATE sheet_queue SET next_attempt_at = 0")
+    mirror.sync_orders_to_sheet()
+    assert catalog_ws.cell(2, 5).value == '8'
+    assert get_queue_head(10) == []
+
+
+def test_unwritable_stock_is_reported_to_manager(catalog_ws):
+    _confirm('o1', [('p1', 'Товар', 10, 1), ('p2', 'Товар 2', 10, 1), ('p9', 'Нет в таблице', 10, 1)])
+    mirror.sync_orders_to_sheet()
+    assert catalog_ws.cell(2, 5).value == '9' and catalog_ws.cell(3, 5).value == 'много'
+    [(chat_id, text)] = mirror.bot.messages
+    assert chat_id == mirror.MANAGER_ID and 'p2' in text and 'p9' in text
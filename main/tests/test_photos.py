@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('telebot')
+
+from telebot.apihelper import ApiTelegramException
+
+import utils.photos as photos
+from database.database import get_cached_photo
+from utils.sheets_client import TokenBucket
+
+
+class FakeBot:
+    """Загрузки в тех. чат получают file_id по номеру; limited - сколько ближайших отправок получат 429."""
+
+    def __init__(self, retry_after=0):
+        self.uploads, self.sent, self.limited, self.retry_after = [], [], 0, retry_after
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        if chat_id != photos.SYS_CHAT_ID:
+            self.sent.append((chat_id, photo))
+            return None
+        if self.limited:
+            self.limited -= 1
+            raise ApiTelegramException('sendPhoto', None, {'error_code': 429, 'description': 'Too Many Requests',
+                                                           'parameters': {'retry_after': self.retry_after}})
+        self.uploads.append(photo)
+        return SimpleNamespace(message_id=len(self.uploads), photo=[SimpleNamespace(file_id=f"file{len(self.uploads)}")])
+
+    def delete_message(self, chat_id, message_id):
+        pass
+
+
+@pytest.fixture
+def fake_bot(db, monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(photos, 'bot', bot)
+    monkeypatch.setattr(photos, 'PHOTO_IDS', {})
+    monkeypatch.setattr(photos, 'UPLOAD_BUCKET', TokenBucket(1000, 1000))
+    monkeypatch.setattr(photos, '_pause_until', 0.0)
+    monkeypatch.setattr(photos.requests, 'get', lambda url, timeout: SimpleNamespace(
+        content=url.encode(), raise_for_status=lambda: None))
+    return bot
+
+
+def _catalog(count):
+    return SimpleNamespace(items=[SimpleNamespace(photo_url=f"https://img/{i}.jpg") for i in range(count)])
+
+
+def test_warm_up_uploads_at_most_the_limit_per_run(fake_bot, monkeypatch):
+    monkeypatch.setattr(photos, 'PHOTO_WARM_LIMIT', 2)
+    photos.warm_photo_cache(_catalog(5))
+    assert len(fake_bot.uploads) == 2
+    photos.warm_photo_cache(_catalog(5))
+    photos.warm_photo_cache(_catalog(5))
+    assert len(fake_bot.uploads) == 5
+    assert all(get_cached_photo(f"https://img/{i}.jpg") for i in range(5))
+
+
+def test_warm_up_waits_out_flood_control(fake_bot):
+    fake_bot.limited = 1
+    photos.warm_photo_cache(_catalog(2))
+    assert len(fake_bot.uploads) == 2
+
+
+def test_product_view_does_not_wait_for_flood_control(fake_bot):
+    fake_bot.retry_after = 30
+    fake_bot.limited = 1
+    url = "https://img/0.jpg"
+    photos.send_product_photo(100, url)             # 429: фото уходит по URL, без ожидания
+    assert fake_bot.sent == [(100, url)] and fake_bot.uploads == []
+    photos.send_product_photo(101, url)             # Пауза еще идет - загрузку не пробуем
+    assert fake_bot.sent[-1] == (101, url) and fake_bot.uploads == []
@@ -0,0 +1,42 @@
+import sqlite3
+import threading
+
+import pytest
+
+import database.database as database
+from database.database import db_connection, close_db_connection
+
+
+def _in_thread(target):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(target()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def _use_connection():
+    with db_connection() as conn:
+        conn.execute("SELECT 1")
+    return conn
+
+
+def test_connection_of_finished_thread_is_closed(db):
+    leaked = _in_thread(_use_connection)            # Поток завершился, не закрыв соединение
+    reclaimed = database.POOL_STATS['reclaimed']
+    _in_thread(_use_connection)                     # Следующее открытие соединения закрывает брошенное
+    assert database.POOL_STATS['reclaimed'] == reclaimed + 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        leaked.execute("SELECT 1")
+
+
+def test_closed_connection_leaves_the_registry(db):
+    def use_and_close():
+        _use_connection()
+        close_db_connection()
+        return threading.current_thread()
+
+    thread = _in_thread(use_and_close)
+    assert thread not in database._OWNERS
+    with db_connection() as conn:                   # Соединение текущего потока не трогается
+        assert conn.execute("SELECT 1").fetchone()[0] == 1
@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip('telebot')
+
+from utils.router import Router, PrefixTrie
+
+
+def _handler(name):
+    def handler(update):
+        return name
+    handler.__name__ = name
+    return handler
+
+
+def test_callback_prefers_exact_then_longest_prefix():
+    router = Router()
+    router.callback('cat_back')(_handler('back'))
+    router.callback(prefix='cat_')(_handler('category'))
+    router.callback(prefix=('cat_page_', 'page_'))(_handler('page'))
+
+    assert router.resolve_callback('cat_back').__name__ == 'back'
+    assert router.resolve_callback('cat_page_3').__name__ == 'page'
+    assert router.resolve_callback('page_1').__name__ == 'page'
+    assert router.resolve_callback('cat_Жидкости').__name__ == 'category'
+    assert router.resolve_callback('ca') is None
+    assert router.resolve_callback(None) is None
+
+
+def test_message_resolution_order():
+    router = Router()
+    router.command('start')(_handler('start'))
+    router.message('Корзина')(_handler('cart'))
+    router.message(lookup=lambda text: text in {'Жидкости'})(_handler('category'))
+    router.message(prefix='Корз')(_handler('prefix'))
+    router.fallback(_handler('fallback'))
+
+    assert router.resolve_message('/start ref_42').__name__ == 'start'
+    assert router.resolve_message('/START@shop_bot').__name__ == 'start'
+    assert router.resolve_message('Корзина').__name__ == 'cart'
+    assert router.resolve_message('Жидкости').__name__ == 'category'
+    assert router.resolve_message('Корзинка').__name__ == 'prefix'
+    assert router.resolve_message('/unknown').__name__ == 'fallback'
+    assert router.resolve_message('привет').__name__ == 'fallback'
+
+
+def test_duplicate_routes_are_rejected():
+    router = Router()
+    router.callback('x')(_handler('x'))
+    with pytest.raises(ValueError):
+        router.callback('x')(_handler('x2'))
+    trie = PrefixTrie()
+    trie.add('a_', 1)
+    with pytest.raises(ValueError):
+        trie.add('a_', 2)
+
+
+def test_dispatch_runs_teardown_even_if_handler_fails():
+    router = Router()
+    calls = []
+    router.teardown(lambda: calls.append('teardown'))
+
+    @router.callback(prefix='boom_')
+    def boom(call):
+        calls.append(call.data)
+        raise RuntimeError("handler failed")
+
+    with pytest.raises(RuntimeError):
+        router.dispatch_callback(type('Call', (), {'data': 'boom_1'})())
+    router.dispatch_callback(type('Call', (), {'data': 'unknown'})())
+    assert calls == ['boom_1', 'teardown', 'teardown']
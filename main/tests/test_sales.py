@@ -0,0 +1,52 @@
+from database.database import db_connection
+from database.orders import insert_order, set_order_status, STATUS_CONFIRMED, STATUS_CANCELLED
+from database.sales import rebuild_sales, get_order_totals
+
+TABLES = {
+    'sales_daily': "SELECT day, placed, confirmed, ROUND(revenue, 2) FROM sales_daily WHERE placed OR confirmed ORDER BY day",
+    'sales_products': "SELECT product_id, units, ROUND(revenue, 2) FROM sales_products WHERE units ORDER BY product_id",
+    'sales_customers': "SELECT user_id, orders, ROUND(spent, 2) FROM sales_customers WHERE orders ORDER BY user_id",
+    'sales_totals': "SELECT placed, confirmed, ROUND(revenue, 2) FROM sales_totals",
+}
+
+
+def _aggregates():
+    with db_connection() as conn:
+        return {table: [tuple(row) for row in conn.execute(sql)] for table, sql in TABLES.items()}
+
+
+def _place_orders(count):
+    with db_connection() as conn:
+        for n in range(count):
+            items = [(f"a{n % 4}", f"Товар A{n % 4}", 25.5, 1 + n % 3), (f"b{n % 7}", f"Товар B{n % 7}", 40, 1)]
+            total = sum(price * qty for _, _, price, qty in items)
+            insert_order(conn, f"o{n}", 100 + n % 5, 'user', items, total, 'pickup', 'cash',
+                         created_at=f"2026-10-{1 + n % 6:02d} {n % 24:02d}:15:00")
+
+
+def test_incremental_aggregates_match_rebuild(db):
+    _place_orders(40)
+    for n in range(0, 40, 2):
+        set_order_status(f"o{n}", STATUS_CONFIRMED)
+    for n in range(0, 40, 6):       # Отмена подтвержденных
+        set_order_status(f"o{n}", STATUS_CANCELLED)
+    for n in range(1, 40, 9):       # Отмена оформленных
+        set_order_status(f"o{n}", STATUS_CANCELLED)
+    for n in range(0, 40, 12):      # Повторное подтверждение отмененных
+        set_order_status(f"o{n}", STATUS_CONFIRMED)
+
+    incremental = _aggregates()
+    assert incremental['sales_products'] and incremental['sales_customers']
+    rebuild_sales()
+    assert _aggregates() == incremental
+
+
+def test_status_change_is_counted_once(db):
+    _place_orders(1)
+    assert set_order_status('o0', STATUS_CONFIRMED)
+    assert not set_order_status('o0', STATUS_CONFIRMED)
+    confirmed = _aggregates()
+    rebuild_sales()
+    assert _aggregates() == confirmed
+    assert confirmed['sales_daily'][0][2] == 1
+    assert get_order_totals() == (1, 1, 65.5)
@@ -0,0 +1,35 @@
+import time
+
+import database.sheet_queue as sheet_queue
+from database.database import db_connection
+from database.sheet_queue import enqueue_sheet_job, get_queue_head, complete_jobs, fail_jobs, JOB_APPEND, JOB_STATUS
+
+
+def _enqueue(*jobs):
+    with db_connection() as conn:
+        for kind, order_id in jobs:
+            enqueue_sheet_job(conn, kind, order_id)
+
+
+def test_queue_keeps_enqueue_order(db):
+    _enqueue((JOB_APPEND, 'o1'), (JOB_APPEND, 'o2'), (JOB_STATUS, 'o1'), (JOB_APPEND, 'o3'))
+    head = get_queue_head(10)
+    assert [(job['kind'], job['order_id']) for job in head] == [
+        (JOB_APPEND, 'o1'), (JOB_APPEND, 'o2'), (JOB_STATUS, 'o1'), (JOB_APPEND, 'o3')]
+    complete_jobs([head[0]['id'], head[1]['id']])
+    assert [job['order_id'] for job in get_queue_head(1)] == ['o1']
+    assert len(get_queue_head(10)) == 2
+
+
+def test_fail_jobs_backs_off_exponentially_up_to_limit(db, monkeypatch):
+    monkeypatch.setattr(sheet_queue, 'SHEETS_QUEUE_MAX_BACKOFF', 10)
+    _enqueue((JOB_APPEND, 'o1'))
+    job_id = get_queue_head(1)[0]['id']
+    delays = []
+    for _ in range(5):
+        now = time.time()
+        fail_jobs([job_id], RuntimeError("429"))
+        job = get_queue_head(1)[0]
+        delays.append(round(job['next_attempt_at'] - now))
+    assert delays == [2, 4, 8, 10, 10]
+    assert job['attempts'] == 5 and job['last_error'] == "429"
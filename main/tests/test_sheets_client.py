@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+import utils.sheets_client as sheets_client
+from utils.sheets_client import TokenBucket, SheetsClient, PRIORITY_HIGH, PRIORITY_LOW
+from utils.fake_sheets import FakeWorksheet, FakeAPIError, ORDERS_HEADER
+
+
+def test_token_bucket_serves_high_priority_first():
+    bucket = TokenBucket(rate_per_sec=5, capacity=1)
+    bucket.acquire()                    # Токенов больше нет, следующий появится через 0.2 сек.
+    order = []
+
+    def worker(name, priority):
+        bucket.acquire(priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=worker, args=('low', PRIORITY_LOW))]
+    threads[0].start()
+    time.sleep(0.05)                    # low уже ждет, high приходит позже
+    threads.append(threading.Thread(target=worker, args=('high', PRIORITY_HIGH)))
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['high', 'low']
+
+
+def test_token_bucket_is_fifo_within_priority():
+    bucket = TokenBucket(rate_per_sec=20, capacity=1)
+    bucket.acquire()
+    order = []
+    threads = []
+    for n in range(3):
+        threads.append(threading.Thread(target=lambda n=n: (bucket.acquire(), order.append(n))))
+        threads[-1].start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2]
+
+
+def test_only_idempotent_calls_are_retried(monkeypatch):
+    monkeypatch.setattr(sheets_client, 'backoff_delay', lambda attempt: 0)
+    monkeypatch.setattr(sheets_client, 'BUCKET', TokenBucket(1000, 1000))
+    sheet = FakeWorksheet('Orders', [ORDERS_HEADER], error_rate=1.0)
+    client = SheetsClient(sheet, 'test_orders')
+
+    with pytest.raises(FakeAPIError):
+        client.append_rows([['o1']])
+    assert sheet.calls['append_rows'] == 1
+
+    with pytest.raises(FakeAPIError):
+        client.batch_update([{'range': 'F2', 'values': [['x']]}])
+    assert sheet.calls['batch_update'] == sheets_client.SHEETS_MAX_RETRIES + 1
+
+
+def test_concurrent_identical_reads_are_coalesced(monkeypatch):
+    monkeypatch.setattr(sheets_client, 'BUCKET', TokenBucket(1000, 1000))
+    sheet = FakeWorksheet('Orders', [ORDERS_HEADER, ['o1']], latency=0.2)
+    client = SheetsClient(sheet, 'test_coalesce')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.col_values(1))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == [['ID', 'o1']] * 5
+    assert sheet.calls['col_values'] == 1
+    assert sheets_client.SHEETS_STATS['test_coalesce.col_values']['coalesced'] == 4
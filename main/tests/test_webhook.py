@@ -0,0 +1,105 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip('telebot')
+
+import utils.webhook as webhook
+
+
+class FakeBot:
+    """Записывает (пользователь, update_id) обработанных обновлений; gate задерживает обработку."""
+
+    def __init__(self):
+        self.processed = []
+        self.lock = threading.Lock()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def process_new_updates(self, updates):
+        self.gate.wait(5)
+        time.sleep(random.random() / 1000)
+        for update in updates:
+            with self.lock:
+                self.processed.append((update.message.from_user.id, update.update_id))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    bot = FakeBot()
+    monkeypatch.setattr(webhook, 'bot', bot)
+    monkeypatch.setattr(webhook, 'WEBHOOK_LISTEN', '127.0.0.1')
+    monkeypatch.setattr(webhook, '_shards', [])
+    monkeypatch.setattr(webhook, '_workers', [])
+    monkeypatch.setattr(webhook, 'WEBHOOK_STATS', dict.fromkeys(webhook.WEBHOOK_STATS, 0))
+    started = []
+
+    def start(workers=4, queue_size=100):
+        srv = webhook.start_webhook(workers, queue_size, port=0)
+        started.append(srv)
+        return f"http://127.0.0.1:{srv.server_address[1]}{webhook.WEBHOOK_PATH}", bot
+
+    yield start
+    if started:
+        bot.gate.set()
+        webhook.stop_webhook(timeout=5)
+
+
+def _update(update_id, user_id):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': 'hi',
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'u'},
+    }}
+
+
+def _post(url, body):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, method='POST'), timeout=5) as r:
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_updates_of_one_user_are_processed_in_order(server):
+    url, bot = server()
+    sent = [(update_id, update_id % 5) for update_id in range(1, 101)]
+    for update_id, user_id in sent:
+        assert _post(url, _update(update_id, user_id)) == 200
+    assert webhook.stop_webhook(timeout=5) == 0
+
+    assert sorted(bot.processed) == sorted((user_id, update_id) for update_id, user_id in sent)
+    for user_id in range(5):
+        ids = [update_id for uid, update_id in bot.processed if uid == user_id]
+        assert ids == sorted(ids)
+    assert webhook.WEBHOOK_STATS['processed'] == 100
+
+
+def test_bad_request_is_rejected(server):
+    url, _ = server()
+    assert _post(url, b'not json') == 400
+    assert _post(url, {'message': {}}) == 400
+    assert _post(url.replace('/webhook', '/other'), _update(1, 1)) == 404
+    assert webhook.WEBHOOK_STATS['bad_requests'] == 2
+
+
+def test_full_queue_answers_503_and_drains_on_stop(server):
+    url, bot = server(workers=1, queue_size=2)
+    bot.gate.clear()
+    codes = [_post(url, _update(1, 1))]
+    while webhook._shards[0].qsize():
+        time.sleep(0.01)
+    codes += [_post(url, _update(update_id, 1)) for update_id in range(2, 6)]
+    # Одно обновление в обработке, два в очереди, остальные отклонены
+    assert codes == [200, 200, 200, 503, 503]
+    assert webhook.WEBHOOK_STATS['rejected'] == 2
+
+    bot.gate.set()
+    assert webhook.stop_webhook(timeout=5) == 0
+    assert [update_id for _, update_id in bot.processed] == [1, 2, 3]
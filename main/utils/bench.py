@@ -0,0 +1,107 @@
+import os
+import statistics
+import tempfile
+import time
+
+import database.database as db
+import utils.utils as utils
+from config import SHEETS_BACKEND, FAKE_SHEETS_LATENCY, FAKE_SHEETS_ERROR_RATE, SHEETS_REQUESTS_PER_MINUTE
+from loader import sheet, orders_sheet
+from database.database import init_db, db_connection, cart_increment, cart_clear
+from database.orders import insert_order, set_order_status, get_order_items, STATUS_CONFIRMED
+from database.sales import get_order_totals, get_top_products, get_top_customers
+from database.analytics import get_window
+from utils.orders_mirror import sync_orders_to_sheet, rebuild_order_rows
+from utils.stock import decrement_stock
+
+# ==========================================
+#        ЗАМЕРЫ ГОРЯЧИХ ПУТЕЙ (python main.py --bench)
+# ==========================================
+# Работает только с локальными таблицами (SHEETS_BACKEND = 'fake') и временной БД,
+# поэтому не трогает ни Google, ни рабочую базу, ни снимок каталога.
+
+def _timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+def _calls(worksheet):
+    return sum(worksheet.raw.calls.values())
+
+def _report(name, samples_ms, api_calls=None):
+    line = f"{name:<34} {len(samples_ms):>4} раз  средн. {statistics.mean(samples_ms):8.1f} мс  макс. {max(samples_ms):8.1f} мс"
+    if api_calls is not None:
+        line += f"  запросов к таблицам: {api_calls}"
+    print(line)
+
+def run_benchmarks(orders=20, skus_per_order=8):
+    if SHEETS_BACKEND != 'fake' or sheet is None:
+        print("Замеры запускаются только с SHEETS_BACKEND = 'fake' (см. config.py).")
+        return False
+
+    tmp_dir = tempfile.mkdtemp(prefix='bot_bench_')
+    db.close_db_connection()
+    db.DB_NAME = os.path.join(tmp_dir, 'bench.db')
+    utils.CATALOG_SNAPSHOT_FILE = os.path.join(tmp_dir, 'catalog_snapshot.json.gz')
+    init_db()
+
+    print(f"Задержка таблиц {FAKE_SHEETS_LATENCY} сек., ошибок {FAKE_SHEETS_ERROR_RATE:.0%}, "
+          f"квота {SHEETS_REQUESTS_PER_MINUTE} запросов/мин. БД: {db.DB_NAME}\n")
+
+    # 1. Синхронизация каталога: полная загрузка и проверка без изменений
+    before = _calls(sheet)
+    _, full_ms = _timed(utils.update_catalog_cache, force=True)
+    _report("Каталог: полная загрузка", [full_ms], _calls(sheet) - before)
+    before = _calls(sheet)
+    skipped = [_timed(utils.update_catalog_cache)[1] for _ in range(5)]
+    _report("Каталог: проверка без изменений", skipped, _calls(sheet) - before)
+
+    catalog = utils.get_catalog()
+    in_stock = [p for p in catalog.items if p.stock > 0]
+    rebuild_order_rows()
+
+    # 2. Корзина и оформление: локальная транзакция, таблица догоняет в фоне
+    cart_ms, checkout_ms, order_ids = [], [], []
+    for n in range(orders):
+        user_id = 1000 + n
+        items = in_stock[(n * skus_per_order) % len(in_stock):][:skus_per_order] or in_stock[:skus_per_order]
+        for product in items:
+            cart_ms.append(_timed(cart_increment, user_id, product.id, product.stock)[1])
+        order_id = f"bench{n:03d}"
+        order_items = [(p.id, p.name, p.price, 1) for p in items]
+
+        def checkout():
+            with db_connection() as conn:
+                insert_order(conn, order_id, user_id, 'bench', order_items, sum(p.price for p in items), 'pickup', 'cash')
+                cart_clear(user_id, conn)
+        checkout_ms.append(_timed(checkout)[1])
+        order_ids.append(order_id)
+    _report("Корзина: добавление товара", cart_ms)
+    _report("Оформление (SQLite)", checkout_ms)
+
+    before = _calls(orders_sheet)
+    (appended, _), drain_ms = _timed(sync_orders_to_sheet)
+    _report(f"Таблица заказов: {appended} строк", [drain_ms], _calls(orders_sheet) - before)
+
+    # 3. Подтверждение: списание остатков и статусы
+    confirm_ms, confirm_calls = [], 0
+    for order_id in order_ids[:5]:
+        before = _calls(sheet)
+        confirm_ms.append(_timed(decrement_stock, get_order_items(order_id), catalog)[1])
+        confirm_calls += _calls(sheet) - before
+        set_order_status(order_id, STATUS_CONFIRMED)
+    _report(f"Подтверждение: списание {skus_per_order} SKU", confirm_ms, confirm_calls)
+
+    before = _calls(orders_sheet)
+    (_, updated), status_ms = _timed(sync_orders_to_sheet)
+    _report(f"Таблица заказов: {updated} статусов", [status_ms], _calls(orders_sheet) - before)
+
+    # 4. Статистика (локальные запросы)
+    stats_ms = [_timed(lambda: (get_order_totals(), get_top_products(), get_top_customers()))[1] for _ in range(20)]
+    _report("Статистика", stats_ms)
+    window_ms = [_timed(get_window, 90)[1] for _ in range(20)]
+    _report("Отчет за 90 дней", window_ms)
+
+    print(f"\nВызовы листа каталога: {sheet.raw.calls}")
+    print(f"Вызовы листа заказов: {orders_sheet.raw.calls}")
+    return True
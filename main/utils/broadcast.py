@@ -0,0 +1,145 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from telebot.apihelper import ApiTelegramException
+
+from loader import bot
+from config import BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_BATCH, BROADCAST_MAX_RETRIES
+from database.broadcasts import (
+    create_broadcast, get_broadcast, get_running_broadcasts, iter_audience, count_recipients,
+    save_progress, finish_broadcast, describe_audience, AUDIENCE_ALL, STATUS_RUNNING, STATUS_CANCELLED
+)
+from database.database import close_db_connection
+from utils.sheets_client import TokenBucket
+
+# ==========================================
+#        ОТПРАВКА РАССЫЛОК
+# ==========================================
+# - общий token bucket на BROADCAST_RATE сообщений/сек. (лимит Telegram ~30/сек.);
+# - получатели аудитории читаются пачками (iter_audience), BROADCAST_WORKERS потоков
+#   отправляют пачку параллельно;
+# - 429 от Telegram: все отправители ждут retry_after, сообщение повторяется;
+# - 403 (бот заблокирован, аккаунт удален): пользователь помечается и больше не получает рассылки;
+# - прогресс хранится в БД (database/broadcasts.py), после перезапуска рассылка продолжается.
+
+BUCKET = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+PROGRESS_INTERVAL = 15      # Как часто (сек.) обновлять сообщение с прогрессом у админа
+
+_pause_until = 0.0
+_pause_lock = threading.Lock()
+_active = set()             # id кампаний, которые сейчас отправляются в этом процессе
+_active_lock = threading.Lock()
+
+def _pause(seconds):
+    """Flood control: все отправители ждут, пока Telegram снова разрешит отправку."""
+    global _pause_until
+    with _pause_lock:
+        _pause_until = max(_pause_until, time.monotonic() + seconds)
+
+def _wait_pause():
+    while True:
+        with _pause_lock:
+            delay = _pause_until - time.monotonic()
+        if delay <= 0:
+            return
+        time.sleep(delay)
+
+def _retry_after(error):
+    parameters = (getattr(error, 'result_json', None) or {}).get('parameters') or {}
+    return parameters.get('retry_after', 1)
+
+def send_one(user_id, text):
+    """Отправляет одно сообщение. Возвращает 'sent', 'blocked' или 'failed'."""
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        _wait_pause()
+        BUCKET.acquire()
+        try:
+            bot.send_message(user_id, text, parse_mode="Markdown")
+            return 'sent'
+        except ApiTelegramException as e:
+            code = getattr(e, 'error_code', None)
+            if code == 429:
+                retry_after = _retry_after(e)
+                print(f"[{datetime.now()}] Рассылка: лимит Telegram, пауза {retry_after} сек.")
+                _pause(retry_after)
+                continue
+            if code == 403:
+                return 'blocked'
+            return 'failed'
+        except Exception:
+            # Сетевые ошибки: короткая пауза и повтор
+            time.sleep(2 ** attempt)
+    return 'failed'
+
+def _progress_text(campaign, total=None):
+    done = campaign['sent'] + campaign['failed'] + campaign['blocked']
+    text = (f"📣 Рассылка #{campaign['id']} ({describe_audience(campaign['audience'])}): обработано {done}" +
+            (f" из ~{total}" if total else "") +
+            f"\nДоставлено: {campaign['sent']}\nЗаблокировали бота: {campaign['blocked']}\nОшибок: {campaign['failed']}")
+    return text
+
+def run_broadcast(broadcast_id):
+    """Отправляет кампанию с сохраненного курсора до конца (или до отмены)."""
+    with _active_lock:
+        if broadcast_id in _active:
+            return
+        _active.add(broadcast_id)
+    try:
+        campaign = get_broadcast(broadcast_id)
+        if not campaign or campaign['status'] != STATUS_RUNNING:
+            return
+        admin_id, text, audience = campaign['admin_id'], campaign['text'], campaign['audience']
+        total = count_recipients(audience, campaign['created_at'])
+        started = time.monotonic()
+        progress_msg, last_report = None, 0.0
+        try:
+            progress_msg = bot.send_message(admin_id, _progress_text(campaign, total))
+        except Exception:
+            pass
+
+        status = STATUS_RUNNING
+        with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix='broadcast') as pool:
+            for batch in iter_audience(audience, campaign['last_user_id'], BROADCAST_BATCH, campaign['created_at']):
+                results = list(pool.map(lambda uid: send_one(uid, text), batch))
+                blocked = [uid for uid, result in zip(batch, results) if result == 'blocked']
+                status = save_progress(broadcast_id, batch[-1], results.count('sent'), results.count('failed'), blocked)
+                if status != STATUS_RUNNING:
+                    break
+
+                if progress_msg and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    try:
+                        bot.edit_message_text(_progress_text(get_broadcast(broadcast_id), total),
+                                              admin_id, progress_msg.message_id)
+                    except Exception:
+                        pass
+
+        if status == STATUS_RUNNING:
+            finish_broadcast(broadcast_id)
+        campaign = get_broadcast(broadcast_id)
+        elapsed = time.monotonic() - started
+        print(f"[{datetime.now()}] Рассылка #{broadcast_id}: {campaign['status']}, отправлено {campaign['sent']} за {elapsed:.0f} сек.")
+        title = "✅ Рассылка завершена!" if campaign['status'] != STATUS_CANCELLED else "🛑 Рассылка остановлена."
+        bot.send_message(admin_id, f"{title}\n{_progress_text(campaign)}\nВремя: {elapsed:.0f} сек.")
+    except Exception as e:
+        print(f"[{datetime.now()}] Ошибка рассылки #{broadcast_id}: {e}. Продолжится после перезапуска.")
+    finally:
+        with _active_lock:
+            _active.discard(broadcast_id)
+        close_db_connection()
+
+def start_broadcast(admin_id, text, audience=AUDIENCE_ALL):
+    """Создает кампанию и запускает отправку в фоне. Возвращает id кампании."""
+    broadcast_id = create_broadcast(admin_id, text, audience)
+    threading.Thread(target=run_broadcast, args=(broadcast_id,), daemon=True).start()
+    return broadcast_id
+
+def resume_broadcasts():
+    """Продолжает рассылки, прерванные остановкой бота. Возвращает их число."""
+    campaigns = get_running_broadcasts()
+    for campaign in campaigns:
+        print(f"[{datetime.now()}] Продолжаю рассылку #{campaign['id']} с user_id > {campaign['last_user_id']}")
+        threading.Thread(target=run_broadcast, args=(campaign['id'],), daemon=True).start()
+    return len(campaigns)
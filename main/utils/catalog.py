@@ -0,0 +1,233 @@
+from collections import defaultdict
+
+
+def _parse_int(value, field, default=None):
+    """Приводит значение ячейки к int. Пустая ячейка -> default (или ошибка, если default не задан)."""
+    if isinstance(value, bool):
+        raise ValueError(f"{field}: некорректное значение {value!r}")
+    if isinstance(value, int):
+        return value
+    text = str(value).strip().replace(' ', '').replace(',', '.') if value is not None else ''
+    if not text:
+        if default is None:
+            raise ValueError(f"{field}: пустая ячейка")
+        return default
+    try:
+        number = float(text)
+    except ValueError:
+        raise ValueError(f"{field}: не число ({value!r})")
+    if not number.is_integer():
+        raise ValueError(f"{field}: ожидается целое число ({value!r})")
+    return int(number)
+
+
+class Product:
+    """
+    Товар каталога. Строка таблицы разбирается и проверяется один раз при синхронизации,
+    дальше хэндлеры работают с готовыми int-полями без повторных преобразований.
+    """
+    __slots__ = ('id', 'name', 'description', 'category', 'manufacturer', 'line', 'price', 'stock', 'photo_url', 'row')
+
+    # Поля, которые сравниваются при поиске изменений (row - служебное, номер строки в таблице)
+    DATA_FIELDS = ('id', 'name', 'description', 'category', 'manufacturer', 'line', 'price', 'stock', 'photo_url')
+
+    def __init__(self, id, name, description, category, manufacturer, line, price, stock, photo_url, row=None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.category = category
+        self.manufacturer = manufacturer
+        self.line = line
+        self.price = price
+        self.stock = stock
+        self.photo_url = photo_url
+        self.row = row
+
+    @classmethod
+    def from_row(cls, record, row=None):
+        """Создает товар из словаря get_all_records. Бросает ValueError для некорректной строки."""
+        pid = str(record.get('id', '')).strip()
+        if not pid:
+            raise ValueError("пустой id")
+        return cls(
+            id=pid,
+            name=str(record.get('Название', '')).strip(),
+            description=str(record.get('Описание', '')).strip(),
+            category=str(record.get('Категория', '')).strip(),
+            manufacturer=str(record.get('Производитель', '')).strip(),
+            line=str(record.get('Линейка', '')).strip(),
+            price=_parse_int(record.get('Цена'), 'Цена'),
+            stock=_parse_int(record.get('Количество'), 'Количество', default=0),
+            photo_url=str(record.get('URL_фото', '') or '').strip(),
+            row=row,
+        )
+
+    def to_tuple(self):
+        return tuple(getattr(self, f) for f in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, values):
+        return cls(*values)
+
+    def same_data(self, other):
+        return all(getattr(self, f) == getattr(other, f) for f in self.DATA_FIELDS)
+
+    def __repr__(self):
+        return f"Product(id={self.id!r}, name={self.name!r}, price={self.price}, stock={self.stock})"
+
+
+def parse_rows(records, first_row=2):
+    """
+    Разбирает строки get_all_records в товары.
+    Возвращает (товары, ошибки), где ошибки - список (номер строки, описание).
+    Номер строки считается с учетом заголовка (первая строка данных - 2).
+    """
+    products, errors, seen = [], [], set()
+    for row, record in enumerate(records, start=first_row):
+        try:
+            product = Product.from_row(record, row)
+        except ValueError as e:
+            errors.append((row, str(e)))
+            continue
+        if product.id in seen:
+            errors.append((row, f"повтор id {product.id}"))
+            continue
+        seen.add(product.id)
+        products.append(product)
+    return products, errors
+
+
+class Catalog:
+    """
+    Неизменяемый снимок каталога.
+    Собирается один раз при обновлении кэша и публикуется целиком,
+    поэтому хэндлеры читают его без блокировок и без копирования.
+    """
+    __slots__ = ('version', 'items', 'by_id', 'tree', '_counts', '_categories', '_manufacturers', '_lines',
+                 '_known_categories', '_known_lines')
+
+    def __init__(self, items, version=0):
+        self.version = version
+        self.items = tuple(items)
+        # Индекс id -> товар
+        self.by_id = {item.id: item for item in self.items}
+
+        # Дерево Категория -> Производитель -> Линейка -> (товары в наличии,)
+        tree = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        for item in self.items:
+            if not item.category or item.stock <= 0:
+                continue
+            tree[item.category][item.manufacturer][item.line].append(item)
+
+        self.tree = {
+            cat: {man: {line: tuple(products) for line, products in lines.items()} for man, lines in mans.items()}
+            for cat, mans in tree.items()
+        }
+
+        # Количество позиций в наличии на каждом уровне дерева
+        self._counts = {}
+        for cat, mans in self.tree.items():
+            for man, lines in mans.items():
+                for line, products in lines.items():
+                    self._counts[(cat, man, line)] = len(products)
+                self._counts[(cat, man)] = sum(len(p) for p in lines.values())
+            self._counts[(cat,)] = sum(self._counts[(cat, man)] for man in mans)
+
+        # Отсортированные списки для кнопок навигации
+        self._categories = tuple(sorted(self.tree))
+        self._manufacturers = {cat: tuple(sorted(mans)) for cat, mans in self.tree.items()}
+        self._lines = {(cat, man): tuple(sorted(lines)) for cat, mans in self.tree.items() for man, lines in mans.items()}
+
+        # Все известные категории и линейки (включая закончившиеся) - для маршрутизации кнопок
+        self._known_categories = frozenset(item.category for item in self.items if item.category)
+        self._known_lines = frozenset((item.category, item.manufacturer, item.line) for item in self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, product_id, default=None):
+        """Товар по id (O(1))."""
+        return self.by_id.get(str(product_id).strip(), default)
+
+    def categories(self):
+        """Категории, в которых есть товары в наличии."""
+        return self._categories
+
+    def manufacturers(self, category):
+        """Производители категории с товарами в наличии."""
+        return self._manufacturers.get(category, ())
+
+    def flavor_lines(self, category, manufacturer):
+        """Линейки производителя с товарами в наличии."""
+        return self._lines.get((category, manufacturer), ())
+
+    def products(self, category, manufacturer, flavor_line):
+        """Товары линейки в наличии (в порядке таблицы)."""
+        return self.tree.get(category, {}).get(manufacturer, {}).get(flavor_line, ())
+
+    def in_stock_count(self, *path):
+        """Количество позиций в наличии для узла дерева (категория[, производитель[, линейка]])."""
+        return self._counts.get(tuple(path), 0)
+
+    def is_category(self, name):
+        """Есть ли в каталоге такая категория (даже если товары в ней закончились)."""
+        return name in self._known_categories
+
+    def has_flavor_line(self, category, manufacturer, flavor_line):
+        return (category, manufacturer, flavor_line) in self._known_lines
+
+
+EMPTY_CATALOG = Catalog([])
+
+
+class CatalogDiff:
+    """Построчная разница между текущим каталогом и свежими данными таблицы."""
+    __slots__ = ('added', 'removed', 'price_changed', 'stock_changed', 'changed', 'moved', 'items')
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.price_changed = []
+        self.stock_changed = []
+        self.changed = []   # Прочие изменения (название, фото, описание...)
+        self.moved = []     # Данные те же, но товар переехал в другую строку таблицы
+        self.items = []     # Итоговый список товаров для нового снимка
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.price_changed or self.stock_changed or self.changed or self.moved)
+
+    def summary(self):
+        return (f"+{len(self.added)} / -{len(self.removed)} / "
+                f"цена: {len(self.price_changed)} / остаток: {len(self.stock_changed)} / прочее: {len(self.changed)}")
+
+
+def diff_catalog(catalog, products):
+    """
+    Сравнивает свежие товары (уже разобранные из всей таблицы) с текущим снимком по id.
+    В diff.items неизменившиеся товары - объекты из старого снимка, остальные - свежие;
+    индексы нового снимка все равно строятся по всему списку (Catalog(diff.items)).
+    """
+    diff = CatalogDiff()
+    seen = set()
+    for product in products:
+        seen.add(product.id)
+        old = catalog.by_id.get(product.id)
+        if old is None:
+            diff.added.append(product.id)
+            diff.items.append(product)
+        elif old.same_data(product):
+            if old.row != product.row:
+                diff.moved.append(product.id)
+                diff.items.append(product)
+            else:
+                diff.items.append(old)
+        else:
+            if old.price != product.price:
+                diff.price_changed.append(product.id)
+            if old.stock != product.stock:
+                diff.stock_changed.append(product.id)
+            if any(getattr(old, f) != getattr(product, f) for f in Product.DATA_FIELDS if f not in ('price', 'stock')):
+                diff.changed.append(product.id)
+            diff.items.append(product)
+    diff.removed = [pid for pid in catalog.by_id if pid not in seen]
+    return diff
@@ -0,0 +1,237 @@
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+# ==========================================
+#        ЛОКАЛЬНАЯ ЗАМЕНА GOOGLE ТАБЛИЦ
+# ==========================================
+# In-process реализация той части gspread, которой пользуется бот.
+# Включается в config.py (SHEETS_BACKEND = 'fake'): бот работает без сервисного
+# аккаунта и сети, а задержка и ошибки Google имитируются (FAKE_SHEETS_LATENCY,
+# FAKE_SHEETS_ERROR_RATE) - так можно воспроизводимо замерять синхронизацию каталога,
+# оформление и подтверждение заказов.
+
+CATALOG_HEADER = ['id', 'Название', 'Описание', 'Категория', 'Количество',
+                  'Производитель', 'Линейка', 'Цена', 'URL_фото']
+ORDERS_HEADER = ['ID', 'ID пользователя', 'username', 'Состав заказа', 'Сумма',
+                 'Статус', 'Доставка', 'Оплата', 'Дата']
+
+_A1 = re.compile(r"^(?:.*!)?([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeAPIError(Exception):
+    """Ошибка в духе gspread.exceptions.APIError: у неё есть response.status_code."""
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code}: {message}")
+        self.response = _Response(status_code)
+
+
+class Cell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+    def __repr__(self):
+        return f"<Cell R{self.row}C{self.col} {self.value!r}>"
+
+
+def col_to_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index
+
+def index_to_col(index):
+    letters = ''
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+def _numericise(value):
+    """Как get_all_records в gspread: числа из строк превращаются в int/float."""
+    if isinstance(value, str):
+        text = value.strip()
+        if re.fullmatch(r"-?\d+", text):
+            return int(text)
+        if re.fullmatch(r"-?\d+\.\d+", text):
+            return float(text)
+    return value
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self.title = worksheet.title
+        self.lastUpdateTime = datetime.now().isoformat()
+        self._worksheet = worksheet
+
+    def get_lastUpdateTime(self):
+        self._worksheet._request('get_lastUpdateTime')
+        return self.lastUpdateTime
+
+    def touch(self):
+        self.lastUpdateTime = datetime.now().isoformat()
+
+
+class FakeWorksheet:
+    """
+    Лист в памяти. latency - средняя задержка одного запроса (сек.),
+    error_rate - доля запросов, завершающихся ошибкой 429 (как при превышении квоты).
+    """
+
+    def __init__(self, title, rows, latency=0.0, error_rate=0.0, seed=None):
+        self.title = title
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = {}
+        self._rows = [[str(v) for v in row] for row in rows]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.spreadsheet = FakeSpreadsheet(self)
+
+    # --- Имитация сети ---
+    def _request(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise FakeAPIError(429, "Quota exceeded (fake)")
+
+    def _get(self, row, col):
+        if row <= len(self._rows) and col <= len(self._rows[row - 1]):
+            return self._rows[row - 1][col - 1]
+        return ''
+
+    def _set(self, row, col, value):
+        while len(self._rows) < row:
+            self._rows.append([])
+        cells = self._rows[row - 1]
+        while len(cells) < col:
+            cells.append('')
+        cells[col - 1] = '' if value is None else str(value)
+
+    def _range(self, a1):
+        match = _A1.match(a1)
+        if not match:
+            raise ValueError(f"Неподдерживаемый диапазон: {a1}")
+        c1, r1, c2, r2 = match.groups()
+        return int(r1), col_to_index(c1), int(r2 or r1), col_to_index(c2 or c1)
+
+    @staticmethod
+    def _trim(values):
+        while values and values[-1] == '':
+            values = values[:-1]
+        return values
+
+    # --- Чтение ---
+    def get_all_values(self):
+        self._request('get_all_values')
+        with self._lock:
+            return [list(row) for row in self._rows]
+
+    def get_all_records(self):
+        self._request('get_all_records')
+        with self._lock:
+            if not self._rows:
+                return []
+            header = self._rows[0]
+            return [{key: _numericise(row[i] if i < len(row) else '') for i, key in enumerate(header)}
+                    for row in self._rows[1:]]
+
+    def row_values(self, row):
+        self._request('row_values')
+        with self._lock:
+            return self._trim(list(self._rows[row - 1])) if row <= len(self._rows) else []
+
+    def col_values(self, col):
+        self._request('col_values')
+        with self._lock:
+            return self._trim([self._get(row, col) for row in range(1, len(self._rows) + 1)])
+
+    def cell(self, row, col):
+        self._request('cell')
+        with self._lock:
+            return Cell(row, col, self._get(row, col))
+
+    def find(self, query, in_row=None, in_column=None):
+        self._request('find')
+        query = str(query)
+        with self._lock:
+            for r, row in enumerate(self._rows, start=1):
+                if in_row and r != in_row:
+                    continue
+                for c, value in enumerate(row, start=1):
+                    if in_column and c != in_column:
+                        continue
+                    if value == query:
+                        return Cell(r, c, value)
+        return None
+
+    def batch_get(self, ranges):
+        self._request('batch_get')
+        result = []
+        with self._lock:
+            for a1 in ranges:
+                r1, c1, r2, c2 = self._range(a1)
+                block = [self._trim([self._get(r, c) for c in range(c1, c2 + 1)]) for r in range(r1, r2 + 1)]
+                while block and not block[-1]:
+                    block.pop()
+                result.append(block)
+        return result
+
+    # --- Запись ---
+    def update_cell(self, row, col, value):
+        self._request('update_cell')
+        with self._lock:
+            self._set(row, col, value)
+            self.spreadsheet.touch()
+
+    def batch_update(self, data):
+        self._request('batch_update')
+        with self._lock:
+            for item in data:
+                r1, c1, _, _ = self._range(item['range'])
+                for dr, values in enumerate(item['values']):
+                    for dc, value in enumerate(values):
+                        self._set(r1 + dr, c1 + dc, value)
+            self.spreadsheet.touch()
+
+    def append_rows(self, rows, value_input_option='RAW'):
+        self._request('append_rows')
+        with self._lock:
+            first = len(self._rows) + 1
+            for row in rows:
+                self._rows.append(['' if v is None else str(v) for v in row])
+            self.spreadsheet.touch()
+            width = max((len(row) for row in rows), default=1)
+            return {'updates': {'updatedRange': f"'{self.title}'!A{first}:{index_to_col(width)}{len(self._rows)}",
+                                'updatedRows': len(rows)}}
+
+    def append_row(self, values, value_input_option='RAW'):
+        return self.append_rows([values], value_input_option)
+
+
+def demo_catalog_rows(count=200, seed=1):
+    """Демонстрационный каталог: несколько категорий, производителей и линеек."""
+    rnd = random.Random(seed)
+    rows = [CATALOG_HEADER]
+    for i in range(1, count + 1):
+        category = rnd.choice(['Жидкости', 'Картриджи', 'Устройства'])
+        manufacturer = f"Бренд {rnd.randint(1, 6)}"
+        rows.append([f"p{i:04d}", f"Товар {i}", f"Вкус {i}", category, rnd.randint(0, 30),
+                     manufacturer, f"Линейка {rnd.randint(1, 4)}", rnd.choice([25, 35, 45, 60]), ''])
+    return rows
+
+def open_fake_sheets(latency=0.0, error_rate=0.0, catalog_size=200, seed=1):
+    """Пара листов (каталог, заказы) для SHEETS_BACKEND = 'fake'."""
+    catalog = FakeWorksheet('Catalog', demo_catalog_rows(catalog_size, seed), latency, error_rate, seed)
+    orders = FakeWorksheet('Orders', [ORDERS_HEADER], latency, error_rate, seed)
+    return catalog, orders
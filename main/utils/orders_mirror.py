@@ -0,0 +1,226 @@
+import itertools
+import json
+import re
+import threading
+import time
+from datetime import datetime
+
+from config import ORDERS_MIRROR_INTERVAL, SHEETS_QUEUE_BATCH, MANAGER_ID
+from loader import bot, orders_sheet as orders_sheet_client
+from utils.sheets_client import PRIORITY_HIGH, PRIORITY_LOW
+from database.database import db_connection
+from database.orders import (
+    get_order, get_order_items, mark_order_synced, sheet_items_str, count_orders, import_orders_from_sheet,
+    STATUS_CONFIRMED
+)
+from database.sheet_queue import (
+    get_queue_head, complete_jobs, fail_jobs, save_job_payload, JOB_APPEND, JOB_STATUS, JOB_STOCK
+)
+from utils.stock import plan_stock, write_stock
+from utils.utils import get_catalog
+
+# ==========================================
+#        ЗЕРКАЛО ЗАКАЗОВ В GOOGLE ТАБЛИЦЕ
+# ==========================================
+# Оформление и смена статуса пишутся только в SQLite (вместе с заданием в sheet_queue),
+# а эта фоновая задача разбирает очередь строго по порядку:
+# подряд идущие новые заказы уходят одним append_rows, подряд идущие статусы - одним batch_update.
+# При ошибке очередь останавливается на этом же задании и повторяет его позже (с растущей задержкой).
+# Списание остатков (JOB_STOCK) тоже идет только отсюда: один поток пишет остатки по очереди,
+# поэтому два одновременных подтверждения не затирают списания друг друга. Статус заказа
+# и остатки лежат в разных таблицах (заказы и каталог), так что одним batch_update их не записать.
+
+ID_COL = 'A'        # Колонка ID заказа
+STATUS_COL = 'F'    # Колонка статуса
+
+# Запись заказов идет впереди остальных запросов к Google
+orders_sheet = orders_sheet_client.with_priority(PRIORITY_HIGH) if orders_sheet_client is not None else None
+
+_WAKEUP = threading.Event()
+_SYNC_LOCK = threading.Lock()     # Очередь разбирает один поток за раз
+
+def notify_orders_mirror():
+    """Будит фоновую задачу, чтобы изменения попали в таблицу без ожидания интервала."""
+    _WAKEUP.set()
+
+def order_sheet_row(order, items):
+    """Строка таблицы заказов в том же формате, что и раньше писал бот."""
+    return [order['order_id'], order['user_id'], order['username'], sheet_items_str(items), order['total'],
+            order['status'], order['delivery'], order['payment'], (order['created_at'] or '')[:10]]
+
+# --- Индекс строк: order_id -> номер строки в таблице ---
+# Пополняется при добавлении строк (номера берутся из ответа append_rows),
+# целиком строится одним запросом колонки ID при старте или если строки сместились.
+ORDER_ROWS = {}
+_rows_loaded = False
+
+def rebuild_order_rows():
+    """Строит индекс по колонке ID таблицы заказов (один запрос col_values)."""
+    global _rows_loaded
+    if orders_sheet is None:
+        return 0
+    ids = orders_sheet.col_values(1)  # Колонка ID_COL
+    ORDER_ROWS.clear()
+    for row, value in enumerate(ids[1:], start=2):  # Первая строка - заголовок
+        order_id = str(value).strip()
+        if order_id:
+            ORDER_ROWS[order_id] = row
+    _rows_loaded = True
+    return len(ORDER_ROWS)
+
+def _remember_appended_rows(response, order_ids):
+    """Запоминает строки только что добавленных заказов по updatedRange из ответа append_rows."""
+    global _rows_loaded
+    updated_range = response.get('updates', {}).get('updatedRange', '') if isinstance(response, dict) else ''
+    match = re.search(r'![A-Z]+(\d+)', updated_range)
+    if not match:
+        _rows_loaded = False  # Номера неизвестны - перестроим индекс при следующем обновлении статуса
+        return
+    first_row = int(match.group(1))
+    for offset, order_id in enumerate(order_ids):
+        ORDER_ROWS[order_id] = first_row + offset
+
+def _append_orders(jobs):
+    """
+    Добавляет строки заказов. Заказы, которые уже есть в колонке ID, пропускаются: ошибка append_rows
+    не значит, что строки не добавились, поэтому перед повтором (и если индекс неизвестен) индекс
+    перестраивается по таблице - повтор не создаст дубликатов.
+    """
+    if not _rows_loaded or any(job['attempts'] for job in jobs):
+        rebuild_order_rows()
+    rows, appended, synced = [], [], []
+    for job in jobs:
+        order = get_order(job['order_id'])
+        if not order:
+            continue
+        synced.append((order['order_id'], order['status']))
+        if order['order_id'] in ORDER_ROWS or order['order_id'] in appended:
+            continue
+        rows.append(order_sheet_row(order, get_order_items(job['order_id'])))
+        appended.append(order['order_id'])
+    if rows:
+        response = orders_sheet.append_rows(rows)
+        _remember_appended_rows(response, appended)
+    with db_connection() as conn:
+        for order_id, status in synced:
+            mark_order_synced(order_id, status, conn)
+        complete_jobs([job['id'] for job in jobs], conn)
+    return len(rows)
+
+def _locate_rows(order_ids):
+    """
+    Номера строк для заказов. Строки из индекса проверяются одним batch_get колонки ID;
+    если хоть одна не совпала (строки вставляли/удаляли/сортировали) - индекс перестраивается.
+    """
+    if not _rows_loaded:
+        rebuild_order_rows()
+    rows = {order_id: ORDER_ROWS.get(order_id) for order_id in order_ids}
+    known = [(order_id, row) for order_id, row in rows.items() if row]
+    stale = len(known) < len(rows)
+    if known:
+        values = orders_sheet.batch_get([f"{ID_COL}{row}" for _, row in known])
+        for (order_id, _), value_range in zip(known, values):
+            if not value_range or str(value_range[0][0]).strip() != order_id:
+                stale = True
+    if stale:
+        rebuild_order_rows()
+        rows = {order_id: ORDER_ROWS.get(order_id) for order_id in order_ids}
+    return rows
+
+def _update_statuses(jobs):
+    orders = [order for order in (get_order(job['order_id']) for job in jobs) if order]
+    rows = _locate_rows(list({order['order_id'] for order in orders}))
+    updates = []
+    for order in orders:
+        row = rows.get(order['order_id'])
+        if row:
+            updates.append({'range': f"{STATUS_COL}{row}", 'values': [[order['status']]]})
+        else:
+            print(f"[{datetime.now()}] Заказ {order['order_id']} не найден в таблице, статус не обновлен.")
+    if updates:
+        orders_sheet.batch_update(updates)
+    with db_connection() as conn:
+        for order in orders:
+            mark_order_synced(order['order_id'], order['status'], conn)
+        complete_jobs([job['id'] for job in jobs], conn)
+    return len(updates)
+
+def _write_stock(jobs):
+    """
+    Списывает остатки подтвержденных заказов, по одному заданию (каждое удаляется сразу после записи).
+    Расчет (новые абсолютные остатки) сохраняется в задании до записи: повтор после ошибки
+    записывает те же значения, а не вычитает заказ из таблицы второй раз.
+    """
+    catalog = get_catalog()
+    for job in jobs:
+        if job['payload']:
+            plan = json.loads(job['payload'])
+        else:
+            order = get_order(job['order_id'])
+            plan = {'updates': [], 'missing': []}
+            if order and order['status'] == STATUS_CONFIRMED:
+                plan['updates'], plan['missing'] = plan_stock(get_order_items(job['order_id']), catalog)
+            save_job_payload(job['id'], json.dumps(plan))
+            if plan['missing']:
+                print(f"[{datetime.now()}] Заказ {job['order_id']}: остаток не списан для {', '.join(plan['missing'])}")
+                try: bot.send_message(MANAGER_ID, f"⚠️ Заказ {job['order_id']}: остаток не списан "
+                                                  f"(нет в таблице или в ячейке не число): {', '.join(plan['missing'])}")
+                except: pass
+        write_stock(plan['updates'])
+        complete_jobs([job['id']])
+    return len(jobs)
+
+def sync_orders_to_sheet():
+    """Разбирает очередь записей в таблицу. Возвращает (добавлено строк, обновлено статусов)."""
+    if orders_sheet is None:
+        return 0, 0
+    with _SYNC_LOCK:
+        return _drain_queue()
+
+def _drain_queue():
+    appended = updated = 0
+    while True:
+        jobs = get_queue_head(SHEETS_QUEUE_BATCH)
+        if not jobs or jobs[0]['next_attempt_at'] > time.time():
+            break  # Очередь пуста или первое задание ждет повтора - порядок не нарушаем
+
+        # Подряд идущие задания одного типа выполняются одним запросом
+        kind = jobs[0]['kind']
+        batch = list(itertools.takewhile(lambda job: job['kind'] == kind, jobs))
+
+        try:
+            if kind == JOB_APPEND:
+                appended += _append_orders(batch)
+            elif kind == JOB_STATUS:
+                updated += _update_statuses(batch)
+            elif kind == JOB_STOCK:
+                _write_stock(batch)
+            else:
+                complete_jobs([job['id'] for job in batch])  # Неизвестный тип задания - не блокируем очередь
+        except Exception as e:
+            fail_jobs([job['id'] for job in batch], e)
+            print(f"[{datetime.now()}] Ошибка записи в таблицу заказов ({len(batch)} зад.), повторю позже: {e}")
+            break
+
+    return appended, updated
+
+def periodic_orders_mirror():
+    """Фоновая задача: синхронизирует таблицу заказов по сигналу или раз в ORDERS_MIRROR_INTERVAL секунд."""
+    while True:
+        _WAKEUP.wait(ORDERS_MIRROR_INTERVAL)
+        _WAKEUP.clear()
+        try:
+            appended, updated = sync_orders_to_sheet()
+            if appended or updated:
+                print(f"[{datetime.now()}] Таблица заказов: добавлено {appended}, обновлено статусов {updated}.")
+        except Exception as e:
+            print(f"[{datetime.now()}] Ошибка синхронизации таблицы заказов: {e}")
+
+def import_orders_history(catalog):
+    """При первом запуске переносит историю заказов из таблицы в SQLite."""
+    if orders_sheet is None or count_orders() > 0:
+        return 0
+    rows = orders_sheet.with_priority(PRIORITY_LOW).get_all_values()[1:]  # Без заголовка
+    imported = import_orders_from_sheet(rows, catalog)
+    print(f"[{datetime.now()}] Импортировано заказов из таблицы: {imported}.")
+    return imported
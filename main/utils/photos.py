@@ -0,0 +1,151 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from config import SYS_CHAT_ID, PHOTO_UPLOADS_PER_MINUTE, PHOTO_WARM_LIMIT
+from loader import bot
+from database.database import (
+    close_db_connection, get_cached_photo, get_cached_photo_by_hash, save_cached_photo,
+    delete_cached_photos, delete_cached_photo_content, get_cached_photo_urls
+)
+from utils.broadcast import _retry_after
+from utils.sheets_client import TokenBucket, PRIORITY_HIGH, PRIORITY_LOW
+
+# Загрузки идут в один тех. чат, а в группе Telegram пропускает ~20 сообщений в минуту.
+# Загрузка при показе товара (PRIORITY_HIGH) обходит в очереди фоновый прогрев (PRIORITY_LOW).
+# На 429 прогрев ждет retry_after и повторяет, а показ товара не ждет: фото уходит по URL.
+UPLOAD_BUCKET = TokenBucket(PHOTO_UPLOADS_PER_MINUTE / 60.0, 3)
+UPLOAD_RETRIES = 3
+
+# Память процесса: URL -> file_id (чтобы не ходить в БД на каждый показ товара)
+PHOTO_IDS = {}
+_UPLOAD_LOCK = threading.Lock()
+_WARM_LOCK = threading.Lock()
+_pause_until = 0.0          # До этого момента (monotonic) тех. чат под flood control
+
+def _send_to_cache_chat(content, url, priority):
+    """Отправляет фото в тех. чат с учетом лимита и retry_after. Возвращает file_id."""
+    global _pause_until
+    for attempt in range(UPLOAD_RETRIES + 1):
+        delay = _pause_until - time.monotonic()
+        if delay > 0:
+            if priority == PRIORITY_HIGH:
+                raise RuntimeError(f"лимит Telegram на загрузку фото, еще {delay:.0f} сек.")
+            time.sleep(delay)
+        UPLOAD_BUCKET.acquire(priority)
+        try:
+            msg = bot.send_photo(SYS_CHAT_ID, content, caption=f"🖼 Кэш фото: {url}")
+        except ApiTelegramException as e:
+            if getattr(e, 'error_code', None) != 429 or attempt == UPLOAD_RETRIES:
+                raise
+            retry_after = _retry_after(e)
+            print(f"[{datetime.now()}] Кэш фото: лимит Telegram, пауза {retry_after} сек.")
+            _pause_until = max(_pause_until, time.monotonic() + retry_after)
+            continue
+        # Сообщение в тех. чате больше не нужно, file_id остается действительным
+        try:
+            bot.delete_message(SYS_CHAT_ID, msg.message_id)
+        except Exception:
+            pass
+        return msg.photo[-1].file_id
+
+def _upload_photo(url, priority=PRIORITY_HIGH):
+    """
+    Скачивает фото один раз, загружает его в тех. чат и возвращает file_id.
+    Если картинка с таким же содержимым уже загружалась (другой URL) - переиспользует её file_id.
+    """
+    # Скачивание - без блокировки: медленный хост с фото не задерживает остальные загрузки
+    response = requests.get(url, timeout=15)
+    response.raise_for_status()
+    content = response.content
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    with _UPLOAD_LOCK:
+        # Пока скачивали, это фото (или такое же по содержимому) мог загрузить другой поток
+        file_id = PHOTO_IDS.get(url) or get_cached_photo_by_hash(content_hash)
+        if not file_id:
+            file_id = _send_to_cache_chat(content, url, priority)
+        save_cached_photo(url, content_hash, file_id)
+        PHOTO_IDS[url] = file_id
+    return file_id
+
+def get_photo_file_id(url, upload=True, priority=PRIORITY_HIGH):
+    """Возвращает file_id для URL фото: из памяти, из БД или (при upload=True) загрузив фото."""
+    file_id = PHOTO_IDS.get(url)
+    if file_id:
+        return file_id
+    file_id = get_cached_photo(url)
+    if file_id:
+        PHOTO_IDS[url] = file_id
+        return file_id
+    if not upload:
+        return None
+    return _upload_photo(url, priority)
+
+def invalidate_photo(url, file_id=None):
+    """
+    Сбрасывает кэш фото. Записи других URL с тем же содержимым удаляются тоже:
+    иначе поиск по хэшу вернул бы тот же недействительный file_id.
+    """
+    with _UPLOAD_LOCK:
+        for u in delete_cached_photo_content(url):
+            PHOTO_IDS.pop(u, None)
+        if file_id:
+            for u in [u for u, f in list(PHOTO_IDS.items()) if f == file_id]:
+                PHOTO_IDS.pop(u, None)
+
+def send_product_photo(chat_id, url, **kwargs):
+    """
+    Отправляет фото товара по file_id. При первом показе фото загружается один раз,
+    если file_id устарел - кэш сбрасывается и фото загружается заново.
+    В крайнем случае отправляем по URL, как раньше.
+    """
+    try:
+        file_id = get_photo_file_id(url)
+    except Exception as e:
+        print(f"[{datetime.now()}] Не удалось закэшировать фото {url}: {e}")
+        return bot.send_photo(chat_id, url, **kwargs)
+
+    try:
+        return bot.send_photo(chat_id, file_id, **kwargs)
+    except ApiTelegramException as e:
+        if 'file' not in str(e).lower():
+            raise
+        print(f"[{datetime.now()}] file_id для {url} недействителен, загружаю заново: {e}")
+        invalidate_photo(url, file_id)
+        return bot.send_photo(chat_id, get_photo_file_id(url), **kwargs)
+
+def warm_photo_cache(catalog):
+    """
+    Фоновая задача после обновления каталога: загружает фото, которых ещё нет в кэше
+    (не больше PHOTO_WARM_LIMIT за раз, остальные загрузятся при показе или следующем прогреве),
+    и удаляет записи для URL, которые пропали из таблицы (фото заменили или товар удален).
+    """
+    if not _WARM_LOCK.acquire(blocking=False):
+        return  # Предыдущий прогрев ещё идет, новые фото догрузятся лениво при показе
+    try:
+        urls = {item.photo_url for item in catalog.items if item.photo_url}
+        stale = [u for u in get_cached_photo_urls() if u not in urls]
+        if stale:
+            delete_cached_photos(stale)
+            for u in stale:
+                PHOTO_IDS.pop(u, None)
+
+        missing = [url for url in sorted(urls) if not get_photo_file_id(url, upload=False)]
+        uploaded = 0
+        for url in missing[:PHOTO_WARM_LIMIT]:
+            try:
+                get_photo_file_id(url, priority=PRIORITY_LOW)
+                uploaded += 1
+            except Exception as e:
+                print(f"[{datetime.now()}] Не удалось загрузить фото {url}: {e}")
+        if uploaded or stale:
+            print(f"[{datetime.now()}] Кэш фото: загружено {uploaded}, осталось {len(missing) - uploaded}, "
+                  f"удалено устаревших {len(stale)}.")
+    finally:
+        _WARM_LOCK.release()
+        close_db_connection()
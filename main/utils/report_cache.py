@@ -0,0 +1,69 @@
+import threading
+import time
+from datetime import datetime
+
+# ==========================================
+#        КЭШ ОТЧЕТОВ АДМИНКИ
+# ==========================================
+# Готовый текст отчета хранится ttl секунд. Если отчет устарел и его одновременно
+# запрашивают несколько админов (или один нажал дважды), считает только первый запрос,
+# остальные ждут его результат. Ошибки не кэшируются: следующий запрос посчитает заново.
+
+REPORTS = {}        # ключ -> (текст, time.time() расчета)
+REPORT_STATS = {'hits': 0, 'builds': 0, 'waits': 0}
+_FLIGHTS = {}       # ключ -> _Flight выполняющегося расчета
+_LOCK = threading.Lock()
+
+
+class _Flight:
+    """Выполняющийся расчет отчета; text остается None, если расчет упал."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+        self.built_at = None
+
+
+def get_report(key, build, ttl, refresh=False):
+    """
+    Текст отчета `key` и его возраст в секундах.
+    build() вызывается, если отчета нет, он старше ttl или refresh=True.
+    """
+    while True:
+        with _LOCK:
+            cached = REPORTS.get(key)
+            if cached and not refresh and time.time() - cached[1] < ttl:
+                REPORT_STATS['hits'] += 1
+                return cached[0], time.time() - cached[1]
+            flight = _FLIGHTS.get(key)
+            if flight is None:
+                flight = _FLIGHTS[key] = _Flight()
+                break
+            REPORT_STATS['waits'] += 1
+        # Отчет уже считается в другом потоке - ждем и берем его результат
+        flight.done.wait()
+        if flight.text is not None:
+            return flight.text, time.time() - flight.built_at
+        # Расчет упал - пробуем сами
+
+    try:
+        started = time.monotonic()
+        text = build()
+        flight.built_at = time.time()
+        flight.text = text
+        with _LOCK:
+            REPORTS[key] = (text, flight.built_at)
+            REPORT_STATS['builds'] += 1
+        print(f"[{datetime.now()}] Отчет {key} пересчитан за {(time.monotonic() - started) * 1000:.0f} мс")
+        return text, 0.0
+    finally:
+        with _LOCK:
+            _FLIGHTS.pop(key, None)
+        flight.done.set()
+
+def format_age(seconds):
+    """'только что' / '45 сек. назад' / '5 мин. назад'."""
+    if seconds < 5:
+        return "только что"
+    if seconds < 60:
+        return f"{seconds:.0f} сек. назад"
+    return f"{seconds // 60:.0f} мин. назад"
@@ -0,0 +1,142 @@
+from telebot.util import extract_command
+
+
+class PrefixTrie:
+    """Префиксное дерево: находит обработчик с самым длинным совпавшим префиксом за O(длина строки)."""
+    _HANDLER = object()
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, handler):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if self._HANDLER in node:
+            raise ValueError(f"Префикс {prefix!r} уже зарегистрирован")
+        node[self._HANDLER] = handler
+
+    def match(self, text):
+        node, found = self._root, None
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(self._HANDLER, found)
+        return found
+
+
+class Router:
+    """
+    Единая таблица маршрутизации сообщений и callback-кнопок.
+    Вместо последовательной проверки десятков фильтров telebot
+    делаем поиск по словарю (точный текст/команда) и по префиксному дереву.
+
+    Порядок для текста: команда -> точный текст -> динамические проверки (lookup) -> префикс -> fallback.
+    Порядок для callback: точное значение -> самый длинный префикс.
+    """
+
+    def __init__(self):
+        self._commands = {}
+        self._texts = {}
+        self._lookups = []
+        self._text_prefixes = PrefixTrie()
+        self._fallback = None
+        self._callbacks = {}
+        self._callback_prefixes = PrefixTrie()
+        self._teardown = []
+
+    # --- Регистрация ---
+    @staticmethod
+    def _register(table, keys, handler):
+        for key in keys:
+            if key in table:
+                raise ValueError(f"Маршрут {key!r} уже зарегистрирован")
+            table[key] = handler
+
+    @staticmethod
+    def _as_tuple(value):
+        if value is None:
+            return ()
+        return (value,) if isinstance(value, str) else tuple(value)
+
+    def command(self, *names):
+        """Команды вида /name (аргументы после пробела и @botname игнорируются при поиске)."""
+        def decorator(handler):
+            self._register(self._commands, [n.lower() for n in names], handler)
+            return handler
+        return decorator
+
+    def message(self, *texts, prefix=None, lookup=None):
+        """
+        Текстовые сообщения: точное совпадение, префикс или lookup(text) -> bool.
+        lookup должен быть дешевым (проверка по множеству), например категории текущей версии каталога.
+        """
+        def decorator(handler):
+            self._register(self._texts, texts, handler)
+            for p in self._as_tuple(prefix):
+                self._text_prefixes.add(p, handler)
+            if lookup is not None:
+                self._lookups.append((lookup, handler))
+            return handler
+        return decorator
+
+    def teardown(self, func):
+        """Функция, вызываемая после каждого апдейта (даже если хэндлер упал)."""
+        self._teardown.append(func)
+        return func
+
+    def fallback(self, handler):
+        """Обработчик для текста, не подошедшего ни под один маршрут."""
+        self._fallback = handler
+        return handler
+
+    def callback(self, *values, prefix=None):
+        """Callback-кнопки: точное значение call.data или префикс."""
+        def decorator(handler):
+            self._register(self._callbacks, values, handler)
+            for p in self._as_tuple(prefix):
+                self._callback_prefixes.add(p, handler)
+            return handler
+        return decorator
+
+    # --- Диспетчеризация ---
+    def resolve_message(self, text):
+        if text is None:
+            return None
+        if text.startswith('/'):
+            command = extract_command(text)
+            handler = self._commands.get(command.lower() if command else None)
+            if handler:
+                return handler
+        handler = self._texts.get(text)
+        if handler:
+            return handler
+        for lookup, handler in self._lookups:
+            if lookup(text):
+                return handler
+        return self._text_prefixes.match(text) or self._fallback
+
+    def resolve_callback(self, data):
+        if data is None:
+            return None
+        return self._callbacks.get(data) or self._callback_prefixes.match(data)
+
+    def _run(self, handler, update):
+        try:
+            if handler:
+                handler(update)
+        finally:
+            for func in self._teardown:
+                func()
+
+    def dispatch_message(self, message):
+        self._run(self.resolve_message(message.text), message)
+
+    def dispatch_callback(self, call):
+        self._run(self.resolve_callback(call.data), call)
+
+    def install(self, bot):
+        """Регистрирует в telebot по одному обработчику на сообщения и callback-и."""
+        bot.register_message_handler(self.dispatch_message, func=lambda message: True, content_types=['text'])
+        bot.register_callback_query_handler(self.dispatch_callback, func=lambda call: True)
@@ -0,0 +1,203 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from config import SHEETS_REQUESTS_PER_MINUTE, SHEETS_BURST, SHEETS_MAX_RETRIES, SHEETS_MAX_BACKOFF
+
+# ==========================================
+#        КЛИЕНТ GOOGLE ТАБЛИЦ С УЧЕТОМ КВОТЫ
+# ==========================================
+# Все обращения к листам идут через SheetsClient (создается в loader.py):
+# - общий token bucket на SHEETS_REQUESTS_PER_MINUTE запросов (квота Google на пользователя);
+# - приоритеты: когда токенов не хватает, первыми проходят запросы оформления/подтверждения заказов;
+# - 429 и 5xx повторяются с экспоненциальной задержкой и случайным разбросом (jitter),
+#   но только для чтений и идемпотентных записей (RETRY_METHODS): повтор append_rows после
+#   ответа, который не дошел, добавил бы строки дважды - такую ошибку разбирает вызывающий код;
+# - одинаковые одновременные чтения выполняются одним запросом;
+# - счетчики вызовов и задержек по методам (показываются в статусе админки).
+
+PRIORITY_HIGH = 0     # Заказы: запись строк, статусы, списание остатков
+PRIORITY_NORMAL = 1   # Синхронизация каталога
+PRIORITY_LOW = 2      # Отчеты, импорт истории
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+READ_METHODS = {'get_all_records', 'get_all_values', 'col_values', 'row_values', 'batch_get',
+                'find', 'findall', 'cell', 'acell', 'get', 'get_lastUpdateTime'}
+# Повтор этих вызовов безопасен: запись тех же значений в те же ячейки дает тот же результат
+RETRY_METHODS = READ_METHODS | {'batch_update', 'update_cell'}
+
+
+class TokenBucket:
+    """Token bucket, в котором ожидающие обслуживаются по приоритету (при равном - по очереди прихода)."""
+
+    def __init__(self, rate_per_sec, capacity):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Ждет токен. Возвращает время ожидания в секундах."""
+        started = time.monotonic()
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            while True:
+                self._refill()
+                if self._waiters[0] == ticket and self._tokens >= 1:
+                    heapq.heappop(self._waiters)
+                    self._tokens -= 1
+                    self._cond.notify_all()
+                    return time.monotonic() - started
+                if self._waiters[0] == ticket:
+                    self._cond.wait((1 - self._tokens) / self.rate)
+                else:
+                    self._cond.wait()
+
+
+BUCKET = TokenBucket(SHEETS_REQUESTS_PER_MINUTE / 60.0, SHEETS_BURST)
+
+# Счетчики по методам: {метод: {'calls', 'errors', 'retries', 'coalesced', 'total_ms', 'max_ms', 'wait_ms'}}
+SHEETS_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+def _record(method, **values):
+    with _STATS_LOCK:
+        stats = SHEETS_STATS.setdefault(method, {'calls': 0, 'errors': 0, 'retries': 0, 'coalesced': 0,
+                                                 'total_ms': 0.0, 'max_ms': 0.0, 'wait_ms': 0.0})
+        for key, value in values.items():
+            if key == 'max_ms':
+                stats['max_ms'] = max(stats['max_ms'], value)
+            else:
+                stats[key] += value
+
+def is_retryable(error):
+    """429 (квота), 5xx и сетевые ошибки имеет смысл повторить."""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status in RETRY_STATUSES or isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+def backoff_delay(attempt):
+    """Экспоненциальная задержка с jitter: случайное значение в [половина, полная] от 2^attempt сек."""
+    delay = min(SHEETS_MAX_BACKOFF, 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class _Flight:
+    """Одно выполняющееся чтение, результат которого ждут одинаковые запросы."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SheetsClient:
+    """
+    Обертка над объектом gspread (лист или таблица).
+    Методы вызываются так же, как у gspread: sheet.get_all_records(), sheet.batch_update(...).
+    with_priority() возвращает ту же обертку с другим приоритетом.
+    """
+    _flights = {}
+    _flights_lock = threading.Lock()
+
+    def __init__(self, target, name, priority=PRIORITY_NORMAL):
+        self._target = target
+        self._name = name
+        self._priority = priority
+
+    def with_priority(self, priority):
+        return SheetsClient(self._target, self._name, priority)
+
+    @property
+    def raw(self):
+        return self._target
+
+    @property
+    def spreadsheet(self):
+        return SheetsClient(self._target.spreadsheet, f"{self._name}.spreadsheet", self._priority)
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            if attr in READ_METHODS:
+                return self._coalesced(attr, value, args, kwargs)
+            return self._call(attr, value, args, kwargs)
+        return call
+
+    def _call(self, attr, func, args, kwargs):
+        method = f"{self._name}.{attr}"
+        attempt = 0
+        while True:
+            waited = BUCKET.acquire(self._priority)
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                elapsed = (time.monotonic() - started) * 1000
+                _record(method, calls=1, errors=1, total_ms=elapsed, max_ms=elapsed, wait_ms=waited * 1000)
+                if attr not in RETRY_METHODS or attempt >= SHEETS_MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt)
+                attempt += 1
+                _record(method, retries=1)
+                print(f"[{datetime.now()}] Google Таблицы: {method} - {e}. Повтор {attempt}/{SHEETS_MAX_RETRIES} через {delay:.1f} сек.")
+                time.sleep(delay)
+                continue
+            elapsed = (time.monotonic() - started) * 1000
+            _record(method, calls=1, total_ms=elapsed, max_ms=elapsed, wait_ms=waited * 1000)
+            return result
+
+    def _coalesced(self, attr, func, args, kwargs):
+        key = (id(self._target), attr, repr(args), repr(sorted(kwargs.items())))
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            _record(f"{self._name}.{attr}", coalesced=1)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._call(attr, func, args, kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
+def format_sheets_stats():
+    """Текст сводки по запросам к Google Таблицам для админов."""
+    with _STATS_LOCK:
+        items = sorted(SHEETS_STATS.items(), key=lambda kv: -kv[1]['calls'])
+        if not items:
+            return "Запросов к Google Таблицам ещё не было."
+        lines = ["Google Таблицы (вызовов / ошибок / повторов / склеено, средн. и макс. мс, ожидание квоты мс):"]
+        for method, s in items:
+            avg = s['total_ms'] / s['calls'] if s['calls'] else 0
+            lines.append(f"• {method}: {s['calls']}/{s['errors']}/{s['retries']}/{s['coalesced']}, "
+                         f"{avg:.0f} и {s['max_ms']:.0f} мс, {s['wait_ms']:.0f} мс")
+    return "\n".join(lines)
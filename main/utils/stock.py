@@ -0,0 +1,103 @@
+from datetime import datetime
+
+from loader import sheet as catalog_sheet
+from utils.sheets_client import PRIORITY_HIGH
+from utils.catalog import _parse_int
+
+# ==========================================
+#        СПИСАНИЕ ОСТАТКОВ В ТАБЛИЦЕ КАТАЛОГА
+# ==========================================
+# Номер строки каждого товара известен из последней синхронизации каталога (Product.row),
+# поэтому для заказа любого размера достаточно двух запросов к Google:
+# batch_get текущих значений и один batch_update со всеми новыми остатками.
+# Если товар сместился в таблице (строку вставили/удалили), его строка ищется через find.
+# Списание разбито на расчет (plan_stock: чтение и новые абсолютные остатки) и запись
+# (write_stock), чтобы расчет можно было сохранить и при повторе записать те же значения -
+# повтор после ошибки Google не спишет заказ второй раз (см. utils/orders_mirror.py).
+
+ID_COL = 'A'
+STOCK_COL = 'E'
+
+# Подтверждение заказа - запрос с высоким приоритетом
+sheet = catalog_sheet.with_priority(PRIORITY_HIGH) if catalog_sheet is not None else None
+
+def _read_rows(rows, calls):
+    """{номер строки: (id, остаток)} для указанных строк - одним batch_get."""
+    ranges = [f"{ID_COL}{row}:{STOCK_COL}{row}" for row in rows]
+    calls['batch_get'] = calls.get('batch_get', 0) + 1
+    result = {}
+    for row, value_range in zip(rows, sheet.batch_get(ranges)):
+        values = value_range[0] if value_range else []
+        pid = str(values[0]).strip() if values else ''
+        stock = values[4] if len(values) > 4 else ''
+        result[row] = (pid, stock)
+    return result
+
+def plan_stock(items, catalog, calls=None):
+    """
+    Рассчитывает списание по позициям заказа [(product_id, name, quantity)], ничего не записывая.
+    Возвращает (обновления для batch_update с новыми остатками, список товаров, не найденных
+    в таблице или с нечисловым остатком).
+    """
+    calls = {} if calls is None else calls
+    need = {}
+    for pid, _, qty in items:
+        need[pid] = need.get(pid, 0) + qty
+
+    rows = {}
+    for pid in need:
+        product = catalog.get(pid)
+        if product and product.row:
+            rows[pid] = product.row
+
+    current = _read_rows(sorted(set(rows.values())), calls) if rows else {}
+
+    # Самовосстановление: строка сместилась после синхронизации или товара нет в кэше
+    for pid in need:
+        row = rows.get(pid)
+        if row and current.get(row, ('',))[0] == pid:
+            continue
+        calls['find'] = calls.get('find', 0) + 1
+        cell = sheet.find(pid, in_column=1)
+        if cell:
+            rows[pid] = cell.row
+        else:
+            rows.pop(pid, None)
+
+    moved = [row for pid, row in rows.items() if row not in current or current[row][0] != pid]
+    if moved:
+        current.update(_read_rows(sorted(set(moved)), calls))
+
+    updates, missing = [], []
+    for pid, qty in need.items():
+        row = rows.get(pid)
+        if not row:
+            missing.append(pid)
+            continue
+        try:
+            stock = _parse_int(current[row][1], 'Количество', default=0)
+        except ValueError:
+            # В ячейке не число - не затираем ее, товар попадает в список несписанных
+            missing.append(pid)
+            continue
+        updates.append({'range': f"{STOCK_COL}{row}", 'values': [[stock - qty]]})
+    return updates, missing
+
+def write_stock(updates, calls=None):
+    """Записывает рассчитанные остатки одним batch_update (повтор с теми же updates безопасен)."""
+    calls = {} if calls is None else calls
+    if updates:
+        calls['batch_update'] = calls.get('batch_update', 0) + 1
+        sheet.batch_update(updates)
+    print(f"[{datetime.now()}] Списание остатков: {len(updates)} товаров, запросов к Google: {sum(calls.values())} {calls}")
+    return calls
+
+def decrement_stock(items, catalog):
+    """
+    Рассчитывает и сразу записывает списание (без сохранения расчета - для замеров в bench).
+    Возвращает (список несписанных товаров, {метод API: число вызовов}).
+    """
+    calls = {}
+    updates, missing = plan_stock(items, catalog, calls)
+    write_stock(updates, calls)
+    return missing, calls
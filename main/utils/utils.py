@@ -1,69 +1,265 @@
 import threading
 import time
-import shutil
 import os
+import gzip
+import json
+import itertools
+import atexit
 import telebot
 from datetime import datetime
 from functools import wraps
 
 from config import (
-    DB_NAME, BACKUP_INTERVAL, SYS_CHAT_ID, 
-    DISCOUNT_QTY_THRESHOLD, DISCOUNT_PER_LIQUID
+    BACKUP_INTERVAL, SYS_CHAT_ID, MANAGER_ID,
+    DISCOUNT_QTY_THRESHOLD, DISCOUNT_PER_LIQUID, CATALOG_SYNC_INTERVAL,
+    CATALOG_SNAPSHOT_FILE, LAST_SEEN_FLUSH_INTERVAL
 )
 from loader import bot, sheet
-from database.database import get_db_connection, get_cart_items, is_admin
+from database.database import (
+    get_db_connection, get_cart_items, is_admin,
+    get_all_user_ids, register_user, save_last_seen
+)
+from database.backup import create_backup
+from utils.catalog import Catalog, Product, EMPTY_CATALOG, diff_catalog, parse_rows
+from utils.photos import warm_photo_cache
 
 # --- СИСТЕМА КЭШИРОВАНИЯ ---
-CATALOG_CACHE = []
+# Текущий снимок каталога. Заменяется целиком (атомарно) при каждом обновлении,
+# хэндлеры получают его через get_catalog() и читают без блокировок.
+CATALOG = EMPTY_CATALOG
+# Блокировка нужна только писателям, чтобы два обновления не публиковались одновременно
 CACHE_LOCK = threading.Lock()
+_catalog_versions = itertools.count(1)
+
+def get_catalog():
+    """Возвращает актуальный снимок каталога."""
+    return CATALOG
+
+def _publish_catalog(catalog):
+    """Публикует новый снимок каталога и сбрасывает всё, что от него зависит. Вызывать под CACHE_LOCK."""
+    global CATALOG
+    CATALOG = catalog
+    with MARKUP_CACHE_LOCK:
+        MARKUP_CACHE.clear()
+    # Загружаем новые фото в Telegram заранее, чтобы первый показ товара не ждал загрузки
+    if len(catalog):
+        threading.Thread(target=warm_photo_cache, args=(catalog,), daemon=True).start()
+
+# --- КЭШ КЛАВИАТУР ---
+# Готовые (уже сериализованные в JSON) клавиатуры навигации.
+# Для всех пользователей они одинаковы, пока не сменилась версия каталога.
+MARKUP_CACHE = {}
+MARKUP_CACHE_LOCK = threading.Lock()
+
+def cached_markup(key, build):
+    """
+    Возвращает JSON клавиатуры для ключа экрана (screen, категория, ...) текущей версии каталога.
+    build(catalog) вызывается только при промахе и должен вернуть объект клавиатуры telebot.
+    """
+    catalog = CATALOG
+    cache_key = key + (catalog.version,)
+    markup = MARKUP_CACHE.get(cache_key)
+    if markup is None:
+        markup = build(catalog).to_json()
+        with MARKUP_CACHE_LOCK:
+            # Ключ старой версии мог попасть сюда уже после сброса - не сохраняем его
+            if catalog is CATALOG:
+                MARKUP_CACHE[cache_key] = markup
+    return markup
 
-def update_catalog_cache():
-    """Обновляет локальный кэш данных из Google Таблицы."""
-    global CATALOG_CACHE
-    print(f"[{datetime.now()}] Начинаю обновление кэша каталога...")
+# Сводка по синхронизации каталога (показывается админам)
+SYNC_STATS = {
+    'checks': 0,            # Сколько раз проверяли таблицу
+    'skipped': 0,           # Пропущено: таблица не менялась
+    'full_fetches': 0,      # Полных загрузок get_all_records
+    'unchanged_fetches': 0, # Загрузили, но строки не изменились
+    'errors': 0,
+    'revision': None,       # Время последнего изменения таблицы (по данным Google)
+    'last_check': None,
+    'last_change': None,
+    'last_diff': None,
+    'last_duration': 0.0,
+    'bad_rows': [],         # Строки таблицы, не прошедшие проверку: [(номер строки, причина)]
+}
+# Синхронизацию запускают и фоновая задача, и админ (/sync) - счетчики меняются под блокировкой
+_SYNC_STATS_LOCK = threading.Lock()
+
+def _sync_stat(key=None, **values):
+    """+1 к счетчику key и/или запись значений values в SYNC_STATS."""
+    with _SYNC_STATS_LOCK:
+        if key:
+            SYNC_STATS[key] += 1
+        SYNC_STATS.update(values)
+
+def _get_sheet_revision():
+    """Дешевая проверка метаданных: время последнего изменения таблицы (или None, если недоступно)."""
+    try:
+        spreadsheet = sheet.spreadsheet
+        if hasattr(spreadsheet, 'get_lastUpdateTime'):
+            return spreadsheet.get_lastUpdateTime()
+        return getattr(spreadsheet, 'lastUpdateTime', None)
+    except Exception as e:
+        print(f"[{datetime.now()}] Не удалось получить ревизию таблицы: {e}")
+        return None
+
+def update_catalog_cache(force=False):
+    """
+    Обновляет локальный кэш данных из Google Таблицы.
+    Без force сначала проверяет ревизию таблицы и не скачивает её, если изменений не было.
+    Скачанная таблица разбирается целиком, и снимок с индексами строится заново; сравнение
+    со старым снимком (diff_catalog) нужно, чтобы не публиковать каталог без изменений
+    и показать админам, что именно поменялось.
+    """
+    started = time.time()
+    _sync_stat('checks', last_check=datetime.now())
     try:
         if sheet is None:
             print("❌ Ошибка: Нет подключения к таблице.")
+            _sync_stat('errors')
             return False
-            
+
+        revision = _get_sheet_revision()
+        if not force and revision is not None and revision == SYNC_STATS['revision'] and len(CATALOG):
+            _sync_stat('skipped')
+            return True
+
+        print(f"[{datetime.now()}] Начинаю обновление кэша каталога...")
         fresh_data = sheet.get_all_records()
+        _sync_stat('full_fetches')
+        products, bad_rows = parse_rows(fresh_data)
+        _report_bad_rows(bad_rows)
+
         with CACHE_LOCK:
-            CATALOG_CACHE = fresh_data
-        print(f"[{datetime.now()}] Кэш успешно обновлен. Загружено {len(fresh_data)} позиций.")
+            diff = diff_catalog(CATALOG, products)
+            if diff.is_empty() and len(CATALOG):
+                _sync_stat('unchanged_fetches')
+            else:
+                _publish_catalog(Catalog(diff.items, version=next(_catalog_versions)))
+                _sync_stat(last_change=datetime.now(), last_diff=diff.summary())
+                print(f"[{datetime.now()}] Кэш обновлен (версия {CATALOG.version}, {diff.summary()}). Всего {len(CATALOG)} позиций.")
+            _sync_stat(revision=revision)
+            save_catalog_snapshot(CATALOG, revision)
         return True
     except Exception as e:
+        _sync_stat('errors')
         print(f"[{datetime.now()}] ОШИБКА при обновлении кэша: {e}")
         return False
+    finally:
+        _sync_stat(last_duration=time.time() - started)
+
+def _report_bad_rows(bad_rows):
+    """Сообщает менеджеру о некорректных строках каталога (только если список изменился)."""
+    with _SYNC_STATS_LOCK:
+        if bad_rows == SYNC_STATS['bad_rows']:
+            return
+        SYNC_STATS['bad_rows'] = bad_rows
+    if not bad_rows:
+        return
+    print(f"[{datetime.now()}] В каталоге {len(bad_rows)} некорректных строк, они пропущены.")
+    text = f"⚠️ В таблице каталога {len(bad_rows)} некорректных строк (пропущены при синхронизации):\n\n"
+    text += "\n".join(f"• Строка {row}: {reason}" for row, reason in bad_rows[:30])
+    if len(bad_rows) > 30:
+        text += f"\n... и еще {len(bad_rows) - 30}"
+    try:
+        bot.send_message(MANAGER_ID, text)
+    except Exception as e:
+        print(f"Не удалось отправить отчет о строках каталога: {e}")
+
+def save_catalog_snapshot(catalog, revision=None):
+    """Сохраняет снимок каталога на диск (атомарно, через временный файл)."""
+    payload = {
+        'version': catalog.version,
+        'revision': revision,
+        'saved_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'fields': Product.__slots__,
+        'products': [p.to_tuple() for p in catalog.items],
+    }
+    tmp_name = CATALOG_SNAPSHOT_FILE + '.tmp'
+    try:
+        with gzip.open(tmp_name, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_name, CATALOG_SNAPSHOT_FILE)
+    except Exception as e:
+        print(f"[{datetime.now()}] Не удалось сохранить снимок каталога: {e}")
+
+def load_catalog_snapshot():
+    """Загружает последний сохраненный снимок каталога. Возвращает True, если каталог опубликован."""
+    global _catalog_versions
+    if not os.path.exists(CATALOG_SNAPSHOT_FILE):
+        return False
+    try:
+        with gzip.open(CATALOG_SNAPSHOT_FILE, 'rt', encoding='utf-8') as f:
+            payload = json.load(f)
+        if list(payload.get('fields', ())) != list(Product.__slots__):
+            print(f"[{datetime.now()}] Снимок каталога в старом формате, пропускаю.")
+            return False
+        # Снимок целиком разбирается до публикации: битый файл не меняет ни каталог, ни счетчик версий
+        version = int(payload.get('version') or 0)
+        catalog = Catalog([Product.from_tuple(v) for v in payload['products']], version=version)
+        with CACHE_LOCK:
+            # Продолжаем нумерацию версий, чтобы кэши, зависящие от версии, не путались после рестарта
+            _catalog_versions = itertools.count(version + 1)
+            _publish_catalog(catalog)
+            _sync_stat(revision=payload.get('revision'))
+        print(f"[{datetime.now()}] Каталог загружен из снимка от {payload.get('saved_at')}: {len(CATALOG)} позиций.")
+        return True
+    except Exception as e:
+        print(f"[{datetime.now()}] Не удалось прочитать снимок каталога: {e}")
+        return False
+
+def format_sync_stats():
+    """Текст сводки по синхронизации каталога для админов."""
+    def fmt(dt):
+        return dt.strftime("%Y-%m-%d %H:%M:%S") if dt else "—"
+
+    with _SYNC_STATS_LOCK:
+        s = dict(SYNC_STATS)
+    return (f"🔄 *Синхронизация каталога*\n\n"
+            f"Версия каталога: {CATALOG.version} ({len(CATALOG)} позиций)\n"
+            f"Интервал опроса: {CATALOG_SYNC_INTERVAL} сек.\n"
+            f"Проверок: {s['checks']}\nПропущено (без изменений): {s['skipped']}\n"
+            f"Полных загрузок: {s['full_fetches']} (из них без изменений: {s['unchanged_fetches']})\n"
+            f"Ошибок: {s['errors']}\n"
+            f"Некорректных строк в таблице: {len(s['bad_rows'])}\n\n"
+            f"Последняя проверка: {fmt(s['last_check'])} ({s['last_duration']:.2f} сек.)\n"
+            f"Последнее изменение: {fmt(s['last_change'])}\n"
+            f"Изменения: {s['last_diff'] or '—'}")
 
 def periodic_cache_update():
-    """Фоновая задача: обновляет кэш каждые 10 минут."""
+    """Фоновая задача: проверяет таблицу каждые CATALOG_SYNC_INTERVAL секунд."""
     while True:
         update_catalog_cache()
-        time.sleep(600)
+        time.sleep(CATALOG_SYNC_INTERVAL)
 
 # --- СИСТЕМА БЭКАПОВ ---
+def run_backup():
+    """
+    Снимает бэкап (см. database/backup.py) и отправляет его в тех. чат.
+    Возвращает True, если бэкап был отправлен.
+    """
+    print(f"[{datetime.now()}] 📦 Создание бэкапа...")
+    backup_path, content_hash = create_backup()
+    try:
+        size_kb = os.path.getsize(backup_path) / 1024
+        with open(backup_path, 'rb') as file:
+            bot.send_document(
+                chat_id=SYS_CHAT_ID, 
+                document=file,
+                caption=f"📦 Автоматический бэкап базы данных\n🕒 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                        f"💾 {size_kb:.0f} КБ (gzip), sha256 {content_hash[:12]}"
+            )
+        print(f"[{datetime.now()}] ✅ Бэкап отправлен.")
+        return True
+    finally:
+        os.remove(backup_path)
+
 def periodic_backup_task():
     """Создает копию БД и отправляет её в тех. чат каждые 4 часа."""
     time.sleep(60) # Даем боту прогрузиться
     
     while True:
         try:
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            backup_filename = f"backup_{timestamp}_{DB_NAME}"
-            
-            print(f"[{datetime.now()}] 📦 Создание бэкапа...")
-            shutil.copy2(DB_NAME, backup_filename)
-
-            with open(backup_filename, 'rb') as file:
-                bot.send_document(
-                    chat_id=SYS_CHAT_ID, 
-                    document=file,
-                    caption=f"📦 Автоматический бэкап базы данных\n🕒 {timestamp}"
-                )
-            
-            print(f"[{datetime.now()}] ✅ Бэкап отправлен.")
-            os.remove(backup_filename)
-
+            run_backup()
         except Exception as e:
             error_msg = f"⚠️ Ошибка бэкапа: {e}"
             print(error_msg)
@@ -73,27 +269,69 @@ def periodic_backup_task():
 
         time.sleep(BACKUP_INTERVAL)
 
+# --- ОТЛОЖЕННАЯ ЗАПИСЬ ВИЗИТОВ ---
+# Время визита известных пользователей копится в памяти и пишется в БД пачкой
+# раз в LAST_SEEN_FLUSH_INTERVAL секунд (и при остановке бота).
+# Новый пользователь записывается сразу, чтобы first_seen и сама строка в users появились немедленно.
+LAST_SEEN_BUFFER = {}   # user_id -> (username, first_seen, last_seen)
+LAST_SEEN_LOCK = threading.Lock()
+KNOWN_USERS = set()
+
+def load_known_users():
+    """Загружает id уже зарегистрированных пользователей (вызывается при старте)."""
+    KNOWN_USERS.update(get_all_user_ids())
+    print(f"[{datetime.now()}] Загружено {len(KNOWN_USERS)} пользователей.")
+
+def flush_last_seen():
+    """Записывает накопленные визиты одной транзакцией. Возвращает количество записанных строк."""
+    global LAST_SEEN_BUFFER
+    with LAST_SEEN_LOCK:
+        if not LAST_SEEN_BUFFER:
+            return 0
+        pending, LAST_SEEN_BUFFER = LAST_SEEN_BUFFER, {}
+    try:
+        save_last_seen([(uid, username, first, last) for uid, (username, first, last) in pending.items()])
+        return len(pending)
+    except Exception as e:
+        print(f"[{datetime.now()}] Ошибка записи визитов: {e}")
+        # Возвращаем данные в буфер, не затирая более свежие визиты
+        with LAST_SEEN_LOCK:
+            for uid, (username, first, last) in pending.items():
+                if uid in LAST_SEEN_BUFFER:
+                    LAST_SEEN_BUFFER[uid] = (username, first, LAST_SEEN_BUFFER[uid][2])
+                else:
+                    LAST_SEEN_BUFFER[uid] = (username, first, last)
+        return 0
+
+def periodic_last_seen_flush():
+    """Фоновая задача: сбрасывает буфер визитов в БД."""
+    while True:
+        time.sleep(LAST_SEEN_FLUSH_INTERVAL)
+        flush_last_seen()
+
+atexit.register(flush_last_seen)
+
 # --- ДЕКОРАТОРЫ ---
 def update_last_seen(func):
-    """Обновляет время последнего визита пользователя в БД."""
+    """Отмечает визит пользователя (в БД попадает пачкой, см. flush_last_seen)."""
     @wraps(func)
     def wrapper(message_or_call, *args, **kwargs):
         if hasattr(message_or_call, 'from_user'):
             user = message_or_call.from_user
             user_id = user.id
-            username = user.username
             now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
-            try:
-                conn = get_db_connection()
-                # Пытаемся добавить нового или обновить старого
-                conn.execute("INSERT OR IGNORE INTO users (user_id, username, first_seen, last_seen) VALUES (?, ?, ?, ?)",
-                             (user_id, username, now, now))
-                conn.execute("UPDATE users SET last_seen = ? WHERE user_id = ?", (now, user_id))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"Ошибка update_last_seen: {e}")
+            if user_id in KNOWN_USERS:
+                with LAST_SEEN_LOCK:
+                    pending = LAST_SEEN_BUFFER.get(user_id)
+                    first = pending[1] if pending else now
+                    LAST_SEEN_BUFFER[user_id] = (user.username, first, now)
+            else:
+                try:
+                    register_user(user_id, user.username, now)
+                    KNOWN_USERS.add(user_id)
+                except Exception as e:
+                    print(f"Ошибка update_last_seen: {e}")
                 
         return func(message_or_call, *args, **kwargs)
     return wrapper
@@ -124,7 +362,7 @@ def calculate_volume_discount(cart_items_db, all_items):
     
     for item_id, count in cart_items_db.items():
         item = all_items.get(item_id)
-        if item and item.get('Категория') == 'Жидкости':
+        if item and item.category == 'Жидкости':
             liquid_count += count
             
     discount_amount = 0.0
@@ -138,8 +376,7 @@ def update_cart_message(user_id, chat_id, message_id):
     Генерирует текст корзины, считает все скидки (промокоды + объем) 
     и обновляет сообщение в чате.
     """
-    with CACHE_LOCK:
-        all_items = {str(item['id']).strip(): item for item in CATALOG_CACHE}
+    all_items = get_catalog().by_id
     
     cart_items_db = get_cart_items(user_id)
     if not cart_items_db:
@@ -156,10 +393,10 @@ def update_cart_message(user_id, chat_id, message_id):
     for item_id, count in cart_items_db.items():
         if item_id in all_items:
             item = all_items[item_id]
-            price = int(item['Цена']) * count
+            price = item.price * count
             total_price += price
             
-            cart_text += f"• {escape_markdown(item['Название'])} ({escape_markdown(item['Описание'])}) x{count} \\- {price} zl\n"
+            cart_text += f"• {escape_markdown(item.name)} ({escape_markdown(item.description)}) x{count} \\- {price} zl\n"
             
             # Кнопки управления количеством
             keyboard_cart.add(
@@ -0,0 +1,181 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+
+from loader import bot
+from config import (
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_TIMEOUT
+)
+
+# ==========================================
+#        ПРИЕМ ОБНОВЛЕНИЙ ЧЕРЕЗ WEBHOOK (python main.py --webhook)
+# ==========================================
+# HTTP-сервер только принимает POST от Telegram и кладет обновление в очередь - ответ
+# уходит сразу, без ожидания обработки. Обработку ведут WEBHOOK_WORKERS потоков.
+# - У каждого потока своя очередь; обновления одного пользователя всегда попадают
+#   в одну и ту же, поэтому обрабатываются по порядку (важно для пошаговых диалогов).
+# - Очереди ограничены (WEBHOOK_QUEUE_SIZE на всех): если очередь полна, отвечаем 503,
+#   и Telegram повторит доставку позже - память не растет при пиковой нагрузке.
+# - Остановка: сервер перестает принимать запросы, очереди дорабатываются
+#   (не дольше WEBHOOK_DRAIN_TIMEOUT секунд).
+# Счетчики, глубина очередей и задержки (p50/p99) - в статусе админки и по GET /metrics с localhost.
+# Локальная проверка: curl -X POST localhost:8080/webhook -d '{"update_id": 1, "message": {...}}'
+
+_STOP = object()
+_shards = []
+_workers = []
+_server = None
+
+WEBHOOK_STATS = {'received': 0, 'rejected': 0, 'bad_requests': 0, 'processed': 0, 'errors': 0, 'max_depth': 0}
+_LATENCIES = deque(maxlen=2000)     # мс от приема запроса до конца обработки, последние обновления
+_STATS_LOCK = threading.Lock()
+
+def _count(key, value=1):
+    with _STATS_LOCK:
+        WEBHOOK_STATS[key] += value
+
+def _shard_key(payload):
+    """Пользователь, от которого пришло обновление (message.from, callback_query.from ...), иначе update_id."""
+    for value in payload.values():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from'].get('id', 0)
+    return payload.get('update_id', 0)
+
+def enqueue_update(payload):
+    """Ставит обновление в очередь его пользователя. False - очередь полна."""
+    shard = _shards[hash(_shard_key(payload)) % len(_shards)]
+    try:
+        shard.put_nowait((payload, time.monotonic()))
+    except queue.Full:
+        _count('rejected')
+        return False
+    with _STATS_LOCK:
+        WEBHOOK_STATS['received'] += 1
+        WEBHOOK_STATS['max_depth'] = max(WEBHOOK_STATS['max_depth'], shard.qsize())
+    return True
+
+def _worker(shard):
+    while True:
+        item = shard.get()
+        if item is _STOP:
+            return
+        payload, received = item
+        try:
+            bot.process_new_updates([telebot.types.Update.de_json(payload)])
+            _count('processed')
+        except Exception as e:
+            _count('errors')
+            print(f"[{datetime.now()}] Webhook: ошибка обработки обновления {payload.get('update_id')}: {e}")
+        with _STATS_LOCK:
+            _LATENCIES.append((time.monotonic() - received) * 1000)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def _reply(self, code, body=b'', headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != WEBHOOK_PATH:
+            return self._reply(404)
+        if WEBHOOK_SECRET and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return self._reply(403)
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(payload, dict) or 'update_id' not in payload:
+                raise ValueError("нет update_id")
+        except ValueError:
+            _count('bad_requests')
+            return self._reply(400)
+        if not enqueue_update(payload):
+            # Перегрузка: Telegram повторит доставку
+            return self._reply(503, headers={'Retry-After': '1'})
+        self._reply(200)
+
+    def do_GET(self):
+        if self.path == '/metrics' and self.client_address[0] in ('127.0.0.1', '::1'):
+            return self._reply(200, format_webhook_stats().encode('utf-8'),
+                               {'Content-Type': 'text/plain; charset=utf-8'})
+        self._reply(404)
+
+    def log_message(self, format, *args):
+        # Не печатаем строку на каждый запрос
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128    # Очередь соединений ОС: Telegram открывает до max_connections одновременно
+
+
+def _percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+def format_webhook_stats():
+    """Текст сводки по webhook: счетчики, глубина очередей, задержки."""
+    if not _shards:
+        return "Webhook не используется (режим long polling)."
+    with _STATS_LOCK:
+        stats = dict(WEBHOOK_STATS)
+        latencies = sorted(_LATENCIES)
+    depth = sum(shard.qsize() for shard in _shards)
+    capacity = sum(shard.maxsize for shard in _shards)
+    return (f"Webhook: принято {stats['received']}, обработано {stats['processed']}, ошибок {stats['errors']}, "
+            f"отклонено при перегрузке {stats['rejected']}, некорректных {stats['bad_requests']}\n"
+            f"Очередь: {depth}/{capacity} (макс. в одной очереди {stats['max_depth']}), потоков {len(_workers)}\n"
+            f"Задержка обработки: p50 {_percentile(latencies, 0.5):.0f} мс, p99 {_percentile(latencies, 0.99):.0f} мс")
+
+def start_webhook(workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, port=WEBHOOK_PORT):
+    """Запускает потоки-обработчики и HTTP-сервер (в фоне). Возвращает сервер."""
+    global _server
+    # Обработчики выполняются в наших потоках, а не в пуле telebot
+    bot.threaded = False
+    per_shard = max(1, queue_size // workers)
+    for i in range(workers):
+        shard = queue.Queue(maxsize=per_shard)
+        worker = threading.Thread(target=_worker, args=(shard,), name=f"webhook-{i}", daemon=True)
+        _shards.append(shard)
+        _workers.append(worker)
+        worker.start()
+
+    _server = WebhookServer((WEBHOOK_LISTEN, port), WebhookHandler)
+    threading.Thread(target=_server.serve_forever, name="webhook-http", daemon=True).start()
+
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                        max_connections=min(100, max(1, workers * 5)))
+        print(f"--- 🌐 Webhook зарегистрирован в Telegram: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH} ---")
+    print(f"--- 🌐 Webhook слушает {WEBHOOK_LISTEN}:{port}{WEBHOOK_PATH}, потоков {workers}, очередь {per_shard * workers} ---")
+    return _server
+
+def stop_webhook(timeout=WEBHOOK_DRAIN_TIMEOUT):
+    """Перестает принимать обновления и дорабатывает очереди. Возвращает число необработанных."""
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+    deadline = time.monotonic() + timeout
+    for shard in _shards:
+        # Маркер остановки встает за уже принятыми обновлениями
+        try:
+            shard.put(_STOP, timeout=max(0.1, deadline - time.monotonic()))
+        except queue.Full:
+            pass
+    for worker in _workers:
+        worker.join(max(0.0, deadline - time.monotonic()))
+    left = sum(max(0, shard.qsize() - 1) for shard, worker in zip(_shards, _workers) if worker.is_alive())
+    print(f"--- 🛑 Webhook остановлен: {format_webhook_stats()} ---")
+    if left:
+        print(f"--- ⚠️ Не успели обработать {left} обновлений за {timeout} сек. ---")
+    return left